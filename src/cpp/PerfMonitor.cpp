@@ -25,6 +25,8 @@
 #include <fstream>
 #include <streambuf>
 #include <sstream>
+#include <string.h>
+#include <vector>
 
 #include "PerfMonitor.hpp"
 
@@ -32,6 +34,10 @@ PerfMonitor::PerfMonitor(unsigned int indicationId, unsigned int requestId) :
         PerfMonitorIndicationWrapper(indicationId) {
     performanceRequest = new PerfMonitorRequestProxy(requestId);
     sem_init(&respSem, 0, 0);
+    pthread_mutex_init(&respLock, NULL);
+    respBuf = NULL;
+    respSize = 0;
+    respCount = 0;
 }
 
 void PerfMonitor::printPerformance(std::string filename) {
@@ -56,19 +62,113 @@ void PerfMonitor::printPerformance(std::string filename) {
     }
 }
 
+// Reads a map compiled by perfmon_compile.py. The counters are stored in
+// groups that share a submodule path, and responses within a group come back
+// in request order, so each group is read with a single batch of requests.
+void PerfMonitor::printPerformanceCompiled(std::string filename) {
+    std::ifstream file(filename, std::ios::binary);
+    std::vector<char> data((std::istreambuf_iterator<char>(file)), std::istreambuf_iterator<char>());
+
+    // header: magic, version, PerfSubIndexSz, PerfLevels, #entries, #groups, #string bytes
+    const size_t headerSize = 20;
+    if (data.size() < headerSize || memcmp(data.data(), "PMAP", 4) != 0 || (uint8_t) data[4] != 1 || data[5] != 0) {
+        std::cerr << "ERROR: " << filename << " is not a compiled perfmon map" << std::endl;
+        return;
+    }
+    uint32_t numEntries, numGroups, stringsSize;
+    memcpy(&numEntries, &data[8], 4);
+    memcpy(&numGroups, &data[12], 4);
+    memcpy(&stringsSize, &data[16], 4);
+    if (data.size() != headerSize + 12 * ((size_t) numEntries + numGroups) + stringsSize) {
+        std::cerr << "ERROR: " << filename << " is truncated" << std::endl;
+        return;
+    }
+    const char *entries = &data[headerSize];
+    const char *groups = entries + 12 * numEntries;
+    const char *strings = groups + 12 * numGroups;
+
+    // check every offset before using any of them, the last string has to
+    // be NUL terminated too
+    bool valid = stringsSize == 0 || strings[stringsSize - 1] == '\0';
+    for (uint32_t i = 0 ; valid && i < numEntries ; i++) {
+        uint32_t name;
+        memcpy(&name, entries + 12 * i + 4, 4);
+        valid = name < stringsSize;
+    }
+    for (uint32_t g = 0 ; valid && g < numGroups ; g++) {
+        uint32_t first, count;
+        memcpy(&first, groups + 12 * g, 4);
+        memcpy(&count, groups + 12 * g + 4, 4);
+        valid = first <= numEntries && count <= numEntries - first;
+    }
+    if (!valid) {
+        std::cerr << "ERROR: " << filename << " is corrupt" << std::endl;
+        return;
+    }
+
+    std::vector<uint32_t> indices(numEntries);
+    std::vector<uint64_t> values(numEntries);
+    for (uint32_t i = 0 ; i < numEntries ; i++) {
+        memcpy(&indices[i], entries + 12 * i, 4);
+    }
+    for (uint32_t g = 0 ; g < numGroups ; g++) {
+        uint32_t first, count;
+        memcpy(&first, groups + 12 * g, 4);
+        memcpy(&count, groups + 12 * g + 4, 4);
+        if (count > 0) {
+            readMonitorBatch(&indices[first], &values[first], count);
+        }
+    }
+    for (uint32_t i = 0 ; i < numEntries ; i++) {
+        uint32_t name;
+        memcpy(&name, entries + 12 * i + 4, 4);
+        std::cout << strings + name << " = " << values[i] << std::endl;
+    }
+}
+
 void PerfMonitor::setEnable(const int x) {
     performanceRequest->setEnable(x);
 }
 
 uint64_t PerfMonitor::readMonitor(const uint32_t index) {
-    performanceRequest->req((uint64_t) index);
-    // set semaphore
-    sem_wait(&respSem);
-    uint64_t resp = prevResp;
+    uint64_t resp;
+    readMonitorBatch(&index, &resp, 1);
     return resp;
 }
 
+// Only use this for indices whose responses come back in order, i.e.
+// counters behind the same submodule path.
+void PerfMonitor::readMonitorBatch(const uint32_t *indices, uint64_t *values, size_t n) {
+    pthread_mutex_lock(&respLock);
+    respBuf = values;
+    respSize = n;
+    respCount = 0;
+    pthread_mutex_unlock(&respLock);
+    for (size_t i = 0 ; i < n ; i++) {
+        performanceRequest->req((uint64_t) indices[i]);
+    }
+    for (size_t i = 0 ; i < n ; i++) {
+        sem_wait(&respSem);
+    }
+    pthread_mutex_lock(&respLock);
+    respBuf = NULL;
+    respSize = 0;
+    pthread_mutex_unlock(&respLock);
+}
+
+// Responses that arrive while no batch is waiting for them, or after the
+// batch got all of its responses, are dropped. Posting respSem for them would
+// let the next batch finish before its own responses arrive.
 void PerfMonitor::resp(const uint64_t x) {
-    prevResp = x;
-    sem_post(&respSem);
+    pthread_mutex_lock(&respLock);
+    bool expected = respBuf != NULL && respCount < respSize;
+    if (expected) {
+        respBuf[respCount++] = x;
+    }
+    pthread_mutex_unlock(&respLock);
+    if (expected) {
+        sem_post(&respSem);
+    } else {
+        std::cerr << "WARNING: dropping unexpected PerfMonitor response " << x << std::endl;
+    }
 }
@@ -24,7 +24,10 @@
 #ifndef PERFORMANCE_HPP
 #define PERFORMANCE_HPP
 
+#include <pthread.h>
 #include <semaphore.h>
+#include <stddef.h>
+#include <stdint.h>
 #include <string>
 #include "PerfMonitorIndication.h"
 #include "PerfMonitorRequest.h"
@@ -37,8 +40,10 @@ class PerfMonitor : public PerfMonitorIndicationWrapper {
 
         // these are called by the main thread
         void printPerformance(std::string filename);
+        void printPerformanceCompiled(std::string filename);
         void setEnable(const int x);
         uint64_t readMonitor(const uint32_t index);
+        void readMonitorBatch(const uint32_t *indices, uint64_t *values, size_t n);
 
         // theses are called by the PerformanceIndication thread
         void resp(const uint64_t x);
@@ -46,9 +51,13 @@ class PerfMonitor : public PerfMonitorIndicationWrapper {
     private:
         PerfMonitorRequestProxy *performanceRequest;
 
-        // used by both threads
+        // used by both threads, respLock protects respBuf, respSize and
+        // respCount
         sem_t respSem;
-        uint64_t prevResp;
+        pthread_mutex_t respLock;
+        uint64_t *respBuf;
+        size_t respSize;
+        size_t respCount;
 
         bool verbose;
 };
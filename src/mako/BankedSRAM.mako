@@ -0,0 +1,149 @@
+
+// Copyright (c) 2019 Massachusetts Institute of Technology
+
+// Permission is hereby granted, free of charge, to any person
+// obtaining a copy of this software and associated documentation
+// files (the "Software"), to deal in the Software without
+// restriction, including without limitation the rights to use, copy,
+// modify, merge, publish, distribute, sublicense, and/or sell copies
+// of the Software, and to permit persons to whom the Software is
+// furnished to do so, subject to the following conditions:
+
+// The above copyright notice and this permission notice shall be
+// included in all copies or substantial portions of the Software.
+
+// THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+// EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+// MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+// NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+// BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+// ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+// CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+// SOFTWARE.
+
+<%
+    # This template expects num_banks, num_read_ports, num_write_ports, and
+    # byte_en
+    module_name = 'SRAM_B%d_%dR%dW' % (num_banks, num_read_ports, num_write_ports)
+    if byte_en:
+        module_name += '_BE'
+    log_banks = num_banks.bit_length() - 1
+    data_sz = '(DATA_SZ_BYTES*8)' if byte_en else 'DATA_SZ'
+    ports = [('read', i) for i in range(num_read_ports)] + [('write', i) for i in range(num_write_ports)]
+%>
+// ${num_banks} bank SRAM with ${num_read_ports} read port${'s' if num_read_ports != 1 else ''} and ${num_write_ports} write port${'s' if num_write_ports != 1 else ''}${' with byte enables' if byte_en else ''}
+//
+// Addresses are interleaved across the banks: the low ${log_banks} address bits
+// select the bank. Each bank serves one read and one write per cycle. If
+// several ports access the same bank in the same cycle, the lowest numbered
+// port wins and the other requests are dropped. read_conflict_i and
+// write_conflict_i are set in the cycle after a dropped request, along with
+// read_data_i for reads. A concurrent read and write to the same address
+// returns the old data.
+module ${module_name} (
+    input clk,
+% for i in range(num_read_ports):
+    input read_en_${i},
+    input [ADDR_SZ-1:0] read_addr_${i},
+    output [${data_sz}-1:0] read_data_${i},
+    output read_conflict_${i},
+% endfor
+% for i in range(num_write_ports):
+    input write_en_${i},
+ % if byte_en:
+    input [DATA_SZ_BYTES-1:0] write_bytes_${i},
+ % endif
+    input [ADDR_SZ-1:0] write_addr_${i},
+    input [${data_sz}-1:0] write_data_${i},
+    output write_conflict_${i}${',' if i != num_write_ports-1 else ''}
+% endfor
+);
+
+    parameter ADDR_SZ = 9;
+% if byte_en:
+    parameter DATA_SZ_BYTES = 8;
+% else:
+    parameter DATA_SZ = 64;
+% endif
+    parameter MEM_SZ = 512;
+
+    localparam LOG_BANKS = ${log_banks};
+    localparam BANK_MEM_SZ = MEM_SZ / ${num_banks};
+
+% for (kind, i) in ports:
+    reg                  ${kind}_conflict_reg_${i};
+% endfor
+% for i in range(num_read_ports):
+    reg  [LOG_BANKS-1:0] read_bank_reg_${i};
+% endfor
+
+% for b in range(num_banks):
+    // bank ${b}
+    reg [${data_sz}-1:0] ram_block_${b} [BANK_MEM_SZ-1:0];
+    reg [${data_sz}-1:0] read_data_reg_${b};
+
+ % for (kind, i) in ports:
+    wire ${kind}_req_${i}_${b} = ${kind}_en_${i} && (${kind}_addr_${i}[LOG_BANKS-1:0] == ${b});
+ % endfor
+ % for (kind, i) in ports:
+  % if i == 0:
+    wire ${kind}_grant_${i}_${b} = ${kind}_req_${i}_${b};
+  % else:
+    wire ${kind}_grant_${i}_${b} = ${kind}_req_${i}_${b} && !(${' || '.join('%s_req_%d_%d' % (kind, j, b) for j in range(i))});
+  % endif
+ % endfor
+ % for (kind, n) in (('read', num_read_ports), ('write', num_write_ports)):
+    wire bank_${kind}_en_${b} = ${' || '.join('%s_req_%d_%d' % (kind, i, b) for i in range(n))};
+    wire [ADDR_SZ-1:0] bank_${kind}_addr_${b} = ${''.join('%s_req_%d_%d ? %s_addr_%d : ' % (kind, i, b, kind, i) for i in range(n-1))}${kind}_addr_${n-1};
+ % endfor
+    wire [${data_sz}-1:0] bank_write_data_${b} = ${''.join('write_req_%d_%d ? write_data_%d : ' % (i, b, i) for i in range(num_write_ports-1))}write_data_${num_write_ports-1};
+ % if byte_en:
+    wire [DATA_SZ_BYTES-1:0] bank_write_bytes_${b} = ${''.join('write_req_%d_%d ? write_bytes_%d : ' % (i, b, i) for i in range(num_write_ports-1))}write_bytes_${num_write_ports-1};
+
+    generate
+        genvar i_${b};
+        for (i_${b} = 0 ; i_${b} < DATA_SZ_BYTES ; i_${b} = i_${b}+1) begin
+            always @ (posedge clk) begin
+                if (bank_write_en_${b} == 1) begin
+                    if (bank_write_bytes_${b}[i_${b}] == 1) begin
+                        ram_block_${b}[bank_write_addr_${b}[ADDR_SZ-1:LOG_BANKS]][(i_${b}+1)*8-1:i_${b}*8] <= bank_write_data_${b}[(i_${b}+1)*8-1:i_${b}*8];
+                    end
+                end
+                if (bank_read_en_${b} == 1) begin
+                    read_data_reg_${b}[(i_${b}+1)*8-1:i_${b}*8] <= ram_block_${b}[bank_read_addr_${b}[ADDR_SZ-1:LOG_BANKS]][(i_${b}+1)*8-1:i_${b}*8];
+                end
+            end
+        end
+    endgenerate
+ % else:
+
+    always @ (posedge clk) begin
+        if (bank_write_en_${b} == 1) begin
+            ram_block_${b}[bank_write_addr_${b}[ADDR_SZ-1:LOG_BANKS]] <= bank_write_data_${b};
+        end
+        if (bank_read_en_${b} == 1) begin
+            read_data_reg_${b} <= ram_block_${b}[bank_read_addr_${b}[ADDR_SZ-1:LOG_BANKS]];
+        end
+    end
+ % endif
+
+% endfor
+    // ports
+    always @ (posedge clk) begin
+% for i in range(num_read_ports):
+        if (read_en_${i} == 1) begin
+            read_bank_reg_${i} <= read_addr_${i}[LOG_BANKS-1:0];
+        end
+% endfor
+% for (kind, i) in ports:
+        ${kind}_conflict_reg_${i} <= ${kind}_en_${i} && !(${' || '.join('%s_grant_%d_%d' % (kind, i, b) for b in range(num_banks))});
+% endfor
+    end
+
+% for i in range(num_read_ports):
+    assign read_data_${i} = ${''.join('(read_bank_reg_%d == %d) ? read_data_reg_%d : ' % (i, b, b) for b in range(num_banks-1))}read_data_reg_${num_banks-1};
+% endfor
+% for (kind, i) in ports:
+    assign ${kind}_conflict_${i} = ${kind}_conflict_reg_${i};
+% endfor
+endmodule
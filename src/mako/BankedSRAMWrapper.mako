@@ -0,0 +1,283 @@
+
+// Copyright (c) 2019 Massachusetts Institute of Technology
+//
+// Permission is hereby granted, free of charge, to any person
+// obtaining a copy of this software and associated documentation
+// files (the "Software"), to deal in the Software without
+// restriction, including without limitation the rights to use, copy,
+// modify, merge, publish, distribute, sublicense, and/or sell copies
+// of the Software, and to permit persons to whom the Software is
+// furnished to do so, subject to the following conditions:
+//
+// The above copyright notice and this permission notice shall be
+// included in all copies or substantial portions of the Software.
+//
+// THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+// EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+// MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+// NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+// BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+// ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+// CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+// SOFTWARE.
+
+import List::*;
+import RegFile::*;
+import Vector::*;
+
+// Ports of a banked SRAM. Each bank serves one read and one write per cycle.
+// If several ports access the same bank in the same cycle, the lowest
+// numbered port wins and the other requests are dropped. conflict is True in
+// the cycle after a dropped request (along with data for read ports), so the
+// request can be retried.
+interface SRAMCoreBankedReadPort#(type addrT, type dataT);
+    (* always_ready *)
+    method Action req(addrT addr);
+    (* always_ready *)
+    method dataT data;
+    (* always_ready *)
+    method Bool conflict;
+endinterface
+
+// byte_en is ignored (and byteEnSz is 0) for SRAMs without byte enables
+interface SRAMCoreBankedWritePort#(type addrT, type dataT, numeric type byteEnSz);
+    (* always_ready *)
+    method Action req(Bit#(byteEnSz) byte_en, addrT addr, dataT data);
+    (* always_ready *)
+    method Bool conflict;
+endinterface
+
+interface SRAMCoreBanked#(numeric type numReadPorts, numeric type numWritePorts, type addrT, type dataT, numeric type byteEnSz);
+    interface Vector#(numReadPorts, SRAMCoreBankedReadPort#(addrT, dataT)) read;
+    interface Vector#(numWritePorts, SRAMCoreBankedWritePort#(addrT, dataT, byteEnSz)) write;
+endinterface
+
+// Simulation model of an SRAMCoreBanked with numBanks address-interleaved
+// banks. It has the same bank conflict behavior as the generated Verilog.
+module mkSRAMCoreBanked_RegFileModel#(Integer numBanks)(SRAMCoreBanked#(numReadPorts, numWritePorts, addrT, dataT, byteEnSz))
+        provisos(
+            Bits#(addrT, addrSz),
+            Bits#(dataT, dataSz)
+        );
+    Integer bankMemSz = valueOf(TExp#(addrSz)) / numBanks;
+    Bit#(addrSz) bankMask = fromInteger(numBanks - 1);
+    Integer logBanks = log2(numBanks);
+
+    Vector#(numReadPorts, RWire#(addrT)) readReqs <- replicateM(mkRWire);
+    Vector#(numWritePorts, RWire#(Tuple3#(Bit#(byteEnSz), addrT, dataT))) writeReqs <- replicateM(mkRWire);
+    Vector#(numReadPorts, Reg#(dataT)) readData <- replicateM(mkRegU);
+    Vector#(numReadPorts, Reg#(Bool)) readConflicts <- replicateM(mkReg(False));
+    Vector#(numWritePorts, Reg#(Bool)) writeConflicts <- replicateM(mkReg(False));
+
+    List#(RegFile#(Bit#(addrSz), dataT)) banks = Nil;
+    for (Integer b = 0 ; b < numBanks ; b = b+1) begin
+        let bank <- mkRegFile(0, fromInteger(bankMemSz - 1));
+        banks = List::cons(bank, banks);
+    end
+    banks = List::reverse(banks);
+
+    function Bit#(addrSz) bankOf(addrT addr) = pack(addr) & bankMask;
+    function Bit#(addrSz) indexOf(addrT addr) = pack(addr) >> logBanks;
+
+    // a request is dropped if a lower numbered port of the same kind
+    // accesses the same bank
+    function Bool readDropped(Integer i);
+        Bool dropped = False;
+        if (readReqs[i].wget matches tagged Valid .addr) begin
+            for (Integer j = 0 ; j < i ; j = j+1) begin
+                if (readReqs[j].wget matches tagged Valid .other &&& bankOf(other) == bankOf(addr)) begin
+                    dropped = True;
+                end
+            end
+        end
+        return dropped;
+    endfunction
+    function Bool writeDropped(Integer i);
+        Bool dropped = False;
+        if (writeReqs[i].wget matches tagged Valid {.byte_en, .addr, .data}) begin
+            for (Integer j = 0 ; j < i ; j = j+1) begin
+                if (writeReqs[j].wget matches tagged Valid {.other_byte_en, .other, .other_data} &&& bankOf(other) == bankOf(addr)) begin
+                    dropped = True;
+                end
+            end
+        end
+        return dropped;
+    endfunction
+
+    (* fire_when_enabled, no_implicit_conditions *)
+    rule doAccess;
+        for (Integer i = 0 ; i < valueOf(numReadPorts) ; i = i+1) begin
+            if (readReqs[i].wget matches tagged Valid .addr) begin
+                readConflicts[i] <= readDropped(i);
+                for (Integer b = 0 ; b < numBanks ; b = b+1) begin
+                    if (bankOf(addr) == fromInteger(b)) begin
+                        readData[i] <= banks[b].sub(indexOf(addr));
+                    end
+                end
+            end else begin
+                readConflicts[i] <= False;
+            end
+        end
+        for (Integer i = 0 ; i < valueOf(numWritePorts) ; i = i+1) begin
+            writeConflicts[i] <= writeDropped(i);
+        end
+        // each bank takes the first write port that is not dropped
+        for (Integer b = 0 ; b < numBanks ; b = b+1) begin
+            Maybe#(Tuple3#(Bit#(byteEnSz), addrT, dataT)) bankWrite = tagged Invalid;
+            for (Integer i = valueOf(numWritePorts) - 1 ; i >= 0 ; i = i-1) begin
+                if (writeReqs[i].wget matches tagged Valid {.byte_en, .addr, .data} &&& bankOf(addr) == fromInteger(b)) begin
+                    bankWrite = writeReqs[i].wget;
+                end
+            end
+            if (bankWrite matches tagged Valid {.byte_en, .addr, .data}) begin
+                Bit#(dataSz) mask = '1;
+                if (valueOf(byteEnSz) > 0) begin
+                    for (Integer j = 0 ; j < valueOf(dataSz) ; j = j+1) begin
+                        mask[j] = byte_en[j / 8];
+                    end
+                end
+                Bit#(dataSz) oldData = pack(banks[b].sub(indexOf(addr)));
+                banks[b].upd(indexOf(addr), unpack((pack(data) & mask) | (oldData & ~mask)));
+            end
+        end
+    endrule
+
+    function SRAMCoreBankedReadPort#(addrT, dataT) mkReadPort(Integer i);
+        return (interface SRAMCoreBankedReadPort;
+                    method Action req(addrT addr);
+                        readReqs[i].wset(addr);
+                    endmethod
+                    method dataT data = readData[i];
+                    method Bool conflict = readConflicts[i];
+                endinterface);
+    endfunction
+    function SRAMCoreBankedWritePort#(addrT, dataT, byteEnSz) mkWritePort(Integer i);
+        return (interface SRAMCoreBankedWritePort;
+                    method Action req(Bit#(byteEnSz) byte_en, addrT addr, dataT data);
+                        writeReqs[i].wset(tuple3(byte_en, addr, data));
+                    endmethod
+                    method Bool conflict = writeConflicts[i];
+                endinterface);
+    endfunction
+
+    interface read = genWith(mkReadPort);
+    interface write = genWith(mkWritePort);
+endmodule
+
+% for (num_banks, num_read_ports, num_write_ports, byte_en) in configs:
+<%
+    name = 'SRAM_B%d_%dR%dW' % (num_banks, num_read_ports, num_write_ports) + ('_BE' if byte_en else '')
+    ports = [('read', i) for i in range(num_read_ports)] + [('write', i) for i in range(num_write_ports)]
+    value_methods = ['readData_%d' % i for i in range(num_read_ports)] + ['%sConflict_%d' % (kind, i) for (kind, i) in ports]
+    read_reqs = ['readReq_%d' % i for i in range(num_read_ports)]
+    write_reqs = ['writeReq_%d' % i for i in range(num_write_ports)]
+%>\
+////////////////////////////////////////////////////////////////////////////////
+
+(* always_ready *)
+interface ${name}_Raw#(numeric type addrSz, numeric type dataSz);
+ % for i in range(num_read_ports):
+    method Action readReq_${i}(Bit#(addrSz) addr);
+    method Bit#(dataSz) readData_${i};
+    method Bool readConflict_${i};
+ % endfor
+ % for i in range(num_write_ports):
+  % if byte_en:
+    method Action writeReq_${i}(Bit#(TDiv#(dataSz, 8)) byte_en, Bit#(addrSz) addr, Bit#(dataSz) data);
+  % else:
+    method Action writeReq_${i}(Bit#(addrSz) addr, Bit#(dataSz) data);
+  % endif
+    method Bool writeConflict_${i};
+ % endfor
+endinterface
+
+import "BVI" ${name} =
+module mk${name}_Raw(${name}_Raw#(addrSz, dataSz));
+    parameter ADDR_SZ = valueOf(addrSz);
+ % if byte_en:
+    parameter DATA_SZ_BYTES = valueOf(TDiv#(dataSz, 8));
+ % else:
+    parameter DATA_SZ = valueOf(dataSz);
+ % endif
+    parameter MEM_SZ = valueOf(TExp#(addrSz));
+
+    default_clock clk(clk);
+    default_reset no_reset;
+
+ % for i in range(num_read_ports):
+    method readReq_${i}(read_addr_${i}) enable (read_en_${i});
+    method read_data_${i} readData_${i}();
+    method read_conflict_${i} readConflict_${i}();
+ % endfor
+ % for i in range(num_write_ports):
+  % if byte_en:
+    method writeReq_${i}(write_bytes_${i}, write_addr_${i}, write_data_${i}) enable (write_en_${i});
+  % else:
+    method writeReq_${i}(write_addr_${i}, write_data_${i}) enable (write_en_${i});
+  % endif
+    method write_conflict_${i} writeConflict_${i}();
+ % endfor
+
+    schedule (${', '.join(value_methods)}) CF (${', '.join(value_methods)});
+    schedule (${', '.join(value_methods)}) SB (${', '.join(read_reqs + write_reqs)});
+    schedule (${', '.join(read_reqs)}) SB (${', '.join(write_reqs)});
+ % for reqs in (read_reqs, write_reqs):
+  % for (i, req) in enumerate(reqs):
+    schedule (${req}) C (${req});
+   % if i+1 < len(reqs):
+    schedule (${req}) CF (${', '.join(reqs[i+1:])});
+   % endif
+  % endfor
+ % endfor
+endmodule
+
+ % if byte_en:
+module mkSRAMCoreBanked_B${num_banks}_${num_read_ports}R${num_write_ports}W_BE(SRAMCoreBanked#(${num_read_ports}, ${num_write_ports}, Bit#(addrSz), Bit#(dataSz), TDiv#(dataSz, 8)));
+    ${name}_Raw#(addrSz, dataSz) sram <- mk${name}_Raw;
+ % else:
+module mkSRAMCoreBanked_B${num_banks}_${num_read_ports}R${num_write_ports}W(SRAMCoreBanked#(${num_read_ports}, ${num_write_ports}, addrT, dataT, 0)) provisos (Bits#(addrT, addrSz), Bits#(dataT, dataSz));
+    ${name}_Raw#(addrSz, dataSz) sram <- mk${name}_Raw;
+ % endif
+<%
+    addr_t = 'Bit#(addrSz)' if byte_en else 'addrT'
+    data_t = 'Bit#(dataSz)' if byte_en else 'dataT'
+%>\
+
+    Vector#(${num_read_ports}, SRAMCoreBankedReadPort#(${addr_t}, ${data_t})) readPorts = newVector;
+    Vector#(${num_write_ports}, SRAMCoreBankedWritePort#(${addr_t}, ${data_t}, ${'TDiv#(dataSz, 8)' if byte_en else '0'})) writePorts = newVector;
+
+ % for i in range(num_read_ports):
+    readPorts[${i}] =
+        (interface SRAMCoreBankedReadPort;
+            method Action req(${addr_t} addr);
+                sram.readReq_${i}(pack(addr));
+            endmethod
+            method ${data_t} data;
+                return unpack(sram.readData_${i});
+            endmethod
+            method Bool conflict;
+                return sram.readConflict_${i};
+            endmethod
+        endinterface);
+ % endfor
+ % for i in range(num_write_ports):
+    writePorts[${i}] =
+        (interface SRAMCoreBankedWritePort;
+            method Action req(Bit#(${'TDiv#(dataSz, 8)' if byte_en else '0'}) byte_en, ${addr_t} addr, ${data_t} data);
+  % if byte_en:
+                sram.writeReq_${i}(byte_en, addr, data);
+  % else:
+                sram.writeReq_${i}(pack(addr), pack(data));
+  % endif
+            endmethod
+            method Bool conflict;
+                return sram.writeConflict_${i};
+            endmethod
+        endinterface);
+ % endfor
+
+    interface read = readPorts;
+    interface write = writePorts;
+endmodule
+
+% endfor
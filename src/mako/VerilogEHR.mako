@@ -22,11 +22,44 @@
 // SOFTWARE.
 
 <%
-    # This template expects num_ports and has_reset
+    # This template expects num_ports and has_reset, and optionally style
     module_name = 'EHR'
     if not has_reset:
         module_name += 'U'
     module_name += '_' + str(num_ports)
+    style = context.get('style', 'chain')
+
+    # For the prefix style, wire_i is the last enabled write among
+    # (1, r), (EN_write_0, write_0), ..., (EN_write_{i-1}, write_{i-1}).
+    # Picking the later of two (enable, value) pairs is associative, so all
+    # the wire_i can be computed by a Kogge-Stone prefix network with
+    # ceil(log2(num_ports+1)) levels of muxes instead of a chain of
+    # num_ports muxes.
+    prefix_decls = []
+    prefix_assigns = []
+    if style == 'prefix':
+        nodes = [("1'b1", 'r')] + [('EN_write_%d' % i, 'write_%d' % i) for i in range(num_ports)]
+        level = 0
+        dist = 1
+        while dist <= num_ports:
+            level += 1
+            next_nodes = list(nodes)
+            for k in range(dist, num_ports+1):
+                (en_lo, val_lo) = nodes[k-dist]
+                (en_hi, val_hi) = nodes[k]
+                val = 'val_%d_%d' % (level, k)
+                prefix_decls.append('wire   [DATA_SZ-1:0] %s;' % val)
+                prefix_assigns.append('assign %s = %s ? %s : %s;' % (val, en_hi, val_hi, val_lo))
+                if en_lo == "1'b1":
+                    en = "1'b1"
+                else:
+                    en = 'en_%d_%d' % (level, k)
+                    prefix_decls.append('wire                 %s;' % en)
+                    prefix_assigns.append('assign %s = %s | %s;' % (en, en_hi, en_lo))
+                next_nodes[k] = (en, val)
+            nodes = next_nodes
+            dist *= 2
+        prefix_outputs = [val for (en, val) in nodes]
 %>
 module ${module_name} (
     CLK,
@@ -60,11 +93,26 @@ module ${module_name} (
 % for i in range(num_ports+1):
     wire   [DATA_SZ-1:0] wire_${i};
 % endfor
+% if style == 'prefix':
+% for decl in prefix_decls:
+    ${decl}
+% endfor
+
+    // log-depth priority selection of the last enabled write
+% for assign in prefix_assigns:
+    ${assign}
+% endfor
+
+% for i in range(num_ports+1):
+    assign wire_${i} = ${prefix_outputs[i]};
+% endfor
+% else:
 
     assign wire_0 = r;
 % for i in range(num_ports):
     assign wire_${i+1} = EN_write_${i} ? write_${i} : wire_${i};
 % endfor
+% endif
 
 % for i in range(num_ports):
     assign read_${i} = wire_${i};
@@ -28,7 +28,7 @@ import Vector::*;
 // the given number of ports.
 typedef Array#(Reg#(t)) VerilogEHR#(type t);
 
-% for num_ports in range(1, max_num_ports+1):
+% for num_ports in sorted(set(reset_ports) | set(noreset_ports)):
 (* always_ready *)
 interface VerilogEHR_${num_ports}_Raw#(numeric type dataSz);
  % for i in range(num_ports):
@@ -37,6 +37,7 @@ interface VerilogEHR_${num_ports}_Raw#(numeric type dataSz);
  % endfor
 endinterface
 
+ % if num_ports in reset_ports:
 import "BVI" EHR_${num_ports} =
 module mkVerilogEHR_${num_ports}_Raw#(Bit#(dataSz) init)(VerilogEHR_${num_ports}_Raw#(dataSz));
     parameter DATA_SZ = valueOf(dataSz);
@@ -73,6 +74,8 @@ module mkVerilogEHR_${num_ports}_Raw#(Bit#(dataSz) init)(VerilogEHR_${num_ports}
  % endfor
 endmodule
 
+ % endif
+ % if num_ports in noreset_ports:
 import "BVI" EHRU_${num_ports} =
 module mkVerilogEHRU_${num_ports}_Raw(VerilogEHR_${num_ports}_Raw#(dataSz));
     parameter DATA_SZ = valueOf(dataSz);
@@ -108,6 +111,8 @@ module mkVerilogEHRU_${num_ports}_Raw(VerilogEHR_${num_ports}_Raw#(dataSz));
  % endfor
 endmodule
 
+ % endif
+ % if num_ports in reset_ports:
 module mkVerilogEHR_${num_ports}#(dataT init)(VerilogEHR#(dataT)) provisos (Bits#(dataT, dataSz));
     VerilogEHR_${num_ports}_Raw#(dataSz) ehr_raw <- mkVerilogEHR_${num_ports}_Raw(pack(init));
     Reg#(dataT) ehr_ifc[${num_ports}];
@@ -127,6 +132,8 @@ module mkVerilogEHR_${num_ports}#(dataT init)(VerilogEHR#(dataT)) provisos (Bits
     return ehr_ifc;
 endmodule
 
+ % endif
+ % if num_ports in noreset_ports:
 module mkVerilogEHRU_${num_ports}(VerilogEHR#(dataT)) provisos (Bits#(dataT, dataSz));
     VerilogEHR_${num_ports}_Raw#(dataSz) ehr_raw <- mkVerilogEHRU_${num_ports}_Raw;
     Reg#(dataT) ehr_ifc[${num_ports}];
@@ -146,29 +153,38 @@ module mkVerilogEHRU_${num_ports}(VerilogEHR#(dataT)) provisos (Bits#(dataT, dat
     return ehr_ifc;
 endmodule
 
+ % endif
 % endfor
 
 module mkVerilogEHR#(Integer num_ports, dataT init)(VerilogEHR#(dataT)) provisos (Bits#(dataT, dataSz));
     Reg#(dataT) _ifc[num_ports];
-% for i in range(1,max_num_ports+1):
+% for i in sorted(reset_ports):
     if (num_ports == ${i}) begin
         _ifc <- mkVerilogEHR_${i}(init);
     end else
 % endfor
     begin
+% if sorted(reset_ports) == list(range(1, len(reset_ports)+1)):
         errorM("num_ports is too large for mkVerilogEHR");
+% else:
+        errorM("mkVerilogEHR was only generated for num_ports in ${', '.join(str(i) for i in sorted(reset_ports))}");
+% endif
     end
     return _ifc;
 endmodule
 module mkVerilogEHRU#(Integer num_ports)(VerilogEHR#(dataT)) provisos (Bits#(dataT, dataSz));
     Reg#(dataT) _ifc[num_ports];
-% for i in range(1,max_num_ports+1):
+% for i in sorted(noreset_ports):
     if (num_ports == ${i}) begin
         _ifc <- mkVerilogEHRU_${i};
     end else
 % endfor
     begin
+% if sorted(noreset_ports) == list(range(1, len(noreset_ports)+1)):
         errorM("num_ports is too large for mkVerilogEHRU");
+% else:
+        errorM("mkVerilogEHRU was only generated for num_ports in ${', '.join(str(i) for i in sorted(noreset_ports))}");
+% endif
     end
     return _ifc;
 endmodule
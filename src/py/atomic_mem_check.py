@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Golden model checker for AtomicMem and GenericAtomicMem traces.
+#
+# The trace is a text file with one line per request and one per response,
+# as written by $fdisplay in a testbench, optionally after a "(<time>) "
+# prefix. Other lines are ignored. All numbers are hex. fprintAtomicMemTrace
+# in MemUtil.bsv wraps an AtomicMemServerPort to write this format, e.g.
+# tests/MemUtil/AtomicBRAMCheck.bsv writes AtomicBRAMCheck.trace.
+#
+#   req <write_en> <atomic_op> <addr> <data>
+#   resp <write> <data>
+#
+# atomic_op is the fshow name of an AtomicMemOp (or of an AMOSwap, AMOLogical,
+# or AMOArithmetic for GenericAtomicMem). Responses are paired with requests
+# in order. The expected responses follow mkAtomicBRAM and
+# mkGenericAtomicBRAM: requests with write_en == 0 are reads, atomic requests
+# return the old word and write atomicMemOpAlu (--alu memutil) or the
+# AMOArithmetic atomicMemOpFunc (--alu generic) under write_en, and the data
+# of write responses is not checked.
+#
+# The model is a sparse memory of --mem-bytes words. A narrower trace
+# (--data-bytes) goes through the same translation as mkNarrowerMemServerPort.
+# Without --init zero, memory starts unknown and the first read of each byte
+# defines it.
+#
+# Requests are replayed in batches. Within a batch, the k-th round handles
+# the requests to each word between its (k-1)-th and k-th atomic operation,
+# so the number of rounds is one more than the largest number of atomic
+# operations to a single word in the batch.
+#
+# Examples:
+#   atomic_mem_check.py AtomicBRAMCheck.trace --data-bytes 4
+#   atomic_mem_check.py trace.txt --data-bytes 4
+#   atomic_mem_check.py trace.txt --data-bytes 4 --mem-bytes 16 --init zero
+#   atomic_mem_check.py trace.txt --data-bytes 8 --alu generic --image mem.hex
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from np_text import chunk_ranges, hex_value
+
+# AtomicMemOp order from MemUtil.bsv
+op_names = ['None', 'Swap', 'Add', 'Xor', 'And', 'Or', 'Min', 'Max', 'Minu', 'Maxu']
+NONE, SWAP, ADD, XOR, AND, OR, MIN, MAX, MINU, MAXU = range(len(op_names))
+
+def _op_key(c0, c1, length):
+    return (c0.astype(np.int64) << 16) | (c1.astype(np.int64) << 8) | length
+
+op_keys = np.array([_op_key(np.array(ord(n[0])), np.array(ord(n[1])), len(n)) for n in op_names])
+op_order = np.argsort(op_keys)
+
+def parse_hex_bytes(arr, starts, ends, num_bytes):
+    """Parses the hex tokens [starts, ends) of arr into little endian bytes.
+
+    Returns (bytes as a (len(starts), num_bytes) array, valid)."""
+    num_digits = 2 * num_bytes
+    pos = ends[:, None] - 1 - np.arange(num_digits)
+    digits = hex_value[arr[np.maximum(pos, 0)]]
+    inside = pos >= starts[:, None]
+    valid = ((digits < 16) | ~inside).all(axis = 1) & (ends - starts <= num_digits) & (ends > starts)
+    digits = np.where(inside & (digits < 16), digits, 0)
+    return (digits[:, 0::2] | (digits[:, 1::2] << 4), valid)
+
+def parse_ops(arr, starts, ends):
+    """Returns the AtomicMemOp of the op name tokens, or -1."""
+    key = _op_key(arr[starts], arr[np.minimum(starts + 1, len(arr) - 1)], ends - starts)
+    i = op_order[np.minimum(np.searchsorted(op_keys[op_order], key), len(op_keys) - 1)]
+    return np.where(op_keys[i] == key, i, -1)
+
+def parse_chunk(data, data_bytes):
+    """Parses the req and resp lines of a chunk.
+
+    Returns (num_lines, reqs, resps, bad line numbers) with line numbers
+    relative to the chunk. reqs is (lines, write_en, op, addr, data) and resps
+    is (lines, write, data)."""
+    arr = np.frombuffer(data, dtype = np.uint8)
+    ends = np.flatnonzero(arr == ord('\n'))
+    if len(arr) != 0 and arr[-1] != ord('\n'):
+        ends = np.append(ends, len(arr))
+    starts = np.zeros(len(ends), dtype = np.int64)
+    starts[1:] = ends[:-1] + 1
+    lines = np.arange(len(ends))
+    spaces = np.flatnonzero(arr == ord(' '))
+    spaces_end = np.append(spaces, len(arr))
+    # skip a "(<time>) " prefix
+    at = lambda i: arr[np.minimum(i, len(arr) - 1)]
+    first_space = spaces_end[np.searchsorted(spaces, starts)]
+    timed = (at(starts) == ord('(')) & (first_space < ends) & (at(first_space - 1) == ord(')'))
+    starts = np.where(timed, first_space + 1, starts)
+    is_req = (ends - starts > 4) & (at(starts) == ord('r')) & (at(starts + 1) == ord('e')) & (at(starts + 2) == ord('q')) & (at(starts + 3) == ord(' '))
+    is_resp = (ends - starts > 5) & (at(starts) == ord('r')) & (at(starts + 1) == ord('e')) & (at(starts + 2) == ord('s')) & (at(starts + 3) == ord('p')) & (at(starts + 4) == ord(' '))
+
+    def tokens(sel, num_tokens):
+        (s, e) = (starts[sel], ends[sel])
+        k = np.searchsorted(spaces, s)
+        bounds = spaces_end[np.minimum(k[:, None] + np.arange(num_tokens), len(spaces))]
+        bounds = np.minimum(bounds, e[:, None])
+        token_starts = np.concatenate((s[:, None], bounds[:, :-1] + 1), axis = 1)
+        token_ends = np.concatenate((bounds[:, :-1], e[:, None]), axis = 1)
+        # exactly num_tokens tokens separated by single spaces
+        ok = (bounds[:, -1] == e) & (bounds[:, -2] < e) & (token_ends > token_starts).all(axis = 1)
+        return (token_starts[:, 1:], token_ends[:, 1:], ok)
+
+    (ts, te, ok) = tokens(is_req, 5)
+    (write_en, ok_en) = parse_hex_bytes(arr, ts[:, 0], te[:, 0], (data_bytes + 7) // 8)
+    write_en = np.unpackbits(write_en, axis = 1, count = data_bytes, bitorder = 'little').astype(bool)
+    op = parse_ops(arr, ts[:, 1], te[:, 1])
+    (addr, ok_addr) = parse_hex_bytes(arr, ts[:, 2], te[:, 2], 8)
+    addr = addr.view('<u8')[:, 0] if len(addr) else np.zeros(0, dtype = np.uint64)
+    (req_data, ok_data) = parse_hex_bytes(arr, ts[:, 3], te[:, 3], data_bytes)
+    ok &= ok_en & (op >= 0) & ok_addr & ok_data
+    reqs = (lines[is_req][ok], write_en[ok], op[ok].astype(np.int8), addr[ok], req_data[ok])
+    bad = [lines[is_req][~ok]]
+
+    (ts, te, ok) = tokens(is_resp, 3)
+    write = at(ts[:, 0])
+    ok &= (te[:, 0] - ts[:, 0] == 1) & ((write == ord('0')) | (write == ord('1')))
+    (resp_data, ok_data) = parse_hex_bytes(arr, ts[:, 1], te[:, 1], data_bytes)
+    ok &= ok_data
+    resps = (lines[is_resp][ok], write[ok] == ord('1'), resp_data[ok])
+    bad.append(lines[is_resp][~ok])
+    return (len(ends), reqs, resps, np.sort(np.concatenate(bad)))
+
+def alu(op, mem, operand, en, flavor):
+    """Vectorized atomicMemOpAlu on (n, num_bytes) byte arrays."""
+    (n, num_bytes) = mem.shape
+    signed = (op == MIN) | (op == MAX)
+    # masked operands for the adder and comparator
+    masked = []
+    for x in (mem, operand):
+        m = np.where(en, x, 0).astype(np.uint8)
+        if flavor == 'memutil':
+            # disabled bytes take the sign of the byte below them
+            prev_msb = np.zeros(n, dtype = bool)
+            for i in range(num_bytes):
+                m[:, i] = np.where(en[:, i], x[:, i], np.where(signed & prev_msb, 0xff, 0))
+                prev_msb = m[:, i] >= 0x80
+        else:
+            # disabled bytes take the sign of the highest enabled byte
+            msb = np.zeros(n, dtype = bool)
+            for i in range(num_bytes):
+                msb = np.where(en[:, i], x[:, i] >= 0x80, msb)
+            m = np.where(en, x, np.where((signed & msb)[:, None], 0xff, 0)).astype(np.uint8)
+        masked.append(m)
+    (a, b) = masked
+    # add with carries between bytes
+    total = np.zeros((n, num_bytes), dtype = np.uint8)
+    carry = np.zeros(n, dtype = np.uint16)
+    for i in range(num_bytes):
+        s = a[:, i].astype(np.uint16) + b[:, i] + carry
+        total[:, i] = s & 0xff
+        carry = s >> 8
+    # operand > mem, comparing from the top byte
+    ta = a.copy()
+    tb = b.copy()
+    ta[:, -1] ^= np.where(signed, 0x80, 0).astype(np.uint8)
+    tb[:, -1] ^= np.where(signed, 0x80, 0).astype(np.uint8)
+    differ = ta != tb
+    top = num_bytes - 1 - np.argmax(differ[:, ::-1], axis = 1)
+    rows = np.arange(n)
+    operand_larger = differ.any(axis = 1) & (tb[rows, top] > ta[rows, top])
+    is_max = (op == MAX) | (op == MAXU)
+    min_max = np.where((operand_larger == is_max)[:, None], operand, mem)
+    return np.select([(op == SWAP)[:, None], (op == ADD)[:, None], (op == XOR)[:, None], (op == AND)[:, None], (op == OR)[:, None]],
+                     [operand, total, mem ^ operand, mem & operand, mem | operand], min_max).astype(np.uint8)
+
+class Memory:
+    """Sparse memory of num_bytes byte words with a known mask per byte."""
+    def __init__(self, num_bytes, known = False):
+        self.num_bytes = num_bytes
+        self.default_known = known
+        self.addrs = np.zeros(0, dtype = np.uint64)
+        self.rows = np.zeros(0, dtype = np.int64)
+        self.data = np.zeros((1024, num_bytes), dtype = np.uint8)
+        self.known = np.zeros((1024, num_bytes), dtype = bool)
+        self.size = 0
+
+    def lookup(self, addrs):
+        """Returns the rows of the sorted unique word addresses, allocating new ones."""
+        i = np.searchsorted(self.addrs, addrs)
+        found = i < len(self.addrs)
+        found[found] = self.addrs[i[found]] == addrs[found]
+        new = addrs[~found]
+        if len(new) != 0:
+            while self.size + len(new) > len(self.data):
+                self.data = np.concatenate((self.data, np.zeros_like(self.data)))
+                self.known = np.concatenate((self.known, np.zeros_like(self.known)))
+            new_rows = np.arange(self.size, self.size + len(new))
+            self.known[new_rows] = self.default_known
+            self.size += len(new)
+            self.addrs = np.insert(self.addrs, i[~found], new)
+            self.rows = np.insert(self.rows, i[~found], new_rows)
+            i = np.searchsorted(self.addrs, addrs)
+        return self.rows[i]
+
+    def load(self, addrs, words):
+        """Sets words, e.g. from a memory image."""
+        (addrs, last) = np.unique(addrs[::-1], return_index = True)
+        rows = self.lookup(addrs)
+        self.data[rows] = words[::-1][last]
+        self.known[rows] = True
+
+def _to_ints(a):
+    """Returns the rows of a (n, num_bytes) uint8 array as little endian ints."""
+    if a.shape[1] <= 8:
+        padded = np.zeros((len(a), 8), dtype = np.uint8)
+        padded[:, :a.shape[1]] = a
+        return padded.view('<u8')[:, 0].tolist()
+    b = a.tobytes()
+    w = a.shape[1]
+    return [int.from_bytes(b[i:i + w], 'little') for i in range(0, len(b), w)]
+
+def _from_ints(x, num_bytes):
+    """Inverse of _to_ints."""
+    b = b''.join(v.to_bytes(num_bytes, 'little') for v in x)
+    return np.frombuffer(b, dtype = np.uint8).reshape(len(x), num_bytes)
+
+def _fill(write, values, group_start, base, base_known):
+    """Returns what each request sees: the latest earlier write to each byte in
+    its group, or the base of the group."""
+    m = len(write)
+    latest = np.maximum.accumulate(np.where(write, np.arange(m)[:, None], -1), axis = 0)
+    before = np.empty_like(latest)
+    before[0] = -1
+    before[1:] = latest[:-1]
+    hit = before >= group_start[:, None]
+    view = np.where(hit, values[np.maximum(before, 0), np.arange(write.shape[1])], base)
+    return (view, hit | base_known)
+
+class Checker:
+    """Replays batches of requests and responses against a Memory."""
+    def __init__(self, memory, flavor = 'memutil', hot_atomics = 16):
+        self.memory = memory
+        self.flavor = flavor
+        self.hot_atomics = hot_atomics
+        self.counts = np.zeros(3, dtype = np.int64)
+        self.rounds = 0
+        self.hot_requests = 0
+
+    def _replay_hot(self, order, group, state, state_known, write_en, op, data, resp_data, resp_valid):
+        """Replays the requests in order, grouped by word, one at a time.
+
+        Updates state and state_known and returns (expected, compared)."""
+        num_bytes = self.memory.num_bytes
+        byte_mask = lambda a: _to_ints(np.where(a, 0xff, 0).astype(np.uint8))
+        (en, valid) = (byte_mask(write_en[order]), byte_mask(resp_valid[order]))
+        (operands, resps) = (_to_ints(data[order]), _to_ints(resp_data[order]))
+        en_bits = _to_ints(np.packbits(write_en[order], axis = 1, bitorder = 'little'))
+        ops = op[order].tolist()
+        groups = group[order].tolist()
+        words = dict(zip(np.unique(groups).tolist(), zip(_to_ints(state[np.unique(groups)]), byte_mask(state_known[np.unique(groups)]))))
+        expected = []
+        compared = []
+        for j in range(len(order)):
+            (word, known) = words[groups[j]]
+            if en[j] == 0 or ops[j] != NONE:
+                expected.append(word)
+                compared.append(known & valid[j])
+                word = (word & known) | (resps[j] & valid[j] & ~known)
+                known |= valid[j]
+            else:
+                expected.append(0)
+                compared.append(0)
+            if en[j] != 0:
+                operand = operands[j]
+                if ops[j] != NONE:
+                    operand = reference_alu(ops[j], word, operand, en_bits[j], num_bytes, self.flavor)
+                word = (operand & en[j]) | (word & ~en[j])
+                known |= en[j]
+            words[groups[j]] = (word, known)
+        for (g, (word, known)) in words.items():
+            state[g] = _from_ints([word], num_bytes)[0]
+            state_known[g] = _from_ints([known], num_bytes)[0] != 0
+        return (_from_ints(expected, num_bytes), _from_ints(compared, num_bytes) != 0)
+
+    def check(self, addr, write_en, op, data, resp_write, resp_data, resp_valid = None):
+        """Replays a batch of word requests in order.
+
+        resp_valid selects the bytes of resp_data that are part of the response
+        (all by default). Returns (mismatch, expected data, compared bytes) for
+        each request."""
+        n = len(addr)
+        if resp_valid is None:
+            resp_valid = np.ones(write_en.shape, dtype = bool)
+        is_write = write_en.any(axis = 1)
+        atomic = is_write & (op != NONE)
+        self.counts += [int((~is_write).sum()), int((is_write & ~atomic).sum()), int(atomic.sum())]
+        (words, group) = np.unique(addr, return_inverse = True)
+        rows = self.memory.lookup(words)
+        state = self.memory.data[rows]
+        state_known = self.memory.known[rows]
+        expected = np.zeros((n, self.memory.num_bytes), dtype = np.uint8)
+        compared = np.zeros((n, self.memory.num_bytes), dtype = bool)
+        order = np.argsort(group, kind = 'stable')
+        # words with many atomic operations in this batch are replayed one
+        # request at a time, instead of adding a round for each
+        hot = (np.bincount(group, weights = atomic) > self.hot_atomics)[group[order]]
+        hot_order = order[hot]
+        order = order[~hot]
+        if len(hot_order) != 0:
+            (expected[hot_order], compared[hot_order]) = self._replay_hot(hot_order, group, state, state_known, write_en, op, data, resp_data, resp_valid)
+            self.hot_requests += len(hot_order)
+        # order by (atomics before this one to the same word, word, request)
+        g = group[order]
+        first = np.concatenate(([True], g[1:] != g[:-1]))
+        before = np.cumsum(atomic[order]) - atomic[order]
+        rank = before - np.maximum.accumulate(np.where(first, before, 0))
+        order = order[np.argsort(rank, kind = 'stable')]
+        bounds = np.searchsorted(np.sort(rank), np.arange(rank.max() + 2 if len(rank) else 1))
+        for (lo, hi) in zip(bounds[:-1], bounds[1:]):
+            self.rounds += 1
+            idx = order[lo:hi]
+            gg = group[idx]
+            m = len(idx)
+            first = np.concatenate(([True], gg[1:] != gg[:-1]))
+            last = np.concatenate((first[1:], [True]))
+            group_start = np.maximum.accumulate(np.where(first, np.arange(m), 0))
+            (base, base_known) = (state[gg], state_known[gg])
+            (w, values, reads, atomics) = (write_en[idx], data[idx], ~is_write[idx], atomic[idx])
+            valid = resp_valid[idx]
+            if not base_known.all():
+                # reads of unknown bytes define them
+                (view, known) = _fill(w, values, group_start, base, base_known)
+                w = w | (reads[:, None] & valid & ~known)
+                values = np.where(write_en[idx], values, resp_data[idx])
+            (view, known) = _fill(w, values, group_start, base, base_known)
+            expected[idx] = view
+            compared[idx] = known & valid & (reads | atomics)[:, None]
+            # the state after each group is that after its last request
+            new = np.where(w, values, view)[last]
+            new_known = (known | w)[last]
+            la = np.flatnonzero(atomics[last])
+            if len(la) != 0:
+                ia = idx[last][la]
+                old_known = known[last][la]
+                old = np.where(old_known, view[last][la], resp_data[ia])
+                result = alu(op[ia], old, data[ia], write_en[ia], self.flavor)
+                new[la] = np.where(write_en[ia], result, old)
+                new_known[la] = old_known | resp_valid[ia] | write_en[ia]
+            state[gg[last]] = new
+            state_known[gg[last]] = new_known
+        self.memory.data[rows] = state
+        self.memory.known[rows] = state_known
+        mismatch = (resp_write != is_write) | ((resp_data != expected) & compared).any(axis = 1)
+        return (mismatch, expected, compared)
+
+def to_words(addr, write_en, data, data_bytes, mem_bytes, word_addr = False):
+    """Translates narrow requests to mem_bytes words like mkNarrowerMemServerPort.
+
+    Returns (word address, write_en, data, offset of the narrow word)."""
+    log_data = data_bytes.bit_length() - 1
+    log_mem = mem_bytes.bit_length() - 1
+    byte_addr = addr << np.uint64(log_data) if word_addr else addr
+    offset = ((byte_addr >> np.uint64(log_data)) & np.uint64((mem_bytes >> log_data) - 1)).astype(np.int64)
+    words = byte_addr >> np.uint64(log_mem)
+    if mem_bytes == data_bytes:
+        return (words, write_en, data, offset)
+    factor = mem_bytes // data_bytes
+    wide_en = np.zeros((len(addr), factor, data_bytes), dtype = bool)
+    wide_en[np.arange(len(addr)), offset] = write_en
+    return (words, wide_en.reshape(len(addr), mem_bytes), np.tile(data, factor), offset)
+
+def slot_mask(offset, data_bytes, mem_bytes):
+    """Returns the bytes of each mem_bytes word that hold the narrow word at offset."""
+    return (np.arange(mem_bytes) // data_bytes)[None, :] == offset[:, None]
+
+def narrow(wide, offset, data_bytes):
+    """Selects the narrow words at offset from (n, mem_bytes) arrays."""
+    return wide.reshape(len(wide), -1, data_bytes)[np.arange(len(wide)), offset]
+
+def read_image(filename, mem_bytes):
+    """Reads a $readmemh style image of mem_bytes words with @address lines.
+
+    Returns (word addresses, words)."""
+    addrs = []
+    words = []
+    addr = 0
+    with open(filename) as f:
+        for line in f:
+            for token in line.split('//')[0].split():
+                if token.startswith('@'):
+                    addr = int(token[1:], 16)
+                else:
+                    value = int(token.replace('_', ''), 16)
+                    addrs.append(addr)
+                    words.append(value.to_bytes(mem_bytes, 'little'))
+                    addr += 1
+    data = np.frombuffer(b''.join(words), dtype = np.uint8).reshape(-1, mem_bytes)
+    return (np.array(addrs, dtype = np.uint64), data)
+
+def hex_word(b):
+    return bytes(b[::-1]).hex()
+
+def check_trace(filename, data_bytes, mem_bytes = None, flavor = 'memutil', init = 'learn', image = None,
+                word_addr = False, chunk_size = 1 << 24, max_errors = 1, out = sys.stdout):
+    """Checks a trace file. Returns (number of divergences, checker)."""
+    mem_bytes = mem_bytes or data_bytes
+    memory = Memory(mem_bytes, known = (init == 'zero'))
+    if image is not None:
+        memory.load(*read_image(image, mem_bytes))
+    checker = Checker(memory, flavor)
+    pending_reqs = None
+    pending_resps = None
+    line_base = 0
+    errors = 0
+    with open(filename, 'rb') as f:
+        for (start, end) in chunk_ranges(filename, 0, chunk_size):
+            f.seek(start)
+            (num_lines, reqs, resps, bad) = parse_chunk(f.read(end - start), data_bytes)
+            if len(bad) != 0:
+                out.write('WARNING: %d malformed req/resp lines, first is line %d\n' % (len(bad), line_base + bad[0] + 1))
+            reqs = (reqs[0] + line_base,) + reqs[1:]
+            resps = (resps[0] + line_base,) + resps[1:]
+            line_base += num_lines
+            if pending_reqs is not None:
+                reqs = tuple(np.concatenate(x) for x in zip(pending_reqs, reqs))
+                resps = tuple(np.concatenate(x) for x in zip(pending_resps, resps))
+            k = min(len(reqs[0]), len(resps[0]))
+            pending_reqs = tuple(x[k:] for x in reqs)
+            pending_resps = tuple(x[k:] for x in resps)
+            if k == 0:
+                continue
+            (req_lines, write_en, op, addr, data) = (x[:k] for x in reqs)
+            (resp_lines, resp_write, resp_data) = (x[:k] for x in resps)
+            (words, wide_en, wide_data, offset) = to_words(addr, write_en, data, data_bytes, mem_bytes, word_addr)
+            wide_resp = np.tile(resp_data, mem_bytes // data_bytes)
+            (mismatch, expected, compared) = checker.check(words, wide_en, op, wide_data, resp_write, wide_resp,
+                                                           slot_mask(offset, data_bytes, mem_bytes))
+            for i in np.flatnonzero(mismatch)[:max_errors - errors].tolist():
+                exp = narrow(expected[i:i + 1], offset[i:i + 1], data_bytes)[0]
+                cmp = narrow(compared[i:i + 1], offset[i:i + 1], data_bytes)[0]
+                exp_str = ''.join('%02x' % b if c else '??' for (b, c) in zip(exp[::-1], cmp[::-1]))
+                is_write = bool(write_en[i].any())
+                out.write('ERROR: divergence at request %d (line %d), response line %d\n' % (checker.counts.sum() - k + i + 1, req_lines[i] + 1, resp_lines[i] + 1))
+                out.write('    req:      write_en %s, %s, addr %x, data %s\n' % (hex_word(np.packbits(write_en[i], bitorder = 'little')), op_names[op[i] if is_write else NONE], addr[i], hex_word(data[i])))
+                out.write('    expected: write %d, data %s\n' % (is_write, exp_str if cmp.any() else '(not checked)'))
+                out.write('    observed: write %d, data %s\n' % (resp_write[i], hex_word(resp_data[i])))
+                errors += 1
+            if errors >= max_errors:
+                return (errors, checker)
+    if pending_reqs is not None and len(pending_reqs[0]) + len(pending_resps[0]) != 0:
+        out.write('WARNING: %d requests and %d responses are unmatched at the end of the trace\n' % (len(pending_reqs[0]), len(pending_resps[0])))
+    return (errors, checker)
+
+def reference_alu(op, mem, operand, en, num_bytes, flavor):
+    """atomicMemOpAlu on Python ints, one request at a time."""
+    bits = 8 * num_bytes
+    bit_en = sum(0xff << (8 * i) for i in range(num_bytes) if (en >> i) & 1)
+    signed = op in (MIN, MAX)
+    def masked(x):
+        if flavor == 'memutil':
+            (y, prev) = (0, 0)
+            for i in range(num_bytes):
+                b = (x >> (8 * i)) & 0xff if (en >> i) & 1 else (0xff if signed and prev else 0)
+                y |= b << (8 * i)
+                prev = b >> 7
+            return y
+        msb = 0
+        for i in range(num_bytes):
+            if (en >> i) & 1:
+                msb = (x >> (8 * i + 7)) & 1
+        return (x & bit_en) | ((((1 << bits) - 1) & ~bit_en) if signed and msb else 0)
+    if op in (SWAP, XOR, AND, OR):
+        return {SWAP: operand, XOR: mem ^ operand, AND: mem & operand, OR: mem | operand}[op]
+    (a, b) = (masked(mem), masked(operand))
+    if op == ADD:
+        return (a + b) & ((1 << bits) - 1)
+    if signed:
+        (a, b) = (a - (a >> (bits - 1) << bits), b - (b >> (bits - 1) << bits))
+    return operand if (b > a) == (op in (MAX, MAXU)) else mem
+
+def reference_trace(rng, n, num_bytes, flavor, memory, num_words = 64):
+    """Returns random requests and the responses of a scalar reference model."""
+    lines = []
+    full = (1 << num_bytes) - 1
+    for i in range(n):
+        word = int(rng.integers(0, 4)) if rng.random() < 0.3 else int(rng.integers(0, num_words))
+        r = rng.random()
+        if r < 0.4:
+            en = 0
+        elif r < 0.7:
+            size = 1 << int(rng.integers(0, num_bytes.bit_length()))
+            en = ((1 << size) - 1) << (size * int(rng.integers(0, num_bytes // size)))
+        else:
+            en = int(rng.integers(1, full + 1))
+        op = int(rng.integers(0, len(op_names))) if rng.random() < 0.5 else NONE
+        data = int.from_bytes(rng.bytes(num_bytes), 'little')
+        mem = memory.setdefault(word, int.from_bytes(rng.bytes(num_bytes), 'little'))
+        bit_en = sum(0xff << (8 * j) for j in range(num_bytes) if (en >> j) & 1)
+        if en == 0:
+            resp = (0, mem)
+        elif op == NONE:
+            memory[word] = (data & bit_en) | (mem & ~bit_en)
+            resp = (1, int.from_bytes(rng.bytes(num_bytes), 'little'))
+        else:
+            result = reference_alu(op, mem, data, en, num_bytes, flavor)
+            memory[word] = (result & bit_en) | (mem & ~bit_en)
+            resp = (1, mem)
+        lines.append('req %x %s %x %0*x' % (en, op_names[op], word * num_bytes, 2 * num_bytes, data))
+        lines.append('resp %d %0*x' % (resp[0], 2 * num_bytes, resp[1]))
+    return lines
+
+def self_test(tmp, n = 20000, seed = 0):
+    """Checks reference traces, with and without an injected divergence.
+
+    Returns the number of failures."""
+    import io
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for (data_bytes, mem_bytes, flavor) in [(4, 4, 'memutil'), (8, 8, 'generic'), (4, 16, 'memutil'), (16, 16, 'memutil')]:
+        memory = {}
+        lines = reference_trace(rng, n, data_bytes, flavor, memory)
+        # interleave responses later than their requests, with a timestamp
+        reqs = [(2 * i, '(%d) %s' % (10 * i, line)) for (i, line) in enumerate(lines[0::2])]
+        resps = [(2 * i + 7, line) for (i, line) in enumerate(lines[1::2])]
+        trace = [line for (_, line) in sorted(reqs + resps)]
+        filename = os.path.join(tmp, 'trace.txt')
+        with open(filename, 'w') as f:
+            f.write('\n'.join(['sim started'] + trace) + '\n')
+        out = io.StringIO()
+        (errors, checker) = check_trace(filename, data_bytes, mem_bytes, flavor, chunk_size = 1 << 16, out = out)
+        if errors != 0 or checker.counts.sum() != n:
+            print('ERROR: %d byte trace on %d byte memory (%s): %d divergences in %d requests' % (data_bytes, mem_bytes, flavor, errors, checker.counts.sum()))
+            print(out.getvalue())
+            failures += 1
+        # corrupt the response of a late read
+        target = [i for (i, line) in enumerate(trace) if line.startswith('resp 0')][-100]
+        corrupt = list(trace)
+        word = corrupt[target].split()[2]
+        corrupt[target] = 'resp 0 ' + ('%0*x' % (len(word), int(word, 16) ^ 1))
+        with open(filename, 'w') as f:
+            f.write('\n'.join(corrupt) + '\n')
+        out = io.StringIO()
+        (errors, checker) = check_trace(filename, data_bytes, mem_bytes, flavor, chunk_size = 1 << 16, out = out)
+        if errors != 1 or 'response line %d' % (target + 1) not in out.getvalue():
+            print('ERROR: injected divergence at line %d not reported' % (target + 1))
+            print(out.getvalue())
+            failures += 1
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check AtomicMem request/response traces against a golden model')
+    parser.add_argument('trace', nargs = '?', help = 'trace with "req <write_en> <op> <addr> <data>" and "resp <write> <data>" lines')
+    parser.add_argument('--data-bytes', type = int, default = 4, help = 'bytes per word in the trace (default: %(default)s)')
+    parser.add_argument('--mem-bytes', type = int, help = 'bytes per word of the memory behind a narrow bridge (default: --data-bytes)')
+    parser.add_argument('--alu', choices = ['memutil', 'generic'], default = 'memutil', help = 'atomicMemOpAlu from MemUtil or the AMOArithmetic atomicMemOpFunc from GenericAtomicMem')
+    parser.add_argument('--init', choices = ['learn', 'zero'], default = 'learn', help = 'initial memory: defined by the first reads, or zero')
+    parser.add_argument('--image', help = 'hex image of --mem-bytes words loaded before the trace')
+    parser.add_argument('--word-addr', action = 'store_true', help = 'trace addresses are word addresses, as in GenericAtomicMemReq')
+    parser.add_argument('--chunk-size', type = int, default = 16, help = 'MiB of trace per batch (default: %(default)s)')
+    parser.add_argument('--max-errors', type = int, default = 1, help = 'divergences to report before stopping (default: %(default)s)')
+    parser.add_argument('--test', action = 'store_true', help = 'check random traces from a scalar reference model and exit')
+    args = parser.parse_args()
+
+    if args.test:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            failures = self_test(tmp)
+        print('%d failures' % failures)
+        sys.exit(1 if failures else 0)
+    if args.trace is None:
+        parser.print_usage()
+        sys.exit(1)
+    mem_bytes = args.mem_bytes or args.data_bytes
+    for x in (args.data_bytes, mem_bytes):
+        if x & (x - 1) or x < 1:
+            print('ERROR: word sizes must be powers of two, got %d' % x)
+            sys.exit(1)
+    if mem_bytes < args.data_bytes:
+        print('ERROR: --mem-bytes must be at least --data-bytes')
+        sys.exit(1)
+    start = time.perf_counter()
+    (errors, checker) = check_trace(args.trace, args.data_bytes, mem_bytes, args.alu, args.init, args.image,
+                                    args.word_addr, args.chunk_size << 20, args.max_errors)
+    (reads, writes, atomics) = checker.counts.tolist()
+    sys.stderr.write('checked %d requests (%d reads, %d writes, %d atomics) to %d words in %.3fs, %d rounds, %d requests one at a time\n'
+                     % (reads + writes + atomics, reads, writes, atomics, checker.memory.size, time.perf_counter() - start, checker.rounds, checker.hot_requests))
+    sys.exit(1 if errors else 0)
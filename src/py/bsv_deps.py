@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Package dependency graph and parallel build plan for bsv files.
+#
+# Finds the import X::* statements in each file with bsv_grammar.parse_imports,
+# keeps the edges between the given packages, and reports import cycles. The
+# packages are then split into levels such that every package only imports
+# packages from earlier levels, so all packages in a level can be compiled at
+# the same time.
+#
+# Examples:
+#   bsv_deps.py src/bsv
+#   bsv_deps.py --make build/bsv_deps.mk src/bsv/*.bsv
+#   bsv_deps.py --json build/bsv_plan.json src/bsv
+
+import argparse
+import json
+import os
+
+from file_util import write_if_changed
+
+def find_bsv_files(paths):
+    """Returns the bsv files in paths, which may be files or directories."""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.bsv'))
+        else:
+            filenames.append(path)
+    return filenames
+
+def import_graph(filenames):
+    """Returns ({package: file}, {package: sorted list of imported packages})
+    for the packages in filenames. Imports of other packages (e.g. the
+    Bluespec libraries) are dropped."""
+    import bsv_grammar
+    files = {}
+    imports = {}
+    for filename in filenames:
+        package = os.path.splitext(os.path.basename(filename))[0]
+        files[package] = filename
+        with open(filename) as f:
+            imports[package] = bsv_grammar.parse_imports(f.read().expandtabs())
+    graph = {package: sorted(set(p for p in imports[package] if p in files and p != package)) for package in files}
+    return (files, graph)
+
+def find_cycles(graph):
+    """Returns the strongly connected components of graph that contain a
+    cycle, each as a sorted list of packages."""
+    # Tarjan's algorithm, iterative so deep graphs do not hit the recursion
+    # limit
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    cycles = []
+    counter = 0
+    for root in sorted(graph):
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while len(work) != 0:
+            (node, children) = work[-1]
+            child = next(children, None)
+            if child is not None:
+                if child not in index:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph[child])))
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+                continue
+            work.pop()
+            if len(work) != 0:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                if len(component) > 1:
+                    cycles.append(sorted(component))
+    return sorted(cycles)
+
+def levels(graph):
+    """Returns a list of levels, each a sorted list of packages that only
+    import packages from earlier levels. graph must not have cycles."""
+    # Kahn's algorithm: a package's level is known once all its imports have one
+    level = {}
+    remaining = {package: len(graph[package]) for package in graph}
+    users = {package: [] for package in graph}
+    for package in graph:
+        for p in graph[package]:
+            users[p].append(package)
+    ready = [package for package in graph if remaining[package] == 0]
+    while len(ready) != 0:
+        package = ready.pop()
+        level[package] = 1 + max([level[p] for p in graph[package]], default = -1)
+        for user in users[package]:
+            remaining[user] -= 1
+            if remaining[user] == 0:
+                ready.append(user)
+    result = [[] for i in range(max(level.values(), default = -1) + 1)]
+    for package in sorted(level):
+        result[level[package]].append(package)
+    return result
+
+def make_fragment(files, graph, plan, bo_dir = '$(BUILD_DIR)'):
+    """Returns a Make fragment with one rule per package that makes its .bo
+    file depend on the .bo files of the packages it imports."""
+    lines = ['# generated by %s' % os.path.basename(__file__), '']
+    for (i, level) in enumerate(plan):
+        lines.append('BSV_LEVEL_%d = %s' % (i, ' '.join(level)))
+    lines.append('BSV_NUM_LEVELS = %d' % len(plan))
+    lines.append('')
+    for level in plan:
+        for package in level:
+            lines.append(' '.join(['%s/%s.bo:' % (bo_dir, package), files[package]] + ['%s/%s.bo' % (bo_dir, p) for p in graph[package]]))
+    return '\n'.join(lines) + '\n'
+
+def json_plan(files, graph, plan):
+    return {
+        'levels': plan,
+        'packages': {package: {'file': files[package], 'imports': graph[package], 'level': i} for (i, level) in enumerate(plan) for package in level},
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Find import dependencies between bsv packages and plan a parallel build')
+    parser.add_argument('paths', metavar = 'PATH', nargs = '+', help = 'bsv files or directories of bsv files')
+    parser.add_argument('--make', metavar = 'FILE', help = 'write a Make fragment with .bo dependencies')
+    parser.add_argument('--bo-dir', default = '$(BUILD_DIR)', help = 'directory of the .bo files in the Make fragment (default: %(default)s)')
+    parser.add_argument('--json', metavar = 'FILE', help = 'write the build plan as JSON')
+    args = parser.parse_args()
+
+    (files, graph) = import_graph(find_bsv_files(args.paths))
+    cycles = find_cycles(graph)
+    if len(cycles) != 0:
+        for cycle in cycles:
+            print('ERROR: import cycle between %s' % ', '.join(cycle))
+        exit(1)
+    plan = levels(graph)
+    if args.make is not None:
+        write_if_changed(args.make, make_fragment(files, graph, plan, args.bo_dir))
+    if args.json is not None:
+        write_if_changed(args.json, json.dumps(json_plan(files, graph, plan), indent = 1, sort_keys = True) + '\n')
+    if args.make is None and args.json is None:
+        for (i, level) in enumerate(plan):
+            print('level %d: %s' % (i, ' '.join(level)))
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmarks for the bsv_doc_gen.py parser.
+#
+# By default this compares scanning the largest packages in src/bsv with
+# scan_bsv.scanString, which tries the grammar at every character offset,
+# against bsv_grammar.scan, which only tries it where a declaration or comment
+# can start. Both must produce exactly the same matches.
+#
+# With --synthetic it instead parses generated corpora that each stress one
+# grammar element, reports lines per second, peak memory, and the share of
+# the parse time spent in that element (measured with GrammarProfiler) for
+# each of them, and checks that parse time grows linearly with the corpus
+# size. Timings are the median of several runs after a warmup run, and are
+# compared with a baseline relative to a fixed reference workload timed next
+# to each run, since the speed of a shared machine drifts. The results can be
+# written as JSON and compared against a previous run:
+#
+#   bsv_doc_bench.py --synthetic --json baseline.json
+#   bsv_doc_bench.py --synthetic --baseline baseline.json
+
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import bsv_grammar
+
+bsv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bsv')
+
+def time_median(fn, repeat, warmup = 1):
+    """Returns (median elapsed seconds, result) over repeat calls of fn.
+
+    fn is called warmup more times first, and those calls are not timed."""
+    for i in range(warmup):
+        fn()
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return (statistics.median(times), result)
+
+def reference_work():
+    """Fixed pure Python work that does not use the grammar."""
+    counts = {}
+    for i in range(100000):
+        counts[i % 1000] = counts.get(i % 1000, 0) + i
+    return counts
+
+def time_relative(fn, repeat, warmup = 1):
+    """Like time_median, but also times reference_work right after each call
+    of fn and returns (median seconds, median ratio to reference_work, result).
+
+    The speed of a shared machine can change by a factor of two within
+    seconds, which the ratio mostly cancels out."""
+    for i in range(warmup):
+        fn()
+        reference_work()
+    times = []
+    ratios = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        middle = time.perf_counter()
+        reference_work()
+        end = time.perf_counter()
+        times.append(middle - start)
+        ratios.append((middle - start) / (end - middle))
+    return (statistics.median(times), statistics.median(ratios), result)
+
+def matches(scan_result):
+    return [(toks.asList(), start, end) for (toks, start, end) in scan_result]
+
+def bench_scan(filenames, repeat):
+    """Times scanString against scan for each file and checks they agree.
+
+    Returns the number of files where the two disagree."""
+    errors = 0
+    print('%-40s %7s %12s %12s %8s' % ('file', 'lines', 'scanString', 'scan', 'speedup'))
+    for filename in filenames:
+        with open(filename) as f:
+            file_data = f.read()
+        (full_time, full) = time_median(lambda: matches(bsv_grammar.scan_bsv.scanString(file_data)), repeat)
+        (fast_time, fast) = time_median(lambda: matches(bsv_grammar.scan(file_data)), repeat)
+        status = ''
+        if full != fast:
+            status = '  ERROR: results differ'
+            errors += 1
+        print('%-40s %7d %11.4fs %11.4fs %7.1fx%s' % (os.path.basename(filename), file_data.count('\n'), full_time, fast_time, full_time / fast_time, status))
+    return errors
+
+# synthetic corpora
+# Each generator takes a scale and returns (bsv text, number of declarations
+# parse_bsv should find in it). The declaration count guards against a
+# grammar change that makes a corpus stop parsing, which would otherwise look
+# like a big speedup.
+
+def gen_long_modules(scale):
+    """Modules with long bodies, for the module_bsv body skipping."""
+    lines = ['package LongModules;', '']
+    for m in range(scale):
+        lines.append('module mkLong%d(Empty);' % m)
+        for i in range(200):
+            lines.append('    Reg#(Bit#(32)) r%d <- mkReg(%d);' % (i, i))
+        for i in range(100):
+            lines.append('    rule incr%d (r%d != 0);' % (i, i))
+            lines.append('        r%d <= r%d + (r%d >> 1); // %d' % (i, i, i + 1, i))
+            lines.append('    endrule')
+        lines.append('endmodule')
+        lines.append('')
+    lines.append('endpackage')
+    return ('\n'.join(lines) + '\n', 1 + scale)
+
+def gen_nested_types(scale, depth = 12):
+    """Typedefs and function headers with deeply nested type parameters, for type_bsv."""
+    def nested(d):
+        if d == 0:
+            return 'Bit#(8)'
+        return 'Vector#(%d, %s)' % (d + 1, nested(d - 1)) if d % 2 else 'Tuple2#(%s, Maybe#(Bit#(%d)))' % (nested(d - 1), d)
+    lines = ['package NestedTypes;', '']
+    for i in range(5 * scale):
+        lines.append('typedef %s Nested%d;' % (nested(depth), i))
+        lines.append('function %s nestedF%d(%s x, %s y) provisos (Add#(TAdd#(TAdd#(a, b), c), %d, n));' % (nested(depth // 2), i, nested(depth // 2), nested(depth // 3), i))
+        lines.append('    return x;')
+        lines.append('endfunction')
+    lines.append('endpackage')
+    return ('\n'.join(lines) + '\n', 1 + 10 * scale)
+
+def gen_doc_comments(scale):
+    """Large doc comment blocks in front of small declarations, for comment_bsv."""
+    lines = ['package DocComments;', '']
+    for i in range(20 * scale):
+        lines.append('/**')
+        for j in range(30):
+            lines.append(' * Line %d of the documentation of `Doc%d`. It explains *why* the' % (j, i))
+            lines.append(' * interface exists and how to use it; see `mkDoc%d` for details.' % i)
+        lines.append(' */')
+        for j in range(10):
+            lines.append('/// One line doc comment %d for `Doc%d`.' % (j, i))
+        lines.append('// A regular comment that discards nothing important.')
+        lines.append('typedef Bit#(%d) Doc%d;' % (i + 1, i))
+        lines.append('')
+    lines.append('endpackage')
+    return ('\n'.join(lines) + '\n', 1 + 20 * scale)
+
+def gen_nested_functions(scale):
+    """Functions containing nested functions, for the function_bsv recursion."""
+    lines = ['package NestedFunctions;', '']
+    for i in range(20 * scale):
+        lines.append('function Bit#(n) outer%d(Bit#(n) x);' % i)
+        for j in range(5):
+            lines.append('    function Bit#(n) inner%d(Bit#(n) y);' % j)
+            lines.append('        function Bit#(n) innermost(Bit#(n) z) = z + %d;' % j)
+            lines.append('        return innermost(y) ^ (y << %d);' % j)
+            lines.append('    endfunction')
+        lines.append('    return ' + ' + '.join('inner%d(x)' % j for j in range(5)) + ';')
+        lines.append('endfunction')
+        lines.append('')
+    lines.append('endpackage')
+    return ('\n'.join(lines) + '\n', 1 + 20 * scale)
+
+def gen_memutil_like(scale):
+    """A mix of struct typedefs, interfaces, typeclasses, instances, and modules like MemUtil.bsv."""
+    lines = ['package MemUtilLike;', '', 'import Vector::*;', '']
+    decls = 1
+    for i in range(10 * scale):
+        lines += [
+            '/// Request type %d' % i,
+            'typedef struct {',
+            '    Bool write;',
+            '    Bit#(addrSz) addr;',
+            '    Bit#(TMul#(8,TExp#(logNumBytes))) data;',
+            '} Req%d#(numeric type addrSz, numeric type logNumBytes) deriving (Bits, Eq, FShow);' % i,
+            '',
+            '/// Server port %d' % i,
+            'interface Port%d#(numeric type addrSz, numeric type logNumBytes);' % i,
+            '    interface InputPort#(Req%d#(addrSz, logNumBytes)) request;' % i,
+            '    interface OutputPort#(Bit#(TMul#(8,TExp#(logNumBytes)))) response;',
+            'endinterface',
+            '',
+            'typeclass ToPort%d#(type t, numeric type addrSz, numeric type logNumBytes)' % i,
+            '        dependencies (t determines (addrSz, logNumBytes));',
+            '    function Port%d#(addrSz, logNumBytes) toPort%d(t x);' % (i, i),
+            'endtypeclass',
+            '',
+            'instance ToPort%d#(Port%d#(addrSz, logNumBytes), addrSz, logNumBytes);' % (i, i),
+            '    function Port%d#(addrSz, logNumBytes) toPort%d(Port%d#(addrSz, logNumBytes) x) = x;' % (i, i, i),
+            'endinstance',
+            '',
+            '/// Memory %d' % i,
+            'module mkMem%d(Port%d#(addrSz, logNumBytes)) provisos (Add#(a__, logNumBytes, addrSz));' % (i, i),
+            '    Vector#(4, Reg#(Bit#(TMul#(8,TExp#(logNumBytes))))) mem <- replicateM(mkReg(0));',
+            '    Ehr#(2, Maybe#(Req%d#(addrSz, logNumBytes))) req <- mkEhr(tagged Invalid);' % i,
+            '    rule process (req[1] matches tagged Valid .r);',
+            '        if (r.write) mem[r.addr[1:0]] <= r.data;',
+            '        req[1] <= tagged Invalid;',
+            '    endrule',
+            'endmodule',
+            '']
+        decls += 5
+    lines.append('endpackage')
+    return ('\n'.join(lines) + '\n', decls)
+
+# corpus name -> (grammar element it stresses, generator)
+corpora = {
+    'long_modules': ('module_bsv', gen_long_modules),
+    'nested_types': ('type_bsv', gen_nested_types),
+    'doc_comments': ('comment_bsv', gen_doc_comments),
+    'nested_functions': ('function_bsv', gen_nested_functions),
+    'memutil_like': ('declaration_bsv', gen_memutil_like),
+}
+
+def parse_all(text):
+    return sum(1 for d in bsv_grammar.parse_bsv(text))
+
+def element_share(text, element):
+    """Returns the fraction of the time parsing text takes that is spent in
+    element, as measured by GrammarProfiler."""
+    profiler = bsv_grammar.GrammarProfiler()
+    profiler.attach()
+    try:
+        parse_all(text)
+    finally:
+        profiler.detach()
+    totals = profiler.totals()
+    total = sum(s[3] for s in totals.values())
+    return totals[element][4] / total if element in totals and total > 0 else 0.0
+
+def bench_corpus(name, scale, repeat, growth = 4):
+    """Parses corpus name at scale and growth * scale and returns its results.
+
+    The results contain lines per second, peak traced memory, and the share
+    of the time spent in the stressed element at scale, and the exponent k in
+    time ~ size^k estimated from the two scales."""
+    (element, gen) = corpora[name]
+    (text, expected) = gen(scale)
+    (big_text, big_expected) = gen(growth * scale)
+    (seconds, relative, found) = time_relative(lambda: parse_all(text), repeat)
+    (big_seconds, big_relative, big_found) = time_relative(lambda: parse_all(big_text), repeat)
+    tracemalloc.start()
+    parse_all(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    share = element_share(text, element)
+    lines = text.count('\n')
+    big_lines = big_text.count('\n')
+    return {
+        'element': element,
+        'scale': scale,
+        'lines': lines,
+        'bytes': len(text),
+        'declarations': found,
+        'expected_declarations': expected,
+        'seconds': seconds,
+        'lines_per_sec': lines / seconds,
+        'relative_time': relative,
+        'peak_bytes': peak,
+        'element_share': share,
+        'exponent': math.log(big_relative / relative) / math.log(big_lines / lines),
+        'ok': found == expected and big_found == big_expected,
+    }
+
+def bench_synthetic(scale, repeat, names = None):
+    results = {}
+    for name in (names or corpora):
+        results[name] = bench_corpus(name, scale, repeat)
+    return {
+        'python': platform.python_version(),
+        'pyparsing': bsv_grammar.pp.__version__,
+        'results': results,
+    }
+
+def check_synthetic(report, baseline = None, tolerance = 0.4, max_exponent = 1.5):
+    """Prints the synthetic benchmark report and returns the number of problems.
+
+    A corpus is a problem if it did not parse completely, if its parse time
+    grows faster than size^max_exponent, or if its lines per second dropped by
+    more than tolerance relative to the same corpus in baseline. Speeds are
+    compared by their relative_time, so baselines from a faster or slower
+    moment of the machine still compare."""
+    errors = 0
+    print('%-18s %-16s %7s %12s %10s %8s %6s  %s' % ('corpus', 'element', 'lines', 'lines/s', 'peak', 'in elem', 'exp', 'vs baseline'))
+    for (name, r) in report['results'].items():
+        status = []
+        if not r['ok']:
+            status.append('ERROR: found %d of %d declarations' % (r['declarations'], r['expected_declarations']))
+        if r['exponent'] > max_exponent:
+            status.append('ERROR: superlinear')
+        change = ''
+        if baseline is not None and name in baseline['results']:
+            ratio = baseline['results'][name]['relative_time'] / r['relative_time']
+            change = '%+.0f%%' % (100 * (ratio - 1))
+            if ratio < 1 - tolerance:
+                status.append('ERROR: regression')
+        errors += len(status)
+        print('%-18s %-16s %7d %12.0f %9.1fM %7.0f%% %6.2f  %s %s' % (name, r['element'], r['lines'], r['lines_per_sec'], r['peak_bytes'] / 1e6, 100 * r['element_share'], r['exponent'], change, ' '.join(status)))
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the bsv_doc_gen.py parser')
+    parser.add_argument('files', metavar = 'FILE', nargs = '*', help = 'bsv files to scan (default: the largest files in src/bsv)')
+    parser.add_argument('--largest', type = int, default = 5, help = 'number of files from src/bsv to use when no FILE is given')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'report the median of this many runs, after a warmup run')
+    parser.add_argument('--packrat', action = 'store_true', help = 'enable pyparsing packrat memoization')
+    parser.add_argument('--synthetic', action = 'store_true', help = 'benchmark generated corpora instead of files')
+    parser.add_argument('--corpus', action = 'append', choices = sorted(corpora), help = 'only run this synthetic corpus (can be repeated)')
+    parser.add_argument('--scale', type = int, default = 2, help = 'size of the synthetic corpora')
+    parser.add_argument('--json', metavar = 'FILE', help = 'write the synthetic results to FILE')
+    parser.add_argument('--baseline', metavar = 'FILE', help = 'compare the synthetic results with a previous --json FILE')
+    parser.add_argument('--tolerance', type = float, default = 0.4, help = 'allowed fractional slowdown relative to --baseline')
+    parser.add_argument('--max-exponent', type = float, default = 1.5, help = 'largest allowed exponent of parse time versus corpus size')
+    args = parser.parse_args()
+
+    if args.packrat:
+        bsv_grammar.pp.ParserElement.enablePackrat()
+    if args.synthetic:
+        report = bench_synthetic(args.scale, args.repeat, args.corpus)
+        baseline = None
+        if args.baseline is not None:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        errors = check_synthetic(report, baseline, args.tolerance, args.max_exponent)
+        if args.json is not None:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent = 2, sort_keys = True)
+                f.write('\n')
+        if errors > 0:
+            print('ERROR: Found ' + str(errors) + ' errors')
+            sys.exit(1)
+        sys.exit(0)
+    filenames = args.files
+    if len(filenames) == 0:
+        filenames = sorted(glob.glob(os.path.join(bsv_path, '*.bsv')), key = os.path.getsize, reverse = True)[:args.largest]
+    errors = bench_scan(filenames, args.repeat)
+    if errors > 0:
+        print('ERROR: Found ' + str(errors) + ' errors')
+        sys.exit(1)
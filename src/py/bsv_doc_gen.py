@@ -22,243 +22,327 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
+import glob
+import hashlib
+import multiprocessing
+import os
 import sys
-import re
-import pyparsing as pp
-
-# pp.ParserElement.setDefaultWhitespaceChars(' \t')
-
-# Testing infrastructure
-tests = []
-def add_tests(term, matches, no_matches):
-    global tests
-    tests += [(term, matches, no_matches)]
-def run_tests():
-    global tests
-    errors = 0
-    for (term, pass_examples, fail_examples) in tests:
-        for string in pass_examples:
-            try:
-                result = term.parseString(string, parseAll = True)
-                print(string + ' -> ' + str(result))
-            except:
-                print('ERROR: ' + string + ' -> no match')
-                errors += 1
-        for string in fail_examples:
+import time
+
+from file_util import write_if_changed
+
+# The grammar lives in bsv_grammar.py and is only imported when a file
+# actually has to be parsed. This keeps runs where every file is found in the
+# doc cache from paying for importing pyparsing and building the grammar.
+def _grammar():
+    import bsv_grammar
+    return bsv_grammar
+
+# markdown generation
+def gen_markdown(filename, file_data):
+    """Returns the markdown documentation for the bsv file filename.
+
+    filename is only used for the links back to the source, so it should be
+    the path to the file relative to the top of the repository."""
+    out = []
+    for d in _grammar().parse_bsv(file_data):
+        if d.kind == 'package':
+            out.append('# ' + d.name)
+        else:
+            heading = d.name
+            if d.kind == 'typedef':
+                # typedef headings have always shown the parsed name and type formals
+                heading = str([d.name, d.formal_args] if d.formal_args else [d.name])
+            out.append('### [' + heading + '](../../' + filename + '#L' + str(d.line) + ')')
+        if d.doc != '':
+            out.append(d.doc)
+        if d.kind != 'package':
+            out.append("```bluespec")
+            out.append(file_data[d.scan_start:d.span[1]])
+            out.append("```")
+        out.append('')
+    return ''.join(line + '\n' for line in out)
+
+def enable_packrat():
+    """Turns on pyparsing's packrat memoization for the grammar.
+
+    This is off by default. Declaration bodies are skipped with a regex and
+    scan only tries the grammar where a declaration can start, so there is
+    little backtracking left for memoization to save."""
+    _grammar().pp.ParserElement.enablePackrat()
+
+def _gen_markdown_timed(args):
+    (filename, file_data) = args
+    start = time.perf_counter()
+    markdown = gen_markdown(filename, file_data)
+    return (filename, markdown, time.perf_counter() - start)
+
+# doc cache
+_tool_version = None
+def tool_version():
+    """Returns a hash of the sources of the doc generator and its grammar.
+
+    Any edit to either file changes the version and invalidates every
+    entry in the doc cache."""
+    global _tool_version
+    if _tool_version is None:
+        h = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in ['bsv_doc_gen.py', 'bsv_grammar.py']:
+            with open(os.path.join(here, name), 'rb') as f:
+                h.update(f.read())
+        _tool_version = h.hexdigest()
+    return _tool_version
+
+class DocCache:
+    """Persistent on-disk cache of generated markdown.
+
+    Each source filename gets one slot in the cache directory, and each slot
+    holds at most one entry named by the hash of the tool version, the
+    filename (it appears in the generated links) and the source text. A
+    lookup with a matching hash returns the stored markdown without parsing
+    anything. Storing a new entry evicts whatever older entry the slot held."""
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(cachedir, exist_ok = True)
+
+    def _slot(self, filename):
+        return hashlib.sha256(filename.encode()).hexdigest()[:16]
+
+    def key(self, filename, file_data):
+        h = hashlib.sha256()
+        h.update(tool_version().encode())
+        h.update(b'\0' + filename.encode() + b'\0')
+        h.update(file_data.encode())
+        return h.hexdigest()
+
+    def _path(self, filename, key):
+        return os.path.join(self.cachedir, self._slot(filename) + '-' + key + '.md')
+
+    def get(self, filename, file_data):
+        """Returns the cached markdown for this file or None."""
+        try:
+            with open(self._path(filename, self.key(filename, file_data))) as f:
+                markdown = f.read()
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return markdown
+
+    def put(self, filename, file_data, markdown):
+        path = self._path(filename, self.key(filename, file_data))
+        for stale in glob.glob(os.path.join(self.cachedir, self._slot(filename) + '-*.md')):
+            if stale != path:
+                os.remove(stale)
+                self.evicted += 1
+        tmp = path + '.tmp%d' % os.getpid()
+        with open(tmp, 'w') as f:
+            f.write(markdown)
+        os.replace(tmp, path)
+
+    def stats(self):
+        return 'doc cache: %d hits, %d misses, %d evicted' % (self.hits, self.misses, self.evicted)
+
+def gen_markdown_batch(filenames, outdir, jobs = None, cache = None, packrat = False):
+    """Generates the markdown for each file in filenames into outdir.
+
+    Files found in cache (a DocCache or None) are written without parsing.
+    The remaining files are spread across a pool of jobs worker processes
+    (default: one per core). Each worker builds the grammar once when it
+    imports it, so the cost of importing pyparsing and constructing the
+    grammar is paid once per worker instead of once per file. If packrat is
+    True, packrat memoization is enabled in every process that parses. Output files
+    are only rewritten when their content changes. Returns a list of
+    (filename, output filename, elapsed seconds) tuples."""
+    os.makedirs(outdir, exist_ok = True)
+    def outname(filename):
+        return os.path.join(outdir, os.path.splitext(os.path.basename(filename))[0] + '.md')
+    results = []
+    file_data = {}
+    work = []
+    for filename in filenames:
+        start = time.perf_counter()
+        with open(filename) as f:
+            file_data[filename] = f.read()
+        markdown = cache.get(filename, file_data[filename]) if cache is not None else None
+        if markdown is None:
+            work.append(filename)
+        else:
+            write_if_changed(outname(filename), markdown)
+            results.append((filename, outname(filename), time.perf_counter() - start))
+    # largest files first so one big package doesn't end up last on one worker
+    work.sort(key = lambda filename: len(file_data[filename]), reverse = True)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(work)))
+    args = [(filename, file_data[filename]) for filename in work]
+    if jobs == 1:
+        if packrat and work:
+            enable_packrat()
+        rendered = map(_gen_markdown_timed, args)
+    else:
+        pool = multiprocessing.Pool(jobs, enable_packrat if packrat else None)
+        rendered = pool.imap_unordered(_gen_markdown_timed, args)
+    for (filename, markdown, elapsed) in rendered:
+        write_if_changed(outname(filename), markdown)
+        if cache is not None:
+            cache.put(filename, file_data[filename], markdown)
+        results.append((filename, outname(filename), elapsed))
+    if jobs != 1:
+        pool.close()
+        pool.join()
+    return results
+
+# watch mode
+def _snapshot(paths):
+    """Returns {filename: (mtime_ns, size)} for the bsv files in paths.
+
+    Directories in paths are searched for *.bsv files (not recursively)."""
+    snapshot = {}
+    for path in paths:
+        filenames = sorted(glob.glob(os.path.join(path, '*.bsv'))) if os.path.isdir(path) else [path]
+        for filename in filenames:
             try:
-                result = term.parseString(string, parseAll = True)
-                print('ERROR: ' + string + ' -> ' + str(result))
-                errors += 1
-            except:
-                print(string + ' -> no match')
-    return errors
-
-# BSV objects
-def parse_type(toks):
-    # print('type = ' + str(toks.asDict()))
-    # return [''.join(toks)]
-    return toks
-    
-
-    
-
-# BSV comments
-doc_comment=''
-def collect_doc(toks):
-    global doc_comment
-    block = ''.join(toks)
-    # block is entire comment block. Process it as necessary
-    block = re.sub(r'\ */// ?', '', block)
-    block = re.sub(r'\ */\** ?', '', block)
-    block = re.sub(r'\ *\* ?', '', block)
-    ### print(block)
-    doc_comment += '\n' + block
-def clear_doc():
-    global doc_comment
-    doc_comment = ''
-doc_block_comment_bsv = (~pp.Literal('/**/') + pp.Regex(r"/\*\*([^*]*\*+)+?/")).setName('doc block comment').setParseAction(collect_doc)
-doc_oneline_comment_bsv = ((pp.Literal('///') + pp.LineEnd()) | pp.Regex(r"///(\\\n|[^/])(\\\n|.)*")).setName('doc one line comment').setParseAction(collect_doc)
-block_comment_bsv = (~doc_block_comment_bsv + pp.Regex(r"/\*(?:[^*]*\*+)+?/")).setName('block comment').setParseAction(clear_doc)
-oneline_comment_bsv = (~doc_oneline_comment_bsv + pp.Regex(r"//(?:\\\n|.)*")).setName('one line comment').setParseAction(clear_doc)
-comment_bsv = doc_block_comment_bsv | doc_oneline_comment_bsv | block_comment_bsv | oneline_comment_bsv
-
-add_tests(oneline_comment_bsv, ['//', '//Hello, World!', '// Hello, World!', '////Hello, World!', '//// Hello, World!'], ['///', '///Hello, World!', '/// Hello, World!'])
-add_tests(doc_oneline_comment_bsv, ['///', '///Hello, World!', '/// Hello, World!'], ['//', '//Hello, World!', '// Hello, World!', '////Hello, World!', '//// Hello, World!'])
-
-# basic identifiers and literals
-Identifier_bsv = pp.Word(pp.srange('[A-Z]'), pp.srange('[a-zA-Z0-9$_]'))
-identifier_bsv = pp.Word(pp.srange('[a-z_]'), pp.srange('[a-zA-Z0-9$_]'))
-anyIdentifier_bsv = pp.Word(pp.srange('[a-zA-Z_]'), pp.srange('[a-zA-Z0-9$_]'))
-dec_literal_bsv = pp.Optional(pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('d')) + pp.Word(pp.srange('[0-9_]'))
-hex_literal_bsv = pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('h') + pp.Word(pp.srange('[0-9A-Fa-f_]'))
-oct_literal_bsv = pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('o') + pp.Word(pp.srange('[0-7_]'))
-bin_literal_bsv = pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('b') + pp.Word(pp.srange('[01_]'))
-int_literal_bsv = hex_literal_bsv | oct_literal_bsv | bin_literal_bsv | dec_literal_bsv | '\'0' | '\'1'
-
-# some tests
-add_tests(Identifier_bsv, ['Hello', 'World', 'A', 'ALL_CAPS', 'About_$3_50'], ['$display', 'a', '_TEST', '`Riscv', ''])
-add_tests(identifier_bsv, ['hello', 'world', 'a', 'aLMOST_ALL_CAPS', 'about_$3_50', '_TEST_', '_abc'], ['$display', 'A', '`Riscv', ''])
-add_tests(anyIdentifier_bsv, ['hello', 'Hello', 'HELLO', 'world'], [''])
-add_tests(dec_literal_bsv, ['0', '1', '2', '42'], ['1a', 'hello', 'world'])
-add_tests(int_literal_bsv, ['0', '1', '\'1', '\'0', '20152', "'hf0A", "201'hfff", "'b10110", "8'b11111111"], ["'b00101001012"])
-
-# tokens
-def token(x):
-    return pp.Suppress(pp.Literal(x))
-
-# keywords
-kw_package = pp.Keyword('package')
-kw_endpackage = pp.Keyword('endpackage')
-kw_import = pp.Keyword('import')
-kw_export = pp.Keyword('export')
-kw_module = pp.Keyword('module')
-kw_endmodule = pp.Keyword('endmodule')
-kw_typeclass = pp.Keyword('typeclass')
-kw_endtypeclass = pp.Keyword('endtypeclass')
-kw_instance = pp.Keyword('instance')
-kw_endinstance = pp.Keyword('endinstance')
-kw_function = pp.Keyword('function')
-kw_endfunction = pp.Keyword('endfunction')
-kw_type = pp.Keyword('type')
-kw_typedef = pp.Keyword('typedef')
-kw_enum = pp.Keyword('enum')
-kw_union = pp.Keyword('union')
-kw_tagged = pp.Keyword('tagged')
-kw_struct = pp.Keyword('struct')
-kw_numeric = pp.Keyword('numeric')
-kw_deriving = pp.Keyword('deriving')
-kw_provisos = pp.Keyword('provisos')
-kw_dependencies = pp.Keyword('dependencies')
-kw_determines = pp.Keyword('determines')
-
-add_tests(kw_module + ';', ['module;'], [])
-add_tests(kw_module + 's', [], ['modules'])
-add_tests(kw_module + '_', [], ['module_'])
-add_tests(kw_module + '2', [], ['module2'])
-
-# packages, imports, and exports
-#package_bsv = kw_package + Identifier_bsv + ';' + \
-#              pp.ZeroOrMore(~kw_endpackage + pp.Word(pp.printables)) + \
-#              kw_endpackage + pp.Optional(':' + Identifier_bsv)
-package_bsv = kw_package + Identifier_bsv('name') + ';'
-import_bsv = kw_import + Identifier_bsv + pp.Literal('::') + pp.Literal('*') + pp.Literal(';')
-export_bsv = kw_export + anyIdentifier_bsv + pp.Optional(pp.Literal('(') + pp.Literal('..') + pp.Literal(')')) + ';'
-
-# type
-type_bsv = pp.Forward()
-function_type_bsv = kw_function + type_bsv + identifier_bsv + token('(') + pp.delimitedList(type_bsv + identifier_bsv) + token(')')
-type_bsv <<     (function_type_bsv \
-            |   (pp.Optional(anyIdentifier_bsv('package') + '::') + anyIdentifier_bsv('name') + \
-                pp.Optional( pp.Suppress('#') + pp.Suppress('(') + pp.Group(pp.delimitedList(type_bsv, ','))('formal_args') + pp.Suppress(')') )) \
-            |   (int_literal_bsv('numeric'))).setParseAction(parse_type)
-
-add_tests(type_bsv, ['a', 'WriteReq', 'Bool', 'function Bit#(1) f(Bit#(1) x)', 'void', 'Bit#(2)', 'List::List#(t)', 'Vector#(2, Reg#(Bit#(32)))'], ['Vector#(2 Reg#(Bit#(5)))', 'A#(B#(C#(a))'])
-
-# terms used in typedef definitions
-union_member_bsv = pp.Forward()
-type_formal_bsv = pp.Optional(kw_numeric) + kw_type + identifier_bsv
-type_formals_bsv = token('#') + token('(') + pp.Group(pp.delimitedList(type_formal_bsv, ',')) + token(')')
-typedef_type_bsv = Identifier_bsv + pp.Optional(type_formals_bsv)
-deriving_bsv = pp.Optional(kw_deriving + token('(') + pp.Group(pp.delimitedList(Identifier_bsv, ',')) + token(')'), default = [])
-subunion_bsv = kw_union + kw_tagged + token('{') + pp.OneOrMore(union_member_bsv) + token('}')
-struct_member_bsv = (type_bsv + identifier_bsv + token(';')) | (subunion_bsv + Identifier_bsv + token(';'))
-substruct_bsv = kw_struct + token('{') + pp.OneOrMore(struct_member_bsv) + token('}')
-union_member_bsv << ((type_bsv + Identifier_bsv + token(';')) | (subunion_bsv + Identifier_bsv + token(';')) | (substruct_bsv + Identifier_bsv + token(';')))
-enum_element_bsv = Identifier_bsv + pp.Optional(token('=') + int_literal_bsv) # TODO also support [intLiteral] and [intLiteral:intLiteral]
-
-# typedefs
-basic_typedef_bsv = kw_typedef + type_bsv + typedef_type_bsv('name') + token(';');
-enum_typedef_bsv = kw_typedef + kw_enum + token('{') + pp.delimitedList(enum_element_bsv, ',') + token('}') + typedef_type_bsv('name') + deriving_bsv + token(';')
-struct_typedef_bsv = kw_typedef + kw_struct + token('{') + pp.OneOrMore(struct_member_bsv) + token('}') + typedef_type_bsv('name') + deriving_bsv + token(';')
-union_typedef_bsv = kw_typedef + kw_union + kw_tagged + token('{') + pp.OneOrMore(union_member_bsv) + token('}') + typedef_type_bsv('name') + deriving_bsv + token(';')
-typedef_bsv = basic_typedef_bsv | enum_typedef_bsv | struct_typedef_bsv | union_typedef_bsv
-
-# typedef tests
-add_tests(basic_typedef_bsv, ['typedef a MyA;'], ['typedef x y;'])
-
-# provisos
-provisos_bsv = pp.Optional(kw_provisos + token('(') + pp.Group(pp.delimitedList(type_bsv, ',')) + token(')'), default = [])
-
-# module
-module_bsv = kw_module + pp.Optional(token('[') + type_bsv + token(']')) + identifier_bsv('name') + \
-             pp.ZeroOrMore(~kw_endmodule + pp.Word(pp.printables)) + \
-             kw_endmodule + pp.Optional(token(':') + identifier_bsv)
-
-# module tests
-add_tests(module_bsv, ["module[m] mkTest(); endmodule : mkTest"], [])
-
-# function
-# functions can take function as arguments, and the syntax does not match "type_bsv + identifier_bsv" so I made the identifier optional
-function_bsv = pp.Forward()
-function_bsv << (kw_function + pp.Optional(type_bsv) + identifier_bsv('name') + pp.Optional( token('(') + pp.Group(pp.delimitedList(type_bsv + pp.Optional(identifier_bsv), ',')) + token(')'), default=[] )('args') + provisos_bsv + token(';') + \
-                pp.ZeroOrMore(pp.Group(function_bsv) | (~kw_endfunction + pp.Word(pp.printables))) + \
-                kw_endfunction + pp.Optional(token(':') + identifier_bsv))
-
-# typeclass
-type_list_bsv = identifier_bsv | (token('(') + pp.delimitedList(identifier_bsv, ',') + token(')'))
-type_depend_bsv = type_list_bsv + kw_determines + type_list_bsv
-type_depends_bsv = pp.Optional(kw_dependencies + token('(') + pp.delimitedList(type_depend_bsv, ',') + token(')'))
-typeclass_bsv = kw_typeclass + Identifier_bsv('name') + type_formals_bsv('formal_args') + provisos_bsv + type_depends_bsv + token(';') + \
-                pp.ZeroOrMore(~kw_endtypeclass + pp.Word(pp.printables)) + \
-                kw_endtypeclass + pp.Optional(token(':') + Identifier_bsv)
-
-# typeclass tests
-
-# instances
-instance_bsv = kw_instance + Identifier_bsv('name') + token('#') + token('(') + pp.Group(pp.delimitedList(type_bsv, ','))('formal_args') + token(')') + provisos_bsv + token(';') + \
-               pp.ZeroOrMore(~kw_endinstance + pp.Word(pp.printables)) + \
-               kw_endinstance + pp.Optional(token(':') + Identifier_bsv)
-
-# interface
-kw_interface = pp.Keyword('interface')
-kw_endinterface = pp.Keyword('endinterface')
-interface_bsv = kw_interface + Identifier_bsv('name') + pp.Optional(type_formals_bsv) + token(';') + \
-                pp.ZeroOrMore(~kw_endinterface + pp.Word(pp.printables)) + \
-                kw_endinterface + pp.Optional(token(':') + Identifier_bsv)
-
+                st = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            snapshot[filename] = (st.st_mtime_ns, st.st_size)
+    return snapshot
+
+def _regenerate(filenames, outdir, cache, log, verbose = True):
+    """Regenerates the markdown for filenames one file at a time.
+
+    A file that cannot be read or parsed, e.g. because an editor renamed it
+    away while saving, is logged and skipped so the watcher keeps going."""
+    for filename in filenames:
+        try:
+            results = gen_markdown_batch([filename], outdir, 1, cache)
+        except (OSError, ValueError, RecursionError, _grammar().pp.ParseBaseException) as e:
+            log.write('ERROR: %s: %s\n' % (filename, e))
+            continue
+        if verbose:
+            for (filename, outname, elapsed) in results:
+                log.write('%8.3fs  %s -> %s\n' % (elapsed, filename, outname))
+    log.flush()
+
+def watch_markdown(paths, outdir, cache = None, interval = 0.25, debounce = 0.1, log = sys.stderr):
+    """Keeps the markdown in outdir up to date with the bsv files in paths.
+
+    The grammar is built once up front and the files are polled every
+    interval seconds. After a change, the files are polled again every
+    debounce seconds until they stop changing, so that a burst of saves
+    (or an editor that writes a file in several steps) only regenerates
+    each changed file once. Runs until interrupted."""
+    _grammar()
+    snapshot = _snapshot(paths)
+    _regenerate(sorted(snapshot), outdir, cache, log, verbose = False)
+    log.write('watching %d files\n' % len(snapshot))
+    log.flush()
+    while True:
+        time.sleep(interval)
+        current = _snapshot(paths)
+        if current == snapshot:
+            continue
+        while True:
+            time.sleep(debounce)
+            settled = _snapshot(paths)
+            if settled == current:
+                break
+            current = settled
+        changed = sorted(f for f in current if snapshot.get(f) != current[f])
+        snapshot = current
+        # files can still disappear after the last poll
+        changed = [f for f in changed if os.path.exists(f)]
+        if len(changed) == 0:
+            continue
+        _regenerate(changed, outdir, cache, log)
+
+def profile_markdown(filenames, outdir = None, top = 15):
+    """Generates markdown for filenames in this process with every grammar
+    element instrumented and returns the profiler's hot-spot report.
+
+    Output files are written to outdir like gen_markdown_batch does, or
+    discarded if outdir is None. The doc cache is not used, since cache hits
+    would not be profiled."""
+    profiler = _grammar().GrammarProfiler()
+    profiler.attach()
+    try:
+        for filename in filenames:
+            with open(filename) as f:
+                file_data = f.read()
+            profiler.set_file(filename)
+            markdown = gen_markdown(filename, file_data)
+            if outdir is not None:
+                os.makedirs(outdir, exist_ok = True)
+                write_if_changed(os.path.join(outdir, os.path.splitext(os.path.basename(filename))[0] + '.md'), markdown)
+    finally:
+        profiler.detach()
+    return profiler.report(top)
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('ERROR: expected a bsv filename or --test')
-        exit(1)
-    if sys.argv[1] == '--test' or sys.argv[1] == '-test':
-        errors = run_tests()
+    parser = argparse.ArgumentParser(description = 'Generate markdown documentation for bsv files')
+    parser.add_argument('files', metavar = 'FILE', nargs = '*', help = 'bsv files to document')
+    parser.add_argument('--test', '-test', action = 'store_true', help = 'run the grammar tests')
+    parser.add_argument('-o', '--outdir', help = 'write FILE.md into OUTDIR for each FILE instead of printing to stdout')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of worker processes for --outdir (default: number of cores)')
+    parser.add_argument('--cache', metavar = 'DIR', help = 'reuse markdown cached in DIR for files whose source has not changed')
+    parser.add_argument('--packrat', action = 'store_true', help = 'enable pyparsing packrat memoization')
+    parser.add_argument('--profile', metavar = 'N', type = int, nargs = '?', const = 15, help = 'parse the files in a single process with every grammar element instrumented and print the N hottest elements (default: 15)')
+    parser.add_argument('--watch', action = 'store_true', help = 'keep regenerating docs into --outdir as the files (or *.bsv files in directories) change')
+    parser.add_argument('--interval', type = float, default = 0.25, help = 'polling interval in seconds for --watch')
+    args = parser.parse_args()
+
+    if args.test:
+        errors = _grammar().run_tests()
+        errors += _grammar().check_profiler()
         if errors > 0:
             print('ERROR: Found ' + str(errors) + ' errors')
             exit(1)
         else:
             exit(0)
-    with open(sys.argv[1]) as f:
-        file_data = f.read()
-        # scan_result = (typedef_bsv | typeclass_bsv | instance_bsv | module_bsv).ignore(comment_bsv).scanString(file_data)
-        def save_doc_comment(toks):
-            global doc_comment
-            try:
-                toks.insert(0, doc_comment)
-                doc_comment = ''
-                return toks
-            except TypeError as e:
-                print('ERROR: type error in save_doc_comment: ' + str(e))
-                print('type(toks) = ' + str(type(toks)))
-                exit(1)
-        scan_result = (comment_bsv | (package_bsv | typedef_bsv | interface_bsv | typeclass_bsv | instance_bsv | module_bsv | function_bsv).addParseAction(save_doc_comment)).scanString(file_data)
-        for (x, y, z) in scan_result:
-            if 'name' in x:
-                line = pp.lineno(y, file_data)
-                if x[1] == 'package':
-                    print('# ' + str(x['name']))
-                elif 'formal_args' in x:
-                    # print('## ' + str(x['name']) + '#(' + str(x['formal_args']) + ')')
-                    # print('### ' + str(x['name']))
-                    print('### [' + str(x['name']) + '](../../' + sys.argv[1] + '#L' + str(line) + ')')
-                else:
-                    # print('### ' + str(x['name']))
-                    print('### [' + str(x['name']) + '](../../' + sys.argv[1] + '#L' + str(line) + ')')
-                if x[0] != '':
-                    print(x[0])
-                if x[1] != 'package':
-                    print("```bluespec")
-                    print(file_data[y:z])
-                    print("```")
-                print('')
-        
+    if len(args.files) == 0:
+        print('ERROR: expected a bsv filename or --test')
+        exit(1)
+    if args.profile is not None:
+        if args.packrat:
+            enable_packrat()
+        sys.stderr.write(profile_markdown(args.files, args.outdir, args.profile))
+        exit(0)
+    cache = DocCache(args.cache) if args.cache is not None else None
+    if args.watch:
+        if args.outdir is None:
+            print('ERROR: --watch requires --outdir')
+            exit(1)
+        try:
+            watch_markdown(args.files, args.outdir, cache, args.interval)
+        except KeyboardInterrupt:
+            exit(0)
+    if args.outdir is None:
+        if len(args.files) != 1:
+            print('ERROR: expected a single bsv filename without --outdir')
+            exit(1)
+        with open(args.files[0]) as f:
+            file_data = f.read()
+        markdown = cache.get(args.files[0], file_data) if cache is not None else None
+        if markdown is None:
+            if args.packrat:
+                enable_packrat()
+            markdown = gen_markdown(args.files[0], file_data)
+            if cache is not None:
+                cache.put(args.files[0], file_data, markdown)
+        sys.stdout.write(markdown)
+        exit(0)
+
+    start = time.perf_counter()
+    results = gen_markdown_batch(args.files, args.outdir, args.jobs, cache, args.packrat)
+    total = time.perf_counter() - start
+    for (filename, outname, elapsed) in sorted(results, key = lambda r: r[2], reverse = True):
+        sys.stderr.write('%8.3fs  %s -> %s\n' % (elapsed, filename, outname))
+    sys.stderr.write('%8.3fs  total for %d files (%.3fs summed over files)\n' % (total, len(results), sum(r[2] for r in results)))
+    if cache is not None:
+        sys.stderr.write(cache.stats() + '\n')
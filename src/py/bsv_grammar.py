@@ -0,0 +1,535 @@
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# pyparsing grammar for the parts of BSV that bsv_doc_gen.py documents. This is
+# kept separate from bsv_doc_gen.py so that tools can avoid importing pyparsing
+# and building the grammar when they don't need to parse anything.
+
+import re
+import threading
+import time
+import pyparsing as pp
+
+# pp.ParserElement.setDefaultWhitespaceChars(' \t')
+
+# Testing infrastructure
+tests = []
+def add_tests(term, matches, no_matches):
+    global tests
+    tests += [(term, matches, no_matches)]
+def run_tests():
+    global tests
+    errors = 0
+    for (term, pass_examples, fail_examples) in tests:
+        for string in pass_examples:
+            try:
+                result = term.parseString(string, parseAll = True)
+                print(string + ' -> ' + str(result))
+            except:
+                print('ERROR: ' + string + ' -> no match')
+                errors += 1
+        for string in fail_examples:
+            try:
+                result = term.parseString(string, parseAll = True)
+                print('ERROR: ' + string + ' -> ' + str(result))
+                errors += 1
+            except:
+                print(string + ' -> no match')
+    return errors
+
+# BSV objects
+def parse_type(toks):
+    # print('type = ' + str(toks.asDict()))
+    # return [''.join(toks)]
+    return toks
+    
+
+    
+
+# Giving an element a results name, as in Identifier_bsv('name'), uses a copy
+# of it (and of its sub-expressions) in the grammar. Elements that are copied
+# this way get a name with setName, which the copies keep, so GrammarProfiler
+# can tell which element a copy was made from.
+
+# BSV comments
+# Doc comments ("/** */" and "///") that directly precede a declaration are
+# that declaration's documentation. Any other comment in between discards
+# the doc comments seen so far. This is tracked by parse_bsv, so the comment
+# terms themselves have no parse actions.
+def doc_comment_text(toks):
+    block = ''.join(toks)
+    # block is entire comment block. Process it as necessary
+    block = re.sub(r'\ */// ?', '', block)
+    block = re.sub(r'\ */\** ?', '', block)
+    block = re.sub(r'\ *\* ?', '', block)
+    return block
+doc_block_comment_bsv = (~pp.Literal('/**/') + pp.Regex(r"/\*\*([^*]*\*+)+?/")).setName('doc block comment')
+doc_oneline_comment_bsv = ((pp.Literal('///') + pp.LineEnd()) | pp.Regex(r"///(\\\n|[^/])(\\\n|.)*")).setName('doc one line comment')
+block_comment_bsv = (~doc_block_comment_bsv + pp.Regex(r"/\*(?:[^*]*\*+)+?/")).setName('block comment')
+oneline_comment_bsv = (~doc_oneline_comment_bsv + pp.Regex(r"//(?:\\\n|.)*")).setName('one line comment')
+# Streamlining merges a nested MatchFirst into the MatchFirst that contains it
+# when the outer one has just two alternatives. Alternatives is a MatchFirst
+# that keeps them, so elements like doc_oneline_comment_bsv, comment_bsv and
+# declaration_bsv stay separate elements that GrammarProfiler can time.
+class Alternatives(pp.MatchFirst):
+    pass
+
+comment_bsv = Alternatives([doc_block_comment_bsv, doc_oneline_comment_bsv])('doc_comment') | Alternatives([block_comment_bsv, oneline_comment_bsv])('comment')
+
+add_tests(oneline_comment_bsv, ['//', '//Hello, World!', '// Hello, World!', '////Hello, World!', '//// Hello, World!'], ['///', '///Hello, World!', '/// Hello, World!'])
+add_tests(doc_oneline_comment_bsv, ['///', '///Hello, World!', '/// Hello, World!'], ['//', '//Hello, World!', '// Hello, World!', '////Hello, World!', '//// Hello, World!'])
+
+# basic identifiers and literals
+Identifier_bsv = pp.Word(pp.srange('[A-Z]'), pp.srange('[a-zA-Z0-9$_]')).setName('Identifier')
+identifier_bsv = pp.Word(pp.srange('[a-z_]'), pp.srange('[a-zA-Z0-9$_]')).setName('identifier')
+anyIdentifier_bsv = pp.Word(pp.srange('[a-zA-Z_]'), pp.srange('[a-zA-Z0-9$_]')).setName('any identifier')
+dec_literal_bsv = (pp.Optional(pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('d')) + pp.Word(pp.srange('[0-9_]'))).setName('decimal literal')
+hex_literal_bsv = (pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('h') + pp.Word(pp.srange('[0-9A-Fa-f_]'))).setName('hex literal')
+oct_literal_bsv = (pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('o') + pp.Word(pp.srange('[0-7_]'))).setName('octal literal')
+bin_literal_bsv = (pp.Optional(pp.Word(pp.nums)) + '\'' + pp.CaselessLiteral('b') + pp.Word(pp.srange('[01_]'))).setName('binary literal')
+int_literal_bsv = (hex_literal_bsv | oct_literal_bsv | bin_literal_bsv | dec_literal_bsv | '\'0' | '\'1').setName('integer literal')
+
+# some tests
+add_tests(Identifier_bsv, ['Hello', 'World', 'A', 'ALL_CAPS', 'About_$3_50'], ['$display', 'a', '_TEST', '`Riscv', ''])
+add_tests(identifier_bsv, ['hello', 'world', 'a', 'aLMOST_ALL_CAPS', 'about_$3_50', '_TEST_', '_abc'], ['$display', 'A', '`Riscv', ''])
+add_tests(anyIdentifier_bsv, ['hello', 'Hello', 'HELLO', 'world'], [''])
+add_tests(dec_literal_bsv, ['0', '1', '2', '42'], ['1a', 'hello', 'world'])
+add_tests(int_literal_bsv, ['0', '1', '\'1', '\'0', '20152', "'hf0A", "201'hfff", "'b10110", "8'b11111111"], ["'b00101001012"])
+
+# tokens
+def token(x):
+    return pp.Suppress(pp.Literal(x))
+
+# keywords
+kw_package = pp.Keyword('package')
+kw_endpackage = pp.Keyword('endpackage')
+kw_import = pp.Keyword('import')
+kw_export = pp.Keyword('export')
+kw_module = pp.Keyword('module')
+kw_endmodule = pp.Keyword('endmodule')
+kw_typeclass = pp.Keyword('typeclass')
+kw_endtypeclass = pp.Keyword('endtypeclass')
+kw_instance = pp.Keyword('instance')
+kw_endinstance = pp.Keyword('endinstance')
+kw_function = pp.Keyword('function')
+kw_endfunction = pp.Keyword('endfunction')
+kw_type = pp.Keyword('type')
+kw_typedef = pp.Keyword('typedef')
+kw_enum = pp.Keyword('enum')
+kw_union = pp.Keyword('union')
+kw_tagged = pp.Keyword('tagged')
+kw_struct = pp.Keyword('struct')
+kw_numeric = pp.Keyword('numeric')
+kw_deriving = pp.Keyword('deriving')
+kw_provisos = pp.Keyword('provisos')
+kw_dependencies = pp.Keyword('dependencies')
+kw_determines = pp.Keyword('determines')
+
+add_tests(kw_module + ';', ['module;'], [])
+add_tests(kw_module + 's', [], ['modules'])
+add_tests(kw_module + '_', [], ['module_'])
+add_tests(kw_module + '2', [], ['module2'])
+
+# declaration bodies
+# Bodies of modules, interfaces, typeclasses, instances, and functions are not
+# parsed. They are skipped one whitespace-separated word at a time until the
+# matching end keyword. body_words_bsv matches a whole run of such words with
+# a single regex instead of a pp.Word with a keyword lookahead for every word.
+# It returns the same tokens as pp.ZeroOrMore(~kw + pp.Word(pp.printables))
+# where kw is any of stop_keywords.
+def body_words_bsv(*stop_keywords, min_words = 0):
+    word = r'(?!(?:%s)(?![A-Za-z0-9_$]))[!-~]+[ \t\n\r]*' % '|'.join(stop_keywords)
+    return pp.Regex('(?:%s)%s' % (word, '*' if min_words == 0 else '+')).setParseAction(lambda toks: toks[0].split())
+
+add_tests(body_words_bsv('endmodule') + kw_endmodule, ['endmodule', 'a b; c endmodule', 'x.endmodule endmodule', 'endmodulex endmodule'], ['a b c', 'a endmodule b'])
+
+# packages, imports, and exports
+#package_bsv = kw_package + Identifier_bsv + ';' + \
+#              pp.ZeroOrMore(~kw_endpackage + pp.Word(pp.printables)) + \
+#              kw_endpackage + pp.Optional(':' + Identifier_bsv)
+package_bsv = kw_package + Identifier_bsv('name') + ';'
+import_bsv = kw_import + Identifier_bsv + pp.Literal('::') + pp.Literal('*') + pp.Literal(';')
+export_bsv = kw_export + anyIdentifier_bsv + pp.Optional(pp.Literal('(') + pp.Literal('..') + pp.Literal(')')) + ';'
+add_tests(import_bsv, ['import Vector::*;', 'import  Ehr :: * ;'], ['import "BVI" EHR_2 =', 'import vector::*;', 'import Vector::mkVector;'])
+
+# type
+type_bsv = pp.Forward()
+function_type_bsv = kw_function + type_bsv + identifier_bsv + token('(') + pp.delimitedList(type_bsv + identifier_bsv) + token(')')
+type_bsv <<     (function_type_bsv \
+            |   (pp.Optional(anyIdentifier_bsv('package') + '::') + anyIdentifier_bsv('name') + \
+                pp.Optional( pp.Suppress('#') + pp.Suppress('(') + pp.Group(pp.delimitedList(type_bsv, ','))('formal_args') + pp.Suppress(')') )) \
+            |   (int_literal_bsv('numeric'))).setParseAction(parse_type)
+
+add_tests(type_bsv, ['a', 'WriteReq', 'Bool', 'function Bit#(1) f(Bit#(1) x)', 'void', 'Bit#(2)', 'List::List#(t)', 'Vector#(2, Reg#(Bit#(32)))'], ['Vector#(2 Reg#(Bit#(5)))', 'A#(B#(C#(a))'])
+
+# terms used in typedef definitions
+union_member_bsv = pp.Forward()
+type_formal_bsv = pp.Optional(kw_numeric) + kw_type + identifier_bsv
+type_formals_bsv = (token('#') + token('(') + pp.Group(pp.delimitedList(type_formal_bsv, ',')) + token(')')).setName('type formals')
+typedef_type_bsv = (Identifier_bsv + pp.Optional(type_formals_bsv)).setName('typedef type')
+deriving_bsv = pp.Optional(kw_deriving + token('(') + pp.Group(pp.delimitedList(Identifier_bsv, ',')) + token(')'), default = [])
+subunion_bsv = kw_union + kw_tagged + token('{') + pp.OneOrMore(union_member_bsv) + token('}')
+struct_member_bsv = (type_bsv + identifier_bsv + token(';')) | (subunion_bsv + Identifier_bsv + token(';'))
+substruct_bsv = kw_struct + token('{') + pp.OneOrMore(struct_member_bsv) + token('}')
+union_member_bsv << ((type_bsv + Identifier_bsv + token(';')) | (subunion_bsv + Identifier_bsv + token(';')) | (substruct_bsv + Identifier_bsv + token(';')))
+enum_element_bsv = Identifier_bsv + pp.Optional(token('=') + int_literal_bsv) # TODO also support [intLiteral] and [intLiteral:intLiteral]
+
+# typedefs
+basic_typedef_bsv = kw_typedef + type_bsv + typedef_type_bsv('name') + token(';');
+enum_typedef_bsv = kw_typedef + kw_enum + token('{') + pp.delimitedList(enum_element_bsv, ',') + token('}') + typedef_type_bsv('name') + deriving_bsv + token(';')
+struct_typedef_bsv = kw_typedef + kw_struct + token('{') + pp.OneOrMore(struct_member_bsv) + token('}') + typedef_type_bsv('name') + deriving_bsv + token(';')
+union_typedef_bsv = kw_typedef + kw_union + kw_tagged + token('{') + pp.OneOrMore(union_member_bsv) + token('}') + typedef_type_bsv('name') + deriving_bsv + token(';')
+typedef_bsv = basic_typedef_bsv | enum_typedef_bsv | struct_typedef_bsv | union_typedef_bsv
+
+# typedef tests
+add_tests(basic_typedef_bsv, ['typedef a MyA;'], ['typedef x y;'])
+
+# provisos
+provisos_bsv = pp.Optional(kw_provisos + token('(') + pp.Group(pp.delimitedList(type_bsv, ',')) + token(')'), default = [])
+
+# module
+module_bsv = kw_module + pp.Optional(token('[') + type_bsv + token(']')) + identifier_bsv('name') + \
+             body_words_bsv('endmodule') + \
+             kw_endmodule + pp.Optional(token(':') + identifier_bsv)
+
+# module tests
+add_tests(module_bsv, ["module[m] mkTest(); endmodule : mkTest"], [])
+
+# function
+# functions can take function as arguments, and the syntax does not match "type_bsv + identifier_bsv" so I made the identifier optional
+function_bsv = pp.Forward()
+function_bsv << (kw_function + pp.Optional(type_bsv) + identifier_bsv('name') + pp.Optional( token('(') + pp.Group(pp.delimitedList(type_bsv + pp.Optional(identifier_bsv), ',')) + token(')'), default=[] )('args') + provisos_bsv + token(';') + \
+                pp.ZeroOrMore(body_words_bsv('function', 'endfunction', min_words = 1) | pp.Group(function_bsv) | (~kw_endfunction + pp.Word(pp.printables))) + \
+                kw_endfunction + pp.Optional(token(':') + identifier_bsv))
+
+# typeclass
+type_list_bsv = identifier_bsv | (token('(') + pp.delimitedList(identifier_bsv, ',') + token(')'))
+type_depend_bsv = type_list_bsv + kw_determines + type_list_bsv
+type_depends_bsv = pp.Optional(kw_dependencies + token('(') + pp.delimitedList(type_depend_bsv, ',') + token(')'))
+typeclass_bsv = kw_typeclass + Identifier_bsv('name') + type_formals_bsv('formal_args') + provisos_bsv + type_depends_bsv + token(';') + \
+                body_words_bsv('endtypeclass') + \
+                kw_endtypeclass + pp.Optional(token(':') + Identifier_bsv)
+
+# typeclass tests
+
+# instances
+instance_bsv = kw_instance + Identifier_bsv('name') + token('#') + token('(') + pp.Group(pp.delimitedList(type_bsv, ','))('formal_args') + token(')') + provisos_bsv + token(';') + \
+               body_words_bsv('endinstance') + \
+               kw_endinstance + pp.Optional(token(':') + Identifier_bsv)
+
+# interface
+kw_interface = pp.Keyword('interface')
+kw_endinterface = pp.Keyword('endinterface')
+interface_bsv = kw_interface + Identifier_bsv('name') + pp.Optional(type_formals_bsv('formal_args')) + token(';') + \
+                body_words_bsv('endinterface') + \
+                kw_endinterface + pp.Optional(token(':') + Identifier_bsv)
+
+
+# top-level scanner for doc generation
+# scan_bsv = (typedef_bsv | typeclass_bsv | instance_bsv | module_bsv).ignore(comment_bsv)
+declaration_bsv = pp.MatchFirst([package_bsv, typedef_bsv, interface_bsv, typeclass_bsv, instance_bsv, module_bsv, function_bsv])
+scan_bsv = Alternatives([comment_bsv, declaration_bsv])
+scan_bsv.streamline()
+
+# scan_bsv can only match where a comment or one of the declaration keywords
+# starts, or in the whitespace right in front of one, so scan only tries it at
+# those offsets instead of at every character like scanString does.
+scan_start_re = re.compile(r'/|(?<![A-Za-z0-9_$])(?:package|typedef|interface|typeclass|instance|module|function)(?![A-Za-z0-9_$])')
+
+# pyparsing's packrat cache is shared by the whole process, so resetting it
+# and parsing with it are serialized across threads. The lock is not held
+# while scan yields, so scans can also be interleaved in one thread.
+_parse_lock = threading.Lock()
+
+def scan(file_data, expr = scan_bsv, start_re = scan_start_re):
+    """Yields the same (tokens, start, end) tuples as expr.scanString(file_data).
+
+    start_re must match everywhere expr can start matching."""
+    instring = file_data.expandtabs()
+    with _parse_lock:
+        pp.ParserElement.resetCache()
+    loc = 0
+    m = start_re.search(instring)
+    while m:
+        # scanString would have reached this match from the first whitespace
+        # character in front of it that it tried
+        start = m.start()
+        while start > loc and instring[start - 1] in ' \n\t\r':
+            start -= 1
+        start = expr.preParse(instring, start)
+        try:
+            with _parse_lock:
+                (end, toks) = expr._parse(instring, start, callPreParse = False)
+        except pp.ParseException:
+            loc = m.start() + 1
+            m = start_re.search(instring, loc)
+            continue
+        yield (toks, start, end)
+        loc = end
+        m = start_re.search(instring, loc)
+
+# exports
+scan_exports_bsv = Alternatives([comment_bsv, export_bsv])
+scan_exports_bsv.streamline()
+scan_exports_start_re = re.compile(r'/|(?<![A-Za-z0-9_$])export(?![A-Za-z0-9_$])')
+
+def parse_exports(text):
+    """Returns the list of identifiers exported by export statements in text."""
+    exports = []
+    for (toks, start, end) in scan(text, scan_exports_bsv, scan_exports_start_re):
+        if 'comment' not in toks and 'doc_comment' not in toks:
+            exports.append(toks[1])
+    return exports
+
+scan_imports_bsv = Alternatives([comment_bsv, import_bsv])
+scan_imports_bsv.streamline()
+scan_imports_start_re = re.compile(r'/|(?<![A-Za-z0-9_$])import(?![A-Za-z0-9_$])')
+
+def parse_imports(text):
+    """Returns the list of packages imported by import statements in text.
+
+    Imports inside `ifdef blocks are included."""
+    imports = []
+    for (toks, start, end) in scan(text, scan_imports_bsv, scan_imports_start_re):
+        if 'comment' not in toks and 'doc_comment' not in toks:
+            imports.append(toks[1])
+    return imports
+
+# declarations
+class Declaration:
+    """A top-level declaration found by parse_bsv.
+
+    kind is the keyword that starts the declaration ('package', 'typedef',
+    'interface', 'typeclass', 'instance', 'module', or 'function'), name is
+    the declared identifier, and formal_args is the list of parsed formal
+    parameter tokens (type formals for typedefs, interfaces, and typeclasses,
+    instance arguments for instances, and argument types and names for
+    functions). line is the line number of the declaration's first keyword,
+    span is its (start, end) offsets in the text with tabs expanded like
+    pyparsing does, and doc is its doc comment or ''. scan_start is the offset
+    where scan matched the declaration, which includes the whitespace in
+    front of it."""
+    __slots__ = ('kind', 'name', 'formal_args', 'line', 'span', 'doc', 'scan_start')
+
+    def __init__(self, kind, name, formal_args, line, span, doc, scan_start = None):
+        self.kind = kind
+        self.name = name
+        self.formal_args = formal_args
+        self.line = line
+        self.span = span
+        self.doc = doc
+        self.scan_start = span[0] if scan_start is None else scan_start
+
+    def __repr__(self):
+        return 'Declaration(%r, %r, %r, %r, %r, %r)' % (self.kind, self.name, self.formal_args, self.line, self.span, self.doc)
+
+def declaration(toks, line, start, end, doc, scan_start = None):
+    """Returns the Declaration for the declaration_bsv tokens toks."""
+    kind = toks[0]
+    name = toks['name']
+    formal_args = []
+    if kind == 'typedef':
+        # typedef_type_bsv puts the type formals into the name
+        if len(name) > 1:
+            formal_args = name[1].asList()
+        name = name[0]
+    elif kind == 'typeclass':
+        formal_args = toks['formal_args'][0].asList()
+    elif kind == 'interface':
+        if 'formal_args' in toks:
+            formal_args = toks['formal_args'][0].asList()
+    elif kind == 'instance':
+        formal_args = toks['formal_args'].asList()
+    elif kind == 'function':
+        formal_args = toks['args'].asList()
+    return Declaration(kind, str(name), formal_args, line, (start, end), doc, scan_start)
+
+leading_space_re = re.compile(r'[ \n\t\r]*')
+
+def parse_bsv(text):
+    """Yields a Declaration for each top-level declaration in text.
+
+    All state of a parse is local to the generator, so several files can be
+    parsed at the same time, including from different threads, where the
+    individual parse steps are serialized by scan."""
+    doc = ''
+    instring = text.expandtabs()
+    # line numbers are counted incrementally since pp.lineno counts from the
+    # start of instring every time
+    (line, line_loc) = (1, 0)
+    for (toks, start, end) in scan(instring):
+        if 'doc_comment' in toks:
+            doc += '\n' + doc_comment_text(toks)
+        elif 'comment' in toks:
+            doc = ''
+        else:
+            # scan includes the whitespace in front of the declaration
+            decl_start = leading_space_re.match(instring, start).end()
+            line += instring.count('\n', line_loc, decl_start)
+            line_loc = decl_start
+            yield declaration(toks, line, decl_start, end, doc, start)
+            doc = ''
+
+# profiling
+class GrammarProfiler:
+    """Counts and times parse attempts of every module-level grammar element.
+
+    attach() installs pyparsing debug actions on each *_bsv element in this
+    module that the scanners use, and on the copies of them made by giving
+    them a results name, so it affects every parse in the process until
+    detach() is called. Self time excludes time spent in
+    other instrumented elements. Cumulative time includes it, but only counts
+    the outermost attempt of a recursive element like type_bsv or
+    function_bsv. Statistics are kept per file, as set by set_file()."""
+    scanners = ['scan_bsv', 'scan_exports_bsv', 'scan_imports_bsv']
+
+    def __init__(self):
+        module = globals()
+        names = {}
+        copy_names = {}
+        for (name, expr) in module.items():
+            if name.endswith('_bsv') and isinstance(expr, pp.ParserElement):
+                names[id(expr)] = name
+                if expr.customName is not None:
+                    copy_names[expr.customName] = name
+        def original(expr):
+            if id(expr) in names:
+                return names[id(expr)]
+            return copy_names.get(expr.customName)
+        # walk the expressions the scanners actually parse with
+        self.elements = {}
+        self.instrumented = []
+        seen = set()
+        todo = [module[name] for name in self.scanners]
+        while todo:
+            expr = todo.pop()
+            if id(expr) in seen:
+                continue
+            seen.add(id(expr))
+            name = original(expr)
+            if name is not None:
+                self.elements[id(expr)] = name
+                self.instrumented.append(expr)
+            todo += getattr(expr, 'exprs', [])
+            if getattr(expr, 'expr', None) is not None:
+                todo.append(expr.expr)
+        self.stats = {}
+        self.file = None
+        self.stack = []
+        self.active = {}
+
+    def set_file(self, filename):
+        self.file = filename
+
+    def _start(self, instring, loc, expr, *args):
+        self.stack.append([expr, time.perf_counter(), 0.0])
+        name = self.elements[id(expr)]
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def _end(self, expr, success):
+        (expr, start, child_time) = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        name = self.elements[id(expr)]
+        self.active[name] -= 1
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        key = (self.file, name)
+        s = self.stats.get(key)
+        if s is None:
+            # attempts, successes, failures, self time, cumulative time
+            s = self.stats[key] = [0, 0, 0, 0.0, 0.0]
+        s[0] += 1
+        s[1 if success else 2] += 1
+        s[3] += elapsed - child_time
+        if self.active[name] == 0:
+            s[4] += elapsed
+
+    def _success(self, instring, startloc, endloc, expr, toks, *args):
+        self._end(expr, True)
+
+    def _exception(self, instring, loc, expr, exc, *args):
+        self._end(expr, False)
+
+    def attach(self):
+        for expr in self.instrumented:
+            expr.setDebugActions(self._start, self._success, self._exception)
+
+    def detach(self):
+        for expr in self.instrumented:
+            expr.setDebug(False)
+
+    def totals(self, filename = None):
+        """Returns {element: [attempts, successes, failures, self, cumulative]}
+        summed over all files, or for just filename."""
+        totals = {}
+        for ((f, name), s) in self.stats.items():
+            if filename is None or f == filename:
+                t = totals.setdefault(name, [0, 0, 0, 0.0, 0.0])
+                for i in range(5):
+                    t[i] += s[i]
+        return totals
+
+    def report(self, top = 15):
+        """Returns the hot-spot report as a string."""
+        def table(totals, limit):
+            rows = sorted(totals.items(), key = lambda item: item[1][3], reverse = True)[:limit]
+            return ['%-28s %10d %10d %10d %9.4fs %9.4fs' % ((name,) + tuple(s)) for (name, s) in rows]
+        out = ['%-28s %10s %10s %10s %10s %10s' % ('element', 'attempts', 'successes', 'failures', 'self', 'cumulative')]
+        out += table(self.totals(), top)
+        files = sorted(set(f for (f, name) in self.stats), key = lambda f: sum(s[3] for s in self.totals(f).values()), reverse = True)
+        for f in files:
+            totals = self.totals(f)
+            out.append('')
+            out.append('%s: %.4fs in instrumented elements' % (f, sum(s[3] for s in totals.values())))
+            out += table(totals, 5)
+        return '\n'.join(out) + '\n'
+
+profile_test_bsv = '''package ProfileTest;
+/// One line doc comment
+typedef Bit#(8) Byte;
+/** Block doc comment */
+interface Foo;
+endinterface
+// plain comment
+/* plain block comment */
+module mkFoo(Foo);
+endmodule
+endpackage
+'''
+
+def check_profiler():
+    """Profiles a parse of profile_test_bsv and checks that the comment and
+    declaration elements are counted. Returns the number of errors."""
+    profiler = GrammarProfiler()
+    profiler.attach()
+    try:
+        for d in parse_bsv(profile_test_bsv):
+            pass
+    finally:
+        profiler.detach()
+    totals = profiler.totals()
+    errors = 0
+    for name in ['comment_bsv', 'doc_block_comment_bsv', 'doc_oneline_comment_bsv', 'block_comment_bsv', 'oneline_comment_bsv', 'declaration_bsv', 'typedef_bsv', 'interface_bsv', 'module_bsv']:
+        if totals.get(name, [0, 0])[1] == 0:
+            print('ERROR: the profiler did not count any successful parse of ' + name)
+            errors += 1
+    return errors
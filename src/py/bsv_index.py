@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Cross-package symbol index for bsv files.
+#
+# The index is a single SQLite database with one row per top-level
+# declaration found by bsv_grammar.parse_bsv. Updating the index only reparses
+# files whose size or mtime changed and whose content hash differs from the
+# indexed one. Queries never import pyparsing, so they stay fast.
+#
+# Examples:
+#   bsv_index.py update src/bsv
+#   bsv_index.py query mkPerfMonitor
+#   bsv_index.py query 'mkVerilogEHR*' --kind module
+
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+
+default_db = os.path.join('build', 'bsv_index.db')
+
+schema = '''
+create table if not exists files (
+    path text primary key,
+    package text,
+    mtime_ns integer,
+    size integer,
+    hash text
+);
+create table if not exists decls (
+    path text references files(path),
+    name text,
+    kind text,
+    line integer,
+    exported integer
+);
+create index if not exists decls_name on decls(name);
+create index if not exists decls_path on decls(path);
+'''
+
+# Bump this when index_file changes what it stores, so existing indexes are
+# rebuilt instead of keeping rows from the old version for unchanged files.
+index_version = 2
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+def index_file(path):
+    """Parses path and returns (path, hash, package, decls).
+
+    decls is a list of (name, kind, line, exported) tuples. A declaration is
+    exported if the package has no export statements or if it is listed in
+    one of them."""
+    import bsv_grammar
+    with open(path, 'rb') as f:
+        data = f.read()
+    text = data.decode()
+    exports = set(bsv_grammar.parse_exports(text))
+    package = None
+    decls = []
+    for d in bsv_grammar.parse_bsv(text):
+        if d.kind == 'package':
+            package = d.name
+        else:
+            decls.append((d.name, d.kind, d.line, int(len(exports) == 0 or d.name in exports)))
+    return (path, _hash(data), package, decls)
+
+class SymbolIndex:
+    """On-disk index of the declarations in a set of bsv files."""
+    def __init__(self, db):
+        if os.path.dirname(db) != '':
+            os.makedirs(os.path.dirname(db), exist_ok = True)
+        self.conn = sqlite3.connect(db)
+        if self.conn.execute('pragma user_version').fetchone()[0] != index_version:
+            self.conn.executescript('drop table if exists decls; drop table if exists files;')
+            self.conn.execute('pragma user_version = %d' % index_version)
+        self.conn.executescript(schema)
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, roots, jobs = None):
+        """Brings the index up to date with the bsv files under roots.
+
+        roots may contain both directories and files. Files that were
+        indexed under one of the roots and no longer exist are dropped, and
+        a root that does not exist counts as a removed file or directory.
+        Returns (number of files reparsed, number unchanged, number removed)."""
+        paths = set()
+        for root in roots:
+            if os.path.isdir(root):
+                for (dirpath, dirnames, filenames) in os.walk(root):
+                    paths.update(os.path.normpath(os.path.join(dirpath, f)) for f in filenames if f.endswith('.bsv'))
+            elif os.path.exists(root):
+                paths.add(os.path.normpath(root))
+        known = {path: (mtime_ns, size, h) for (path, mtime_ns, size, h) in self.conn.execute('select path, mtime_ns, size, hash from files')}
+        stats = {}
+        stale = []
+        for path in sorted(paths):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                # removed since the directory was walked
+                paths.discard(path)
+                continue
+            stats[path] = (st.st_mtime_ns, st.st_size)
+            if path not in known or known[path][:2] != stats[path]:
+                stale.append(path)
+        # files whose mtime changed but whose content did not only need their
+        # stat updated
+        changed = []
+        for path in stale:
+            if path in known:
+                with open(path, 'rb') as f:
+                    if _hash(f.read()) == known[path][2]:
+                        self.conn.execute('update files set mtime_ns = ?, size = ? where path = ?', stats[path] + (path,))
+                        continue
+            changed.append(path)
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        jobs = max(1, min(jobs, len(changed)))
+        if jobs == 1:
+            results = map(index_file, changed)
+        else:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap_unordered(index_file, changed, chunksize = 8)
+        for (path, h, package, decls) in results:
+            self.conn.execute('delete from decls where path = ?', (path,))
+            self.conn.execute('insert or replace into files values (?, ?, ?, ?, ?)', (path, package) + stats[path] + (h,))
+            self.conn.executemany('insert into decls values (?, ?, ?, ?, ?)', [(path,) + d for d in decls])
+        if jobs != 1:
+            pool.close()
+            pool.join()
+        removed = []
+        for path in known:
+            if path not in paths and any(path == os.path.normpath(root) or path.startswith(os.path.join(os.path.normpath(root), '')) for root in roots):
+                removed.append(path)
+        for path in removed:
+            self.conn.execute('delete from decls where path = ?', (path,))
+            self.conn.execute('delete from files where path = ?', (path,))
+        self.conn.commit()
+        return (len(changed), len(paths) - len(changed), len(removed))
+
+    def query(self, name, kind = None, exported_only = False):
+        """Returns (path, line, kind, name, package, exported) tuples for name.
+
+        name may be a glob pattern using *, ?, and [...]."""
+        op = 'glob' if any(c in name for c in '*?[') else '='
+        sql = 'select d.path, d.line, d.kind, d.name, f.package, d.exported from decls d join files f on d.path = f.path where d.name %s ?' % op
+        args = [name]
+        if kind is not None:
+            sql += ' and d.kind = ?'
+            args.append(kind)
+        if exported_only:
+            sql += ' and d.exported = 1'
+        sql += ' order by d.path, d.line'
+        return self.conn.execute(sql, args).fetchall()
+
+test_bsv = '''package IndexTest;
+
+/// A doc comment
+typedef Bit#(8) Byte;
+
+
+// a comment
+
+interface Foo;
+    method Action bar;
+endinterface
+
+    module mkFoo(Foo);
+    endmodule
+endpackage
+'''
+
+def self_test(tmp):
+    """Indexes test_bsv and checks the line of every declaration. Returns the number of mismatches."""
+    path = os.path.join(tmp, 'IndexTest.bsv')
+    with open(path, 'w') as f:
+        f.write(test_bsv)
+    index = SymbolIndex(os.path.join(tmp, 'index.db'))
+    index.update([tmp], jobs = 1)
+    errors = 0
+    lines = test_bsv.split('\n')
+    for (name, kind) in [('Byte', 'typedef'), ('Foo', 'interface'), ('mkFoo', 'module')]:
+        expected = [n + 1 for (n, line) in enumerate(lines) if line.lstrip().startswith(kind + ' ')]
+        got = [(line, package) for (p, line, k, n, package, exported) in index.query(name)]
+        if got != [(expected[0], 'IndexTest')]:
+            print('ERROR: %s is indexed at %s, expected line %d of package IndexTest' % (name, got, expected[0]))
+            errors += 1
+    # an explicit file root that no longer exists is dropped, not an error
+    os.remove(path)
+    (reparsed, unchanged, removed) = index.update([path], jobs = 1)
+    if (reparsed, unchanged, removed) != (0, 0, 1) or index.query('*') != []:
+        print('ERROR: updating with the removed %s reparsed %d, kept %d, and removed %d files' % (path, reparsed, unchanged, removed))
+        errors += 1
+    index.close()
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Index and query declarations in bsv files')
+    parser.add_argument('-d', '--db', default = default_db, help = 'index database (default: %(default)s)')
+    parser.add_argument('--test', action = 'store_true', help = 'index a small test file, check the declaration lines, and exit')
+    subparsers = parser.add_subparsers(dest = 'command')
+    update_parser = subparsers.add_parser('update', help = 'index new and changed bsv files')
+    update_parser.add_argument('roots', metavar = 'PATH', nargs = '+', help = 'bsv files or directories to index')
+    update_parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of worker processes (default: number of cores)')
+    query_parser = subparsers.add_parser('query', help = 'find where a name is declared')
+    query_parser.add_argument('name', help = 'name or glob pattern to look up')
+    query_parser.add_argument('-k', '--kind', choices = ['typedef', 'interface', 'typeclass', 'instance', 'module', 'function'], help = 'only report declarations of this kind')
+    query_parser.add_argument('-e', '--exported', action = 'store_true', help = 'only report exported declarations')
+    args = parser.parse_args()
+
+    if args.test:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            errors = self_test(tmp)
+        print('%d mismatches' % errors)
+        sys.exit(1 if errors else 0)
+    if args.command is None:
+        parser.print_usage()
+        sys.exit(1)
+    index = SymbolIndex(args.db)
+    if args.command == 'update':
+        for root in args.roots:
+            if not os.path.exists(root):
+                sys.stderr.write('WARNING: %s does not exist, dropping it from the index\n' % root)
+        start = time.perf_counter()
+        (reparsed, unchanged, removed) = index.update(args.roots, args.jobs)
+        sys.stderr.write('%d reparsed, %d unchanged, %d removed in %.3fs\n' % (reparsed, unchanged, removed, time.perf_counter() - start))
+    else:
+        results = index.query(args.name, args.kind, args.exported)
+        for (path, line, kind, name, package, exported) in results:
+            print('%s:%d: %s %s::%s%s' % (path, line, kind, package, name, '' if exported else ' (not exported)'))
+        if len(results) == 0:
+            index.close()
+            sys.exit(1)
+    index.close()
@@ -0,0 +1,46 @@
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# pyparsing grammar for the parts of BSV that bsv_doc_gen.py documents. This is
+
+# File helpers shared by the generators and tools in this directory.
+
+import os
+
+def write_if_changed(filename, data):
+    """Writes data (str or bytes) to filename unless it already contains
+    exactly data, creating the directory if needed.
+
+    Leaving unchanged files alone keeps their mtimes, so builds that depend
+    on them are not redone. Returns True if the file was written."""
+    mode = 'b' if isinstance(data, bytes) else ''
+    try:
+        with open(filename, 'r' + mode) as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    if os.path.dirname(filename) != '':
+        os.makedirs(os.path.dirname(filename), exist_ok = True)
+    with open(filename, 'w' + mode) as f:
+        f.write(data)
+    return True
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2019 Massachusetts Institute of Technology
+#
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Generates banked multi-port SRAM models and their BSV wrappers.
+#
+# Each configuration is named B<banks>_<reads>R<writes>W, with a _BE suffix
+# for byte enables. For each one this writes SRAM_<config>.v to src/v and a
+# mkSRAMCoreBanked_<config> module to src/bsv/BankedSRAMCore.bsv.
+# BankedSRAMUtil's mkSRAM_Banked turns any of them into guarded read and
+# write ports.
+#
+# Example:
+#   gen_BankedSRAM.py B4_2R1W B8_4R2W_BE
+
+import argparse
+import concurrent.futures
+import os
+import re
+import sys
+import time
+
+from file_util import write_if_changed
+from gen_VerilogEHR import get_template, module_path
+
+default_configs = ['B2_2R1W', 'B2_2R1W_BE', 'B4_4R2W', 'B4_4R2W_BE']
+
+verilog_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'v')
+bsv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bsv')
+
+verilog_template_filename = 'BankedSRAM.mako'
+bluespec_template_filename = 'BankedSRAMWrapper.mako'
+
+def parse_config(name):
+    """Returns (num_banks, num_read_ports, num_write_ports, byte_en) for a
+    configuration name such as B4_2R1W or B8_4R2W_BE."""
+    m = re.match(r'B(\d+)_(\d+)R(\d+)W(_BE)?$', name)
+    if m is None:
+        raise ValueError('bad SRAM configuration %r (expected B<banks>_<reads>R<writes>W[_BE])' % name)
+    config = (int(m.group(1)), int(m.group(2)), int(m.group(3)), m.group(4) is not None)
+    (num_banks, num_read_ports, num_write_ports, byte_en) = config
+    if num_banks < 2 or num_banks & (num_banks - 1) != 0:
+        raise ValueError('%s: the number of banks must be a power of two larger than 1' % name)
+    if num_read_ports < 1 or num_write_ports < 1:
+        raise ValueError('%s: there must be at least one read and one write port' % name)
+    return config
+
+def config_name(config):
+    (num_banks, num_read_ports, num_write_ports, byte_en) = config
+    return 'B%d_%dR%dW%s' % (num_banks, num_read_ports, num_write_ports, '_BE' if byte_en else '')
+
+def header(template_filename):
+    return '// generated by %s using %s\n' % (os.path.basename(__file__), template_filename)
+
+def render_verilog(config, module_directory = module_path):
+    """Returns the Verilog for SRAM_<config>."""
+    (num_banks, num_read_ports, num_write_ports, byte_en) = config
+    return header(verilog_template_filename) + get_template(verilog_template_filename, module_directory).render(num_banks = num_banks, num_read_ports = num_read_ports, num_write_ports = num_write_ports, byte_en = byte_en)
+
+def render_bluespec(configs, module_directory = module_path):
+    """Returns BankedSRAMCore.bsv with wrappers for each of configs."""
+    return header(bluespec_template_filename) + get_template(bluespec_template_filename, module_directory).render(configs = sorted(configs))
+
+def _render(job):
+    (filename, fn, args) = job
+    return (filename, fn(*args))
+
+def generate(configs, verilog_path = verilog_path, bsv_path = bsv_path, module_directory = module_path, jobs = None):
+    """Generates SRAM_<config>.v for each of configs and BankedSRAMCore.bsv.
+
+    Returns (list of files written, list of files already up to date)."""
+    jobs_list = [(os.path.join(bsv_path, 'BankedSRAMCore.bsv'), render_bluespec, (configs, module_directory))]
+    for config in sorted(configs):
+        jobs_list.append((os.path.join(verilog_path, 'SRAM_%s.v' % config_name(config)), render_verilog, (config, module_directory)))
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1:
+        rendered = map(_render, jobs_list)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        rendered = executor.map(_render, jobs_list)
+    written = []
+    unchanged = []
+    for (filename, data) in rendered:
+        if write_if_changed(filename, data):
+            written.append(filename)
+        else:
+            unchanged.append(filename)
+    if jobs != 1:
+        executor.shutdown()
+    return (written, unchanged)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate banked multi-port SRAMs and their BSV wrappers')
+    parser.add_argument('configs', metavar = 'CONFIG', nargs = '*', default = default_configs, help = 'configurations to generate, e.g. B4_2R1W or B8_4R2W_BE (default: %s)' % ' '.join(default_configs))
+    parser.add_argument('--verilog-dir', default = verilog_path, help = 'output directory for SRAM_*.v')
+    parser.add_argument('--bsv-dir', default = bsv_path, help = 'output directory for BankedSRAMCore.bsv')
+    parser.add_argument('--module-cache', default = module_path, help = 'directory for compiled templates (default: build/mako_modules)')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of worker processes (default: number of cores)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        configs = set(parse_config(name) for name in args.configs)
+    except ValueError as e:
+        print('ERROR: %s' % e)
+        exit(1)
+    os.makedirs(args.verilog_dir, exist_ok = True)
+    os.makedirs(args.bsv_dir, exist_ok = True)
+    (written, unchanged) = generate(configs, args.verilog_dir, args.bsv_dir, args.module_cache, args.jobs)
+    for filename in sorted(written):
+        sys.stderr.write('wrote %s\n' % filename)
+    sys.stderr.write('%d files written, %d unchanged in %.3fs\n' % (len(written), len(unchanged), time.perf_counter() - start))
@@ -22,8 +22,24 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-# Max number of registers to concat
-n = 20
+import argparse
+import os
+import random
+import re
+import sys
+
+from file_util import write_if_changed
+
+# Default max number of registers to concat
+n = 24
+
+# Max number of registers passed to a single concatReg call. Wider
+# concatRegN functions concatenate chunks of at most this many registers
+# and then concatenate the chunks, so the TAdd nesting in their provisos
+# grows with log(N) instead of N.
+chunk = 4
+
+output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bsv', 'ConcatReg.bsv')
 
 # Top of the generated BSV file
 top_of_file = """// Copyright (c) 2016, 2017 Massachusetts Institute of Technology
@@ -55,8 +71,7 @@ top_of_file = """// Copyright (c) 2016, 2017 Massachusetts Institute of Technolo
  *
  * This package is created by `gen_ConcatReg.py`. If you want to modify this
  * package, please modify `gen_ConcatReg.py` instead. If you need a wider
- * `concatReg` function, change the value of n in `gen_ConcatReg.py` and run
- * it again.
+ * `concatReg` function, run `gen_ConcatReg.py` again with a larger `N`.
  *
  * The Bluespec provided BuildVector.bsv provides another example of
  * constructing a function that takes a variable number of arguments
@@ -104,33 +119,170 @@ function r concatReg(Reg#(Bit#(n1)) r1, Reg#(Bit#(n2)) r2) provisos(ConcatReg#(r
 endfunction
 
 // Automatically generated macros with a set number of registers.
-// These don't require asReg when used.""" % (n)
-
-# Function to print concatRegN
-def print_concatRegN(n):
-    print("/// Concatenate " + str(n) + " registers together")
-    print("function Reg#(Bit#(n)) concatReg" + str(n) + "(")
-    for i in range(1,n+1):
-        print("      Reg#(Bit#(n" + str(i) + ")) r" + str(i) + ("," if i != n else ""))
-    print("    ) provisos (")
-    # print("      Add#( TAdd#( TAdd#( n1 ,n2) ,n3) ,n4,n)\n");
-    print("      Add#(", end="")
-    for i in range(1,n-2+1):
-        print("TAdd#(", end="")
-    for i in range(1,n+1):
-        print("n" + str(i) + (")" if (i != 1 and i != n) else "") + ",", end="")
-    print("n)")
-    print("    );")
-    print("  return concatReg(", end="")
-    for i in range(1,n+1):
-        print("asReg(r" + str(i) + ")" + ("," if i != n else ""), end="")
-    print(");")
-    print("endfunction")
+// These don't require asReg when used."""
+
+def concat_tree(n, chunk = chunk):
+    """Returns the tree used by concatRegN.
+
+    Leaves are register numbers 1 to n. Internal nodes are lists of at most
+    chunk children, and children of the same node have about the same
+    number of leaves."""
+    nodes = list(range(1, n+1))
+    while len(nodes) > chunk:
+        num_groups = (len(nodes) + chunk - 1) // chunk
+        groups = []
+        start = 0
+        for i in range(num_groups):
+            end = start + (len(nodes) - start) // (num_groups - i)
+            groups.append(nodes[start:end] if end - start > 1 else nodes[start])
+            start = end
+        nodes = groups
+    return nodes
+
+def _leaves(node):
+    if isinstance(node, int):
+        return [node]
+    return [leaf for child in node for leaf in _leaves(child)]
+
+def _name(node):
+    if isinstance(node, int):
+        return 'r%d' % node
+    leaves = _leaves(node)
+    return 'c%d_%d' % (leaves[0], leaves[-1])
+
+def _size_type(node):
+    """Returns the size of node as concatReg computes it: a left-nested TAdd
+    over the children."""
+    if isinstance(node, int):
+        return 'n%d' % node
+    size = _size_type(node[0])
+    for child in node[1:]:
+        size = 'TAdd#(%s,%s)' % (size, _size_type(child))
+    return size
 
+def _concat_call(children):
+    return 'concatReg(' + ','.join('asReg(%s)' % _name(child) for child in children) + ')'
+
+def concatRegN(n, chunk = chunk):
+    """Returns the definition of concatRegN."""
+    root = concat_tree(n, chunk)
+    lines = ['/// Concatenate %d registers together' % n]
+    lines.append('function Reg#(Bit#(n)) concatReg%d(' % n)
+    for i in range(1, n+1):
+        lines.append('      Reg#(Bit#(n%d)) r%d%s' % (i, i, ',' if i != n else ''))
+    lines.append('    ) provisos (')
+    # the last Add of the outermost concatReg call
+    lines.append('      Add#(%s,%s,n)' % (_size_type(root[:-1]) if len(root) > 2 else _size_type(root[0]), _size_type(root[-1])))
+    lines.append('    );')
+    # chunks are concatenated bottom up, so every local is defined before use
+    def add_locals(node):
+        for child in node:
+            if not isinstance(child, int):
+                add_locals(child)
+                lines.append('  Reg#(Bit#(%s)) %s = %s;' % (_size_type(child), _name(child), _concat_call(child)))
+    add_locals(root)
+    lines.append('  return %s;' % _concat_call(root))
+    lines.append('endfunction')
+    return '\n'.join(lines) + '\n'
+
+def gen_package(n, chunk = chunk):
+    """Returns ConcatReg.bsv with concatReg2 to concatRegN."""
+    return top_of_file % n + '\n' + ''.join(concatRegN(i, chunk) + '\n' for i in range(2, n+1)) + 'endpackage\n'
+
+_function_re = re.compile(r'function Reg#\(Bit#\(n\)\) concatReg(\d+)\((.*?)\nendfunction', re.DOTALL)
+_local_re = re.compile(r'^  Reg#\(Bit#\((.*)\)\) (c\d+_\d+) = concatReg\((.*)\);$', re.MULTILINE)
+_return_re = re.compile(r'^  return concatReg\((.*)\);$', re.MULTILINE)
+_provisos_re = re.compile(r'^      Add#\((.*),n\)$', re.MULTILINE)
+
+def _split_args(text):
+    """Splits text on the commas that are not inside #(...) or (...)."""
+    args = []
+    depth = 0
+    start = 0
+    for (i, c) in enumerate(text):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            args.append(text[start:i])
+            start = i + 1
+    args.append(text[start:])
+    return args
+
+def _eval_size(size, widths):
+    m = re.match(r'TAdd#\((.*)\)$', size)
+    if m is not None:
+        return sum(_eval_size(arg, widths) for arg in _split_args(m.group(1)))
+    return widths[size]
+
+def _depth(size):
+    m = re.match(r'TAdd#\((.*)\)$', size)
+    if m is None:
+        return 0
+    return 1 + max(_depth(arg) for arg in _split_args(m.group(1)))
+
+def check_package(text, trials = 3):
+    """Checks the generated concatRegN functions in text.
+
+    For random register widths, every local must have the size of the
+    registers concatenated into it, the provisos must add up to the sum of
+    all widths, and the registers must be concatenated in order. Returns a
+    list of (N, maximum TAdd nesting depth, list of errors)."""
+    results = []
+    for m in _function_re.finditer(text):
+        num = int(m.group(1))
+        body = m.group(2)
+        errors = []
+        max_depth = 0
+        for trial in range(trials):
+            widths = {'n%d' % i: random.randint(1, 64) for i in range(1, num+1)}
+            sizes = {'r%d' % i: widths['n%d' % i] for i in range(1, num+1)}
+            leaves = {'r%d' % i: [i] for i in range(1, num+1)}
+            for (size, name, args) in _local_re.findall(body):
+                args = [re.match(r'asReg\((\w+)\)$', arg).group(1) for arg in _split_args(args)]
+                sizes[name] = _eval_size(size, widths)
+                leaves[name] = [leaf for arg in args for leaf in leaves[arg]]
+                if sizes[name] != sum(sizes[arg] for arg in args):
+                    errors.append('%s has size %s but its registers add up to %d' % (name, size, sum(sizes[arg] for arg in args)))
+                max_depth = max(max_depth, _depth(size))
+            args = [re.match(r'asReg\((\w+)\)$', arg).group(1) for arg in _split_args(_return_re.search(body).group(1))]
+            provisos = _provisos_re.search(body).group(1)
+            max_depth = max(max_depth, _depth('TAdd#(%s)' % provisos))
+            total = _eval_size('TAdd#(%s)' % provisos, widths)
+            if total != sum(widths.values()) or total != sum(sizes[arg] for arg in args):
+                errors.append('provisos add up to %d but the registers add up to %d' % (total, sum(widths.values())))
+            if [leaf for arg in args for leaf in leaves[arg]] != list(range(1, num+1)):
+                errors.append('registers are not concatenated in order')
+            if len(errors) != 0:
+                break
+        results.append((num, max_depth, errors))
+    return results
 
 if __name__ == "__main__":
-    print(top_of_file)
-    for i in range(2,n+1):
-        print_concatRegN(i)
-        print("")
-    print("endpackage")
+    parser = argparse.ArgumentParser(description = 'Generate ConcatReg.bsv with concatReg2 to concatRegN')
+    parser.add_argument('n', metavar = 'N', type = int, nargs = '?', default = n, help = 'widest concatRegN function to generate (default: %(default)s)')
+    parser.add_argument('-o', '--output', default = output_path, help = 'output file, or - for stdout (default: src/bsv/ConcatReg.bsv)')
+    parser.add_argument('--chunk', type = int, default = chunk, help = 'max registers per concatReg call (default: %(default)s)')
+    parser.add_argument('--check', action = 'store_true', help = 'check that the generated provisos add up to the right widths')
+    args = parser.parse_args()
+
+    if args.n < 2 or args.chunk < 2:
+        print('ERROR: N and --chunk must be at least 2')
+        exit(1)
+    text = gen_package(args.n, args.chunk)
+    if args.check:
+        failed = False
+        max_depth = 0
+        for (num, depth, errors) in check_package(text):
+            max_depth = max(max_depth, depth)
+            for error in errors:
+                print('ERROR: concatReg%d: %s' % (num, error))
+                failed = True
+        print('checked concatReg2 to concatReg%d, max TAdd nesting depth %d' % (args.n, max_depth))
+        if failed:
+            exit(1)
+    if args.output == '-':
+        sys.stdout.write(text)
+    elif write_if_changed(args.output, text):
+        sys.stderr.write('wrote %s\n' % args.output)
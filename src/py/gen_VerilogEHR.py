@@ -22,31 +22,367 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
+import concurrent.futures
 import os
-from mako.template import Template
+import re
+import sys
+import time
+from mako.lookup import TemplateLookup
+
+from file_util import write_if_changed
 
 max_num_ports = 8
 
 verilog_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'v')
 bsv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bsv')
 mako_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mako')
+# compiled templates are kept here so they are not recompiled on every run
+module_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build', 'mako_modules')
+# --scan only generates some of the EHRs, so by default it writes here instead
+# of over the complete set tracked in src/v and src/bsv
+scan_verilog_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build', 'verilog_ehr', 'v')
+scan_bsv_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'build', 'verilog_ehr', 'bsv')
+
+verilog_template_filename = 'VerilogEHR.mako'
+bluespec_template_filename = 'VerilogEHRWrapper.mako'
+
+_lookup = None
+def get_template(filename, module_directory = module_path):
+    global _lookup
+    if _lookup is None:
+        _lookup = TemplateLookup(directories = [mako_path], module_directory = module_directory)
+    return _lookup.get_template(filename)
+
+def header(template_filename):
+    return '// generated by %s using %s\n' % (os.path.basename(__file__), template_filename)
+
+def render_verilog(num_ports, has_reset, module_directory = module_path, style = 'chain'):
+    """Returns the Verilog for EHR_<num_ports> (or EHRU_<num_ports> if not has_reset).
+
+    style is 'chain' for a linear chain of muxes from r to the last port, or
+    'prefix' for a log-depth parallel-prefix network with the same behavior."""
+    return header(verilog_template_filename) + get_template(verilog_template_filename, module_directory).render(num_ports = num_ports, has_reset = has_reset, style = style)
+
+def render_bluespec(reset_ports, noreset_ports, module_directory = module_path):
+    """Returns VerilogEHR.bsv with mkVerilogEHR wrappers for each port count
+    in reset_ports and mkVerilogEHRU wrappers for each one in noreset_ports."""
+    return header(bluespec_template_filename) + get_template(bluespec_template_filename, module_directory).render(reset_ports = sorted(reset_ports), noreset_ports = sorted(noreset_ports))
+
+# Patterns used by scan_ehr_usage. Ehr#( is matched on its own because the
+# port count is read by balancing parentheses, so that TAdd#(size,1) and the
+# like are reported instead of silently misread.
+_comment_re = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+_numeric_typedef_re = re.compile(r'\btypedef\s+(\d+)\s+(\w+)\s*;')
+_ehr_type_re = re.compile(r'\bEhr\s*#\s*\(')
+_mk_ehr_re = re.compile(r'\bmkEhr(U?)\b')
+_mk_verilog_ehr_re = re.compile(r'\bmkVerilogEHR(U?)(?:_(\d+)\b|\s*\(\s*(\w+)\s*[,)])')
+
+def _first_arg(text, start):
+    """Returns the first argument of the parenthesized list starting at text[start]."""
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == '(':
+            depth += 1
+        elif text[i] == ')':
+            depth -= 1
+            if depth == 0:
+                return text[start+1:i].strip()
+        elif text[i] == ',' and depth == 1:
+            return text[start+1:i].strip()
+    return text[start+1:].strip()
+
+def scan_ehr_usage(filenames):
+    """Finds the EHRs instantiated by the given bsv design files.
+
+    Statements that instantiate mkEhr or mkEhrU take their port counts from
+    the Ehr#(n, t) types in the same statement; a statement that only
+    mentions an Ehr#(n, t) type (a typedef, an argument, ...) counts as a use
+    of both variants. Direct mkVerilogEHR_<n>, mkVerilogEHR(n, ...) and
+    mkVerilogEHRU(n) uses are found too. Port counts may be literals or names
+    of numeric typedefs in any of the scanned files.
+
+    Returns (reset_ports, noreset_ports, unresolved) where unresolved is a
+    list of (filename, line, text) for uses whose port count is not a
+    constant, such as Ehr#(TAdd#(size,1), t) or let x <- mkEhr(0)."""
+    statements = []
+    numeric_typedefs = {}
+    for filename in filenames:
+        with open(filename) as f:
+            # comments are replaced by whitespace so line numbers still match
+            text = _comment_re.sub(lambda m: re.sub(r'[^\n]', ' ', m.group(0)), f.read())
+        for m in _numeric_typedef_re.finditer(text):
+            numeric_typedefs[m.group(2)] = int(m.group(1))
+        line = 1
+        for statement in text.split(';'):
+            statements.append((filename, line, statement))
+            line += statement.count('\n')
+    reset_ports = set()
+    noreset_ports = set()
+    unresolved = []
+    def port_count(arg):
+        if arg.isdigit():
+            return int(arg)
+        return numeric_typedefs.get(arg)
+    for (filename, line, statement) in statements:
+        # report the line the statement starts on, not the end of the last one
+        line += statement[:len(statement) - len(statement.lstrip())].count('\n')
+        variants = set(m.group(1) == '' for m in _mk_ehr_re.finditer(statement))
+        if len(variants) == 0:
+            variants = {True, False}
+        counts = []
+        for m in _ehr_type_re.finditer(statement):
+            arg = _first_arg(statement, m.end() - 1)
+            n = port_count(arg)
+            if n is None:
+                unresolved.append((filename, line, ' '.join(statement.split())))
+            else:
+                counts.append(n)
+        if len(counts) == 0 and _mk_ehr_re.search(statement) and not _ehr_type_re.search(statement):
+            unresolved.append((filename, line, ' '.join(statement.split())))
+        for n in counts:
+            if True in variants:
+                reset_ports.add(n)
+            if False in variants:
+                noreset_ports.add(n)
+        for m in _mk_verilog_ehr_re.finditer(statement):
+            n = port_count(m.group(2) or m.group(3))
+            if n is None:
+                unresolved.append((filename, line, ' '.join(statement.split())))
+            elif m.group(1) == '':
+                reset_ports.add(n)
+            else:
+                noreset_ports.add(n)
+    return (reset_ports, noreset_ports, unresolved)
+
+_assign_re = re.compile(r'^\s*assign\s+(\w+)\s*=\s*(.*?)\s*;\s*$', re.MULTILINE)
+
+def _eval_assigns(verilog, inputs):
+    """Evaluates the continuous assigns in verilog for the given input values.
+
+    Only the forms the EHR templates emit are understood: a ? b : c, a | b,
+    1'b1, 1'b0, and plain wire names. The inputs are numpy arrays with one
+    entry per test pattern, so every pattern is evaluated at once. Returns
+    (values, depths) where depths counts the muxes on the longest path into
+    each wire."""
+    import numpy as np
+    assigns = dict(_assign_re.findall(verilog))
+    values = dict(inputs)
+    size = len(next(iter(inputs.values())))
+    values.update({"1'b1": np.ones(size, dtype = bool), "1'b0": np.zeros(size, dtype = bool)})
+    depths = {name: 0 for name in values}
+    def get(name):
+        if name not in values:
+            expr = assigns[name]
+            m = re.match(r'(\w+)\s*\?\s*(\w+)\s*:\s*(\w+)$', expr)
+            if m is not None:
+                (sel, a, b) = m.groups()
+                values[name] = np.where(get(sel), get(a), get(b))
+                depths[name] = 1 + max(depths[sel], depths[a], depths[b])
+            elif '|' in expr:
+                args = [arg.strip() for arg in expr.split('|')]
+                values[name] = np.logical_or.reduce([get(arg) for arg in args])
+                depths[name] = max(depths[arg] for arg in args)
+            else:
+                values[name] = get(expr)
+                depths[name] = depths[expr]
+        return values[name]
+    for name in assigns:
+        get(name)
+    return (values, depths)
+
+# EHRs with at most this many ports are checked with every pattern of enables
+exhaustive_ports = 16
+
+def enable_patterns(num_ports, seed = 0):
+    """Returns (patterns, exhaustive) where patterns is a boolean array with
+    one row of port enables per test pattern.
+
+    Up to exhaustive_ports ports every pattern is used. Above that, read_i
+    and the next value of r only depend on which enabled port below them has
+    the highest priority, so for each port j and each output after it there
+    are patterns where j is that port, with the enables below j all clear or
+    all set and random enables after the output, plus random patterns."""
+    import numpy as np
+    if num_ports <= exhaustive_ports:
+        codes = np.arange(2**num_ports)
+        return (((codes[:, None] >> np.arange(num_ports)) & 1).astype(bool), True)
+    rng = np.random.RandomState(seed)
+    rows = []
+    for j in range(-1, num_ports):
+        for out in range(j + 1, num_ports + 1):
+            for fill in (False, True):
+                row = np.zeros(num_ports, dtype = bool)
+                if j >= 0:
+                    row[:j] = fill
+                    row[j] = True
+                row[out:] = rng.rand(num_ports - out) < 0.5
+                rows.append(row)
+    rows.append(rng.rand(256, num_ports) < 0.5)
+    return (np.vstack(rows), False)
+
+def check_equivalence(num_ports, has_reset, style, module_directory = module_path):
+    """Checks that the rendered EHR computes the same read_i and next value
+    of r as the reference priority chain for the patterns of enables from
+    enable_patterns.
+
+    Data only passes through muxes whose selects depend only on enables, so
+    giving r and each write_i a distinct value identifies which one every
+    output selects, and one data pattern per enable pattern is enough.
+    Returns (number of mismatching patterns, maximum mux depth, number of
+    patterns, True if every pattern was checked)."""
+    import numpy as np
+    verilog = render_verilog(num_ports, has_reset, module_directory, style)
+    (patterns, exhaustive) = enable_patterns(num_ports)
+    size = len(patterns)
+    inputs = {'r': np.zeros(size, dtype = np.int64)}
+    for i in range(num_ports):
+        inputs['EN_write_%d' % i] = patterns[:, i]
+        inputs['write_%d' % i] = np.full(size, i + 1, dtype = np.int64)
+    (values, depths) = _eval_assigns(verilog, inputs)
+    expected = np.zeros(size, dtype = np.int64)
+    wrong = np.zeros(size, dtype = bool)
+    for i in range(num_ports):
+        wrong |= values['read_%d' % i] != expected
+        expected = np.where(patterns[:, i], i + 1, expected)
+    wrong |= values['wire_%d' % num_ports] != expected
+    return (int(wrong.sum()), depths['wire_%d' % num_ports], size, exhaustive)
+
+def _render(job):
+    (filename, fn, args) = job
+    return (filename, fn(*args))
+
+def generate(max_num_ports = max_num_ports, verilog_path = verilog_path, bsv_path = bsv_path, module_directory = module_path, jobs = None, reset_ports = None, noreset_ports = None, prefix_ports = ()):
+    """Generates EHR_<n>.v for each n in reset_ports, EHRU_<n>.v for each n in
+    noreset_ports, and VerilogEHR.bsv, rendering them in a pool of jobs
+    worker processes. Both port lists default to 1..max_num_ports. EHRs
+    whose port count is in prefix_ports use the 'prefix' style.
+
+    Returns (list of files written, list of files already up to date)."""
+    if reset_ports is None:
+        reset_ports = range(1, max_num_ports+1)
+    if noreset_ports is None:
+        noreset_ports = range(1, max_num_ports+1)
+    jobs_list = []
+    for i in sorted(set(reset_ports) | set(noreset_ports)):
+        style = 'prefix' if i in prefix_ports else 'chain'
+        if i in reset_ports:
+            jobs_list.append((os.path.join(verilog_path, 'EHR_%d.v' % i), render_verilog, (i, True, module_directory, style)))
+        if i in noreset_ports:
+            jobs_list.append((os.path.join(verilog_path, 'EHRU_%d.v' % i), render_verilog, (i, False, module_directory, style)))
+    jobs_list.append((os.path.join(bsv_path, 'VerilogEHR.bsv'), render_bluespec, (list(reset_ports), list(noreset_ports), module_directory)))
+    # the wrapper package is the largest job, so start it first
+    jobs_list.reverse()
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if jobs == 1:
+        rendered = map(_render, jobs_list)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        rendered = executor.map(_render, jobs_list)
+    written = []
+    unchanged = []
+    for (filename, data) in rendered:
+        if write_if_changed(filename, data):
+            written.append(filename)
+        else:
+            unchanged.append(filename)
+    if jobs != 1:
+        executor.shutdown()
+    return (written, unchanged)
+
+def _in_src_v(directory):
+    real = os.path.realpath(directory)
+    tracked = os.path.realpath(verilog_path)
+    return real == tracked or real.startswith(os.path.join(tracked, ''))
+
+def prune(directory, keep):
+    """Removes the EHR_*.v and EHRU_*.v files in directory that are not in
+    keep, and returns the list of removed files.
+
+    Raises ValueError if directory is the repository's src/v, since the
+    files there are tracked."""
+    if _in_src_v(directory):
+        raise ValueError('refusing to prune %s, which holds the tracked EHRs' % directory)
+    removed = []
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if re.match(r'EHRU?_\d+\.v$', filename) and path not in keep:
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+def _parse_ports(spec):
+    """Parses --ports: a comma separated list of port counts, each optionally
+    followed by u (only EHRU) or r (only EHR)."""
+    reset_ports = set()
+    noreset_ports = set()
+    for item in spec.split(','):
+        m = re.match(r'\s*(\d+)([ur]?)\s*$', item)
+        if m is None:
+            raise argparse.ArgumentTypeError('bad port count %r' % item)
+        if m.group(2) != 'u':
+            reset_ports.add(int(m.group(1)))
+        if m.group(2) != 'r':
+            noreset_ports.add(int(m.group(1)))
+    return (reset_ports, noreset_ports)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Generate Verilog EHRs and their BSV wrappers')
+    parser.add_argument('--max-num-ports', type = int, default = max_num_ports, help = 'generate EHRs with 1 to this many ports (default: %(default)s)')
+    parser.add_argument('--verilog-dir', help = 'output directory for EHR_*.v and EHRU_*.v (default: src/v, or build/verilog_ehr/v with --scan)')
+    parser.add_argument('--bsv-dir', help = 'output directory for VerilogEHR.bsv (default: src/bsv, or build/verilog_ehr/bsv with --scan)')
+    parser.add_argument('--module-cache', default = module_path, help = 'directory for compiled templates (default: build/mako_modules)')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of worker processes (default: number of cores)')
+    parser.add_argument('--scan', metavar = 'FILE', nargs = '+', help = 'only generate the EHRs instantiated by these bsv design files')
+    parser.add_argument('--ports', type = _parse_ports, default = (set(), set()), help = 'with --scan, also generate these port counts, e.g. 3,5u,6r (u: EHRU only, r: EHR only)')
+    parser.add_argument('--allow-unresolved', action = 'store_true', help = 'with --scan, warn about EHRs whose port count is not a constant instead of failing')
+    parser.add_argument('--prefix', metavar = 'N', type = int, nargs = '+', default = [], help = 'use the log-depth prefix network instead of a mux chain for EHRs with these port counts')
+    parser.add_argument('--check', action = 'store_true', help = 'check that both styles match the mux chain for 1 to --max-num-ports ports and exit (every enable pattern up to %d ports)' % exhaustive_ports)
+    parser.add_argument('--prune', action = 'store_true', help = 'remove EHR_*.v and EHRU_*.v files in the Verilog directory that were not generated (never src/v)')
+    args = parser.parse_args()
+    if args.verilog_dir is None:
+        args.verilog_dir = scan_verilog_path if args.scan is not None else verilog_path
+    if args.bsv_dir is None:
+        args.bsv_dir = scan_bsv_path if args.scan is not None else bsv_path
+    if args.prune and _in_src_v(args.verilog_dir):
+        print('ERROR: --prune would remove tracked EHRs from %s; use --verilog-dir to write somewhere else' % args.verilog_dir)
+        exit(1)
 
-verilog_template_filename =  os.path.join(mako_path, 'VerilogEHR.mako')
-verilog_template = Template(filename = verilog_template_filename)
-bluespec_template_filename = os.path.join(mako_path, 'VerilogEHRWrapper.mako')
-bluespec_template = Template(filename = bluespec_template_filename)
-
-for i in range(1, max_num_ports+1):
-    with open(os.path.join(verilog_path, 'EHR_%d.v' % i), 'w') as f:
-        f.write('// generated by %s using %s\n' % (os.path.basename(__file__), os.path.basename(verilog_template_filename)))
-        f.write(verilog_template.render( num_ports = i, has_reset = True ))
-    with open(os.path.join(verilog_path, 'EHRU_%d.v' % i), 'w') as f:
-        f.write('// generated by %s using %s\n' % (os.path.basename(__file__), os.path.basename(verilog_template_filename)))
-        f.write(verilog_template.render( num_ports = i, has_reset = False ))
-
-with open(os.path.join(bsv_path, 'VerilogEHR.bsv'), 'w') as f:
-    f.write('// generated by %s using %s\n' % (os.path.basename(__file__), os.path.basename(bluespec_template_filename)))
-    f.write(bluespec_template.render(max_num_ports = max_num_ports))
+    start = time.perf_counter()
+    if args.check:
+        failed = False
+        for num_ports in range(1, args.max_num_ports+1):
+            for has_reset in (True, False):
+                for style in ('chain', 'prefix'):
+                    (mismatches, depth, patterns, exhaustive) = check_equivalence(num_ports, has_reset, style, args.module_cache)
+                    print('%-7s %-6s %d patterns%s, %d mismatches, mux depth %d' % ('%s_%d' % ('EHR' if has_reset else 'EHRU', num_ports), style, patterns, '' if exhaustive else ' (not exhaustive)', mismatches, depth))
+                    failed = failed or mismatches != 0
+        if failed:
+            print('ERROR: some EHRs do not match the reference mux chain')
+            exit(1)
+        exit(0)
+    reset_ports = None
+    noreset_ports = None
+    if args.scan is not None:
+        (reset_ports, noreset_ports, unresolved) = scan_ehr_usage(args.scan)
+        reset_ports |= args.ports[0]
+        noreset_ports |= args.ports[1]
+        for (filename, line, statement) in unresolved:
+            sys.stderr.write('%s:%d: %s: port count is not a constant: %s\n' % (filename, line, 'WARNING' if args.allow_unresolved else 'ERROR', statement))
+        if len(unresolved) != 0 and not args.allow_unresolved:
+            print('ERROR: add the port counts of these EHRs with --ports, or pass --allow-unresolved')
+            exit(1)
+        sys.stderr.write('EHR ports: %s; EHRU ports: %s\n' % (' '.join(str(i) for i in sorted(reset_ports)) or '-', ' '.join(str(i) for i in sorted(noreset_ports)) or '-'))
+    os.makedirs(args.verilog_dir, exist_ok = True)
+    os.makedirs(args.bsv_dir, exist_ok = True)
+    (written, unchanged) = generate(args.max_num_ports, args.verilog_dir, args.bsv_dir, args.module_cache, args.jobs, reset_ports, noreset_ports, set(args.prefix))
+    for filename in sorted(written):
+        sys.stderr.write('wrote %s\n' % filename)
+    if args.prune:
+        for filename in prune(args.verilog_dir, set(written) | set(unchanged)):
+            sys.stderr.write('removed %s\n' % filename)
+    sys.stderr.write('%d files written, %d unchanged in %.3fs\n' % (len(written), len(unchanged), time.perf_counter() - start))
 
 # def get_verilog_for_ehr(n, has_reset = True):
 #     if has_reset:
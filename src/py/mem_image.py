@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Converts ELF files and raw binary images into load files for
+# mkGenericAtomicBRAMLoad, mkGenericAtomicBRAMLoad2Port, and
+# mkPolymorphicBRAMLoad.
+#
+# LoadFormat Hex files are read with $readmemh and LoadFormat Binary files
+# with $readmemb, so both are text with one word of --data-sz bits per line,
+# most significant digit first, and "@<word address>" lines to skip words.
+# Word 0 of the memory holds the bytes at --base. The bytes of each word are
+# little endian unless --byte-order big is given.
+#
+# The input is memory mapped and the output is written in parallel chunks of
+# words. Each chunk is formatted with numpy and written at its final offset.
+# With --sparse zero every word up to the end of the image is written. With
+# --sparse split, runs of at least --min-gap zero words are left out and the
+# next word gets an @ line, so those words keep the simulator's default BRAM
+# contents instead of zero.
+#
+# With --cache DIR, outputs are stored in DIR under a hash of the input and
+# the options, and converting the same input again just copies the result.
+#
+# Examples:
+#   mem_image.py prog.elf -o mem.hex --data-sz 64 --num-words 65536 --base 0x80000000
+#   mem_image.py kernel.bin -o mem.hex --data-sz 128 --sparse split -j 8
+#   mem_image.py prog.elf -o mem.bin --format binary --data-sz 32 --cache ~/.cache/mem_image
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import struct
+import sys
+import time
+
+import numpy as np
+
+hex_digits = np.frombuffer(b'0123456789abcdef', dtype = np.uint8)
+
+# input images
+
+def read_segments(filename, use_vaddr = False, load_addr = 0):
+    """Returns the (address, file offset, file size, memory size) of the
+    loadable parts of filename.
+
+    ELF files are split into their PT_LOAD segments at their physical (or
+    virtual) addresses. Other files are one segment at load_addr."""
+    with open(filename, 'rb') as f:
+        ident = f.read(64)
+        size = os.fstat(f.fileno()).st_size
+        if ident[:4] != b'\x7fELF':
+            return [(load_addr, 0, size, size)]
+        (elf_class, elf_data) = (ident[4], ident[5])
+        if elf_class not in (1, 2) or elf_data not in (1, 2):
+            raise ValueError('%s: unsupported ELF class %d or data encoding %d' % (filename, elf_class, elf_data))
+        e = '<' if elf_data == 1 else '>'
+        if elf_class == 1:
+            (phoff, phentsize, phnum) = (struct.unpack_from(e + 'I', ident, 28)[0],) + struct.unpack_from(e + 'HH', ident, 42)
+            ph_format = e + 'IIIIII'
+        else:
+            (phoff, phentsize, phnum) = (struct.unpack_from(e + 'Q', ident, 32)[0],) + struct.unpack_from(e + 'HH', ident, 54)
+            ph_format = e + 'IIQQQQQ'
+        f.seek(phoff)
+        table = f.read(phentsize * phnum)
+    segments = []
+    for i in range(phnum):
+        fields = struct.unpack_from(ph_format, table, i * phentsize)
+        if elf_class == 1:
+            (p_type, offset, vaddr, paddr, filesz, memsz) = fields
+        else:
+            (p_type, _, offset, vaddr, paddr, filesz, memsz) = fields
+        if p_type == 1 and memsz != 0:
+            segments.append((vaddr if use_vaddr else paddr, offset, filesz, memsz))
+    if not segments:
+        raise ValueError('%s: no PT_LOAD segments' % filename)
+    return segments
+
+def image_words(mm, segments, base, word_bytes, start, end):
+    """Returns words [start, end) of the image as a (end - start, word_bytes)
+    array. Bytes outside the file parts of the segments are zero."""
+    buf = np.zeros((end - start) * word_bytes, dtype = np.uint8)
+    (lo, hi) = (base + start * word_bytes, base + end * word_bytes)
+    for (addr, offset, filesz, memsz) in segments:
+        (a, b) = (max(lo, addr), min(hi, addr + filesz))
+        if a < b:
+            buf[a - lo:b - lo] = mm[offset + a - addr:offset + b - addr]
+    return buf.reshape(-1, word_bytes)
+
+# formatting
+
+def line_length(data_sz, fmt):
+    return (data_sz // 4 if fmt == 'hex' else data_sz) + 1
+
+def format_words(words, fmt, byte_order = 'little'):
+    """Formats each word of a (n, word_bytes) array as a $readmemh or
+    $readmemb line. Returns bytes."""
+    if byte_order == 'little':
+        words = words[:, ::-1]
+    if fmt == 'hex':
+        digits = np.empty((len(words), 2 * words.shape[1] + 1), dtype = np.uint8)
+        digits[:, 0:-1:2] = hex_digits[words >> 4]
+        digits[:, 1:-1:2] = hex_digits[words & 15]
+    else:
+        digits = np.empty((len(words), 8 * words.shape[1] + 1), dtype = np.uint8)
+        digits[:, :-1] = np.unpackbits(words, axis = 1) + ord('0')
+    digits[:, -1] = ord('\n')
+    return digits.tobytes()
+
+# conversion
+
+def _find_runs(args):
+    """Returns the [start, end) runs of nonzero words in a chunk."""
+    (filename, segments, base, word_bytes, start, end) = args
+    with open(filename, 'rb') as f:
+        mm = np.memmap(f, dtype = np.uint8, mode = 'r') if os.fstat(f.fileno()).st_size else np.zeros(0, dtype = np.uint8)
+        nonzero = image_words(mm, segments, base, word_bytes, start, end).any(axis = 1)
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], nonzero, [False])).astype(np.int8)))
+    return (edges[0::2] + start, edges[1::2] + start)
+
+def _write_piece(args):
+    (filename, segments, base, word_bytes, start, end, fmt, byte_order, output, offset, header) = args
+    with open(filename, 'rb') as f:
+        mm = np.memmap(f, dtype = np.uint8, mode = 'r') if os.fstat(f.fileno()).st_size else np.zeros(0, dtype = np.uint8)
+        data = header + format_words(image_words(mm, segments, base, word_bytes, start, end), fmt, byte_order)
+    fd = os.open(output, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+    return len(data)
+
+def _map(func, tasks, jobs):
+    if jobs == 1 or len(tasks) <= 1:
+        return [func(t) for t in tasks]
+    with multiprocessing.Pool(jobs) as pool:
+        return pool.map(func, tasks)
+
+def layout(filename, segments, base, word_bytes, num_words, sparse = 'zero', min_gap = 64,
+           chunk_words = 1 << 20, jobs = None):
+    """Returns the [start, end) word ranges to write."""
+    if any(addr < base for (addr, _, _, _) in segments):
+        raise ValueError('segment at 0x%x is below the base address 0x%x' % (min(s[0] for s in segments), base))
+    total = max(-(-(addr + memsz - base) // word_bytes) for (addr, _, _, memsz) in segments)
+    if num_words and total > num_words:
+        raise ValueError('the image needs %d words but numWords is %d' % (total, num_words))
+    if sparse == 'zero':
+        return [(0, total)]
+    # only words inside the file parts of segments can be nonzero
+    ranges = sorted(((addr - base) // word_bytes, -(-(addr + filesz - base) // word_bytes)) for (addr, _, filesz, _) in segments if filesz)
+    tasks = [(filename, segments, base, word_bytes, a, min(a + chunk_words, b)) for (a, b) in ranges for a in range(a, b, chunk_words)]
+    runs = _map(_find_runs, tasks, jobs)
+    starts = np.concatenate([r[0] for r in runs] + [np.zeros(0, dtype = np.int64)])
+    ends = np.concatenate([r[1] for r in runs] + [np.zeros(0, dtype = np.int64)])
+    order = np.argsort(starts, kind = 'stable')
+    (starts, ends) = (starts[order], np.maximum.accumulate(ends[order]) if len(ends) else ends)
+    # join runs separated by fewer than min_gap zero words
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] >= min_gap)) if len(starts) else np.zeros(0, dtype = bool)
+    last = np.concatenate((keep[1:], [True])) if len(starts) else keep
+    return list(zip(starts[keep].tolist(), ends[last].tolist()))
+
+def convert(filename, output, data_sz, num_words = 0, fmt = 'hex', base = None, load_addr = None,
+            sparse = 'zero', min_gap = 64, byte_order = 'little', use_vaddr = False,
+            chunk_words = 1 << 20, jobs = None):
+    """Writes the load file for filename to output. Returns the number of words written."""
+    if data_sz % 8 != 0:
+        raise ValueError('dataSz must be a multiple of 8, got %d' % data_sz)
+    word_bytes = data_sz // 8
+    segments = read_segments(filename, use_vaddr, load_addr if load_addr is not None else (base or 0))
+    if base is None:
+        base = min(addr for (addr, _, _, _) in segments) // word_bytes * word_bytes
+    ranges = layout(filename, segments, base, word_bytes, num_words, sparse, min_gap, chunk_words, jobs)
+    length = line_length(data_sz, fmt)
+    tasks = []
+    offset = 0
+    for (i, (a, b)) in enumerate(ranges):
+        for start in range(a, b, chunk_words):
+            end = min(start + chunk_words, b)
+            header = ('@%x\n' % a).encode() if start == a and (i != 0 or a != 0) else b''
+            tasks.append((filename, segments, base, word_bytes, start, end, fmt, byte_order, output, offset, header))
+            offset += len(header) + (end - start) * length
+    tmp = output + '.tmp%d' % os.getpid()
+    with open(tmp, 'wb') as f:
+        f.truncate(offset)
+    try:
+        _map(_write_piece, [t[:8] + (tmp,) + t[9:] for t in tasks], jobs)
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return sum(b - a for (a, b) in ranges)
+
+# cache
+
+def cache_key(filename, options):
+    """Returns a hash of this script, the options, and the contents of filename."""
+    h = hashlib.sha256()
+    with open(os.path.abspath(__file__), 'rb') as f:
+        h.update(f.read())
+    # jobs and chunk_words do not change the output
+    h.update(repr(sorted((k, v) for (k, v) in options.items() if k not in ('jobs', 'chunk_words'))).encode())
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(1 << 24)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+def convert_cached(filename, output, cache_dir, **options):
+    """convert() that reuses a result stored in cache_dir. Returns True on a hit."""
+    os.makedirs(cache_dir, exist_ok = True)
+    path = os.path.join(cache_dir, cache_key(filename, options) + ('.hex' if options.get('fmt', 'hex') == 'hex' else '.bin'))
+    if os.path.exists(path):
+        shutil.copyfile(path, output)
+        return True
+    convert(filename, output, **options)
+    tmp = path + '.tmp%d' % os.getpid()
+    shutil.copyfile(output, tmp)
+    os.replace(tmp, path)
+    return False
+
+# self check
+
+def reference(filename, data_sz, fmt, base, sparse, min_gap, byte_order, use_vaddr):
+    """Formats the load file one word at a time."""
+    word_bytes = data_sz // 8
+    segments = read_segments(filename, use_vaddr, base)
+    with open(filename, 'rb') as f:
+        data = f.read()
+    memory = {}
+    for (addr, offset, filesz, memsz) in segments:
+        for i in range(memsz):
+            memory[addr + i] = data[offset + i] if i < filesz else 0
+    total = -(-(max(memory) + 1 - base) // word_bytes)
+    words = []
+    for w in range(total):
+        b = bytes(memory.get(base + w * word_bytes + i, 0) for i in range(word_bytes))
+        words.append(int.from_bytes(b, byte_order))
+    lines = []
+    if sparse == 'zero':
+        keep = range(total)
+    else:
+        nonzero = [w for w in range(total) if words[w]]
+        keep = set()
+        for (prev, w) in zip([None] + nonzero, nonzero):
+            if prev is not None and w - prev <= min_gap:
+                keep.update(range(prev, w + 1))
+            keep.add(w)
+    prev = -1
+    for w in sorted(keep):
+        if w != prev + 1:
+            lines.append('@%x' % w)
+        lines.append(('%0*x' % (data_sz // 4, words[w])) if fmt == 'hex' else ('{:0%db}' % data_sz).format(words[w]))
+        prev = w
+    return ''.join(line + '\n' for line in lines)
+
+def make_elf(segments, elf_class = 2, endian = '<'):
+    """Returns a minimal ELF file with PT_LOAD segments (paddr, data, memsz)."""
+    (ehsize, phentsize) = (52, 32) if elf_class == 1 else (64, 56)
+    header = bytearray(ehsize)
+    header[0:6] = b'\x7fELF' + bytes([elf_class, 1 if endian == '<' else 2])
+    offset = ehsize + phentsize * len(segments)
+    table = b''
+    payload = b''
+    for (paddr, data, memsz) in segments:
+        if elf_class == 1:
+            table += struct.pack(endian + 'IIIIIIII', 1, offset + len(payload), paddr + 0x1000, paddr, len(data), memsz, 5, 4)
+        else:
+            table += struct.pack(endian + 'IIQQQQQQ', 1, 5, offset + len(payload), paddr + 0x1000, paddr, len(data), memsz, 4)
+        payload += data
+    if elf_class == 1:
+        struct.pack_into(endian + 'I', header, 28, ehsize)
+        struct.pack_into(endian + 'HH', header, 42, phentsize, len(segments))
+    else:
+        struct.pack_into(endian + 'Q', header, 32, ehsize)
+        struct.pack_into(endian + 'HH', header, 54, phentsize, len(segments))
+    return bytes(header) + table + payload
+
+def self_check(tmp, seed = 0):
+    """Compares convert() with reference() on random images. Returns the number of mismatches."""
+    rng = np.random.default_rng(seed)
+    def random_data(n):
+        data = bytearray(rng.bytes(n))
+        for _ in range(3):
+            # zero runs for --sparse split
+            a = int(rng.integers(0, n))
+            zeros = len(data[a:a + int(rng.integers(0, 600))])
+            data[a:a + zeros] = bytes(zeros)
+        return bytes(data)
+    inputs = []
+    for (elf_class, endian) in [(1, '<'), (2, '<'), (2, '>')]:
+        segments = [(0x1000 + 3, random_data(4000), 5000), (0x4000, random_data(777), 777), (0x9000, b'', 64)]
+        inputs.append((make_elf(segments, elf_class, endian), 0x1000))
+    inputs.append((random_data(10000), 0))
+    errors = 0
+    for (k, (data, base)) in enumerate(inputs):
+        filename = os.path.join(tmp, 'image%d' % k)
+        with open(filename, 'wb') as f:
+            f.write(data)
+        for (data_sz, fmt, sparse, byte_order) in [(32, 'hex', 'zero', 'little'), (64, 'hex', 'split', 'little'),
+                                                   (128, 'hex', 'split', 'big'), (8, 'binary', 'split', 'little'),
+                                                   (24, 'binary', 'zero', 'little')]:
+            output = os.path.join(tmp, 'out')
+            convert(filename, output, data_sz, fmt = fmt, base = base, sparse = sparse, min_gap = 16,
+                    byte_order = byte_order, chunk_words = 37, jobs = 2)
+            with open(output) as f:
+                got = f.read()
+            if got != reference(filename, data_sz, fmt, base, sparse, 16, byte_order, False):
+                print('ERROR: image %d, dataSz %d, %s, %s, %s differs from the reference' % (k, data_sz, fmt, sparse, byte_order))
+                errors += 1
+    cache = os.path.join(tmp, 'cache')
+    output = os.path.join(tmp, 'out')
+    hits = [convert_cached(filename, output, cache, data_sz = 32) for _ in range(2)]
+    if hits != [False, True]:
+        print('ERROR: expected a cache miss and then a hit, got %s' % hits)
+        errors += 1
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert ELF and raw binary images into BRAM load files')
+    parser.add_argument('input', nargs = '?', help = 'ELF file or raw binary image')
+    parser.add_argument('-o', '--output', help = 'load file to write')
+    parser.add_argument('--data-sz', type = int, default = 32, help = 'bits per memory word, a multiple of 8 (default: %(default)s)')
+    parser.add_argument('--num-words', type = int, default = 0, help = 'words in the memory, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--format', choices = ['hex', 'binary'], default = 'hex', help = 'LoadFormat of the output (default: %(default)s)')
+    parser.add_argument('--base', type = lambda x: int(x, 0), help = 'byte address of word 0 (default: the lowest segment address)')
+    parser.add_argument('--load-addr', type = lambda x: int(x, 0), help = 'byte address of a raw binary image (default: --base)')
+    parser.add_argument('--vaddr', action = 'store_true', help = 'place ELF segments at their virtual instead of physical addresses')
+    parser.add_argument('--byte-order', choices = ['little', 'big'], default = 'little', help = 'order of the bytes in each word (default: %(default)s)')
+    parser.add_argument('--sparse', choices = ['zero', 'split'], default = 'zero', help = 'write zero words, or skip long zero runs with @ lines (default: %(default)s)')
+    parser.add_argument('--min-gap', type = int, default = 64, help = 'shortest zero run that --sparse split skips, in words (default: %(default)s)')
+    parser.add_argument('--chunk-words', type = int, default = 1 << 20, help = 'words per parallel chunk (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type = int, help = 'worker processes (default: one per core)')
+    parser.add_argument('--cache', metavar = 'DIR', help = 'reuse outputs cached in DIR for inputs and options that have not changed')
+    parser.add_argument('--check', action = 'store_true', help = 'compare against a word at a time reference on random images and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            errors = self_check(tmp)
+        print('%d mismatches' % errors)
+        sys.exit(1 if errors else 0)
+    if args.input is None or args.output is None:
+        parser.print_usage()
+        sys.exit(1)
+    options = dict(data_sz = args.data_sz, num_words = args.num_words, fmt = args.format, base = args.base,
+                   load_addr = args.load_addr, sparse = args.sparse, min_gap = args.min_gap, byte_order = args.byte_order,
+                   use_vaddr = args.vaddr, chunk_words = args.chunk_words, jobs = args.jobs)
+    start = time.perf_counter()
+    try:
+        if args.cache:
+            hit = convert_cached(args.input, args.output, args.cache, **options)
+            status = 'cached' if hit else 'converted'
+        else:
+            convert(args.input, args.output, **options)
+            status = 'converted'
+    except (OSError, ValueError) as e:
+        print('ERROR: %s' % e)
+        sys.exit(1)
+    sys.stderr.write('wrote %s (%s) in %.3fs\n' % (args.output, status, time.perf_counter() - start))
@@ -0,0 +1,67 @@
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# pyparsing grammar for the parts of BSV that bsv_doc_gen.py documents. This is
+
+# Helpers shared by the numpy based parsers of logs and traces
+# (schedule_analyze.py, perfmon_analyze.py, printtrace_index.py, and
+# atomic_mem_check.py).
+
+import mmap
+import os
+
+import numpy as np
+
+# value of each byte as a hex digit, 16 for non hex digits
+hex_value = np.full(256, 16, dtype = np.uint8)
+for (i, c) in enumerate(b'0123456789abcdef'):
+    hex_value[c] = i
+for (i, c) in enumerate(b'ABCDEF'):
+    hex_value[c] = 10 + i
+
+pow10 = np.array([10**k for k in range(20)], dtype = np.uint64)
+
+# multiplier of the polynomial hash used to tell names apart, and its inverse
+# mod 2^64
+hash_mult = np.uint64(0x9e3779b97f4a7c15)
+hash_mult_inv = np.uint64(pow(0x9e3779b97f4a7c15, -1, 1 << 64))
+
+def powers(x, n):
+    """Returns [1, x, x^2, ..., x^(n-1)] as uint64, wrapping around."""
+    p = np.full(n, x, dtype = np.uint64)
+    p[0] = 1
+    return np.cumprod(p, dtype = np.uint64)
+
+def chunk_ranges(filename, offset, chunk_size):
+    """Splits the file from offset into [start, end) ranges of whole lines."""
+    size = os.path.getsize(filename)
+    if size <= offset:
+        return []
+    ranges = []
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+        start = offset
+        while start < size:
+            end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if end < 0 else end + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Analysis of PerfMonitor dumps.
+#
+# A dump is the output of PerfMonitor::printPerformance ("name = value") or of
+# mkPerfOutputFSM ("0x<index>, name = value"). Files may hold any number of
+# dumps back to back. Each counter gets a column in the order it is first seen,
+# and a new snapshot starts whenever a counter repeats within the current one,
+# so dumps do not need any separator lines.
+#
+# The input is parsed in large chunks entirely with numpy: line and '='
+# positions come from byte comparisons, values from a digit matrix, and names
+# are told apart by a polynomial hash, so Python only sees each distinct name
+# once. Everything after parsing is vectorized across all counters and
+# snapshots.
+#
+# Counters are PerfDataSz (64) bits wide and wrap around. mkPerfMonitor.req
+# returns '1 for an index that does not name a counter; such values are
+# masked out of all results.
+#
+# Examples:
+#   perfmon_analyze.py run.log
+#   perfmon_analyze.py run.log --per cycles --ratio core::l1d::missCount/core::l1d::accessCount
+#   perfmon_analyze.py run.log --depth 2 --csv build/deltas.csv
+
+import argparse
+import fnmatch
+import sys
+import time
+
+import numpy as np
+
+from np_text import hash_mult, hash_mult_inv, pow10, powers
+
+perf_data_sz = 64
+perfmon_ext = '.perfmon.txt'
+
+class Snapshots:
+    """Counter values of a sequence of dumps.
+
+    names is the list of counter names and values is a (snapshots, counters)
+    uint64 array. Counters that are missing from a dump or that read as the
+    invalid index sentinel are masked in values."""
+    def __init__(self, names, values, width = perf_data_sz):
+        self.names = names
+        self.values = values
+        self.width = width
+
+    def columns(self, pattern):
+        """Returns the column indices of the names matching the glob pattern."""
+        if pattern in self.names:
+            return [self.names.index(pattern)]
+        return [i for (i, name) in enumerate(self.names) if fnmatch.fnmatchcase(name, pattern)]
+
+def sentinel(width = perf_data_sz):
+    """Returns the value mkPerfMonitor.req responds with for an invalid index."""
+    return np.uint64((1 << width) - 1)
+
+def read_map(filename):
+    """Returns the counter names of a .perfmon.txt file in readout order.
+
+    Like PerfMonitor::printPerformance, everything after the first comma is
+    the name."""
+    names = []
+    with open(filename) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if ',' in line:
+                names.append(line[line.index(',') + 1:])
+    return names
+
+def _blank(x):
+    return (x == ord(' ')) | (x == ord('\t')) | (x == ord('\r'))
+
+def _strip(arr, starts, ends, step):
+    """Moves starts (step = 1) or ends (step = -1) past blank bytes of arr."""
+    edge = starts if step == 1 else ends - 1
+    while True:
+        b = (starts < ends) & _blank(arr[np.maximum(edge, 0)])
+        if not b.any():
+            return starts if step == 1 else ends
+        edge = edge + step * b
+        if step == 1:
+            starts = edge
+        else:
+            ends = edge + 1
+
+class DumpReader:
+    """Streams dump files into a Snapshots.
+
+    Call feed with consecutive pieces of the input and then finish. Counters
+    named in names (e.g. from read_map) get the first columns in that order.
+    Lines that are not of the form "[0x<index>,] name = <decimal>" are
+    ignored."""
+    def __init__(self, names = (), width = perf_data_sz):
+        self.width = width
+        self.names = []
+        # sorted name hashes and their columns
+        self.keys = np.zeros(0, dtype = np.uint64)
+        self.key_cols = np.zeros(0, dtype = np.int32)
+        self.powers = np.zeros(0, dtype = np.uint64)
+        self.inv_powers = np.zeros(0, dtype = np.uint64)
+        self.cols = []
+        self.vals = []
+        self.partial = b''
+        if len(names) != 0:
+            self._parse(b''.join(name + b' = 0\n' for name in names), keep = False)
+
+    def feed(self, data):
+        data = self.partial + data
+        end = data.rfind(b'\n') + 1
+        self.partial = data[end:]
+        self._parse(data[:end])
+
+    def _parse(self, data, keep = True):
+        if len(data) == 0:
+            return
+        arr = np.frombuffer(data, dtype = np.uint8)
+        ends = np.flatnonzero(arr == ord('\n'))
+        starts = np.zeros(len(ends), dtype = ends.dtype)
+        starts[1:] = ends[:-1] + 1
+        starts = _strip(arr, starts, ends, 1)
+        ends = _strip(arr, starts, ends, -1)
+        # split each line at its last '='
+        eqs = np.flatnonzero(arr == ord('='))
+        k = np.searchsorted(eqs, ends) - 1
+        eq = eqs[np.maximum(k, 0)] if len(eqs) else starts
+        ok = (k >= 0) & (eq >= starts)
+        (starts, ends, eq) = (starts[ok], ends[ok], eq[ok])
+        if len(starts) == 0:
+            return
+        # the value is the run of up to 20 digits at the end of the line
+        width = min(len(pow10), int((ends - eq).max()))
+        digits = arr[np.maximum(ends[:, None] - 1 - np.arange(width), eq[:, None])] - np.uint8(ord('0'))
+        run = np.logical_and.accumulate(digits <= 9, axis = 1)
+        n = run.sum(axis = 1)
+        vals = (np.where(run, digits, 0).astype(np.uint64) * pow10[:width]).sum(axis = 1, dtype = np.uint64)
+        # and only blanks may come between the '=' and the value
+        ok = (n > 0) & (_strip(arr, eq + 1, ends, 1) == ends - n)
+        (starts, eq, vals) = (starts[ok], eq[ok], vals[ok])
+        # skip the 0x<index>, prefix printed by mkPerfOutputFSM
+        commas = np.flatnonzero(arr == ord(','))
+        if len(commas) != 0:
+            c = commas[np.minimum(np.searchsorted(commas, starts), len(commas) - 1)]
+            hex_prefix = (arr[starts] == ord('0')) & (arr[np.minimum(starts + 1, len(arr) - 1)] == ord('x'))
+            starts = np.where(hex_prefix & (c > starts) & (c < eq), c + 1, starts)
+        ends = _strip(arr, starts, eq, -1)
+        starts = _strip(arr, starts, ends, 1)
+        ok = starts < ends
+        (starts, ends, vals) = (starts[ok], ends[ok], vals[ok])
+        if len(starts) == 0:
+            return
+        # hash each name as sum(byte[i] * mult**(i - start))
+        if len(self.powers) < len(arr):
+            self.powers = powers(hash_mult, len(arr))
+            self.inv_powers = powers(hash_mult_inv, len(arr))
+        bounds = np.empty(2 * len(starts) - 1, dtype = starts.dtype)
+        bounds[0::2] = starts
+        bounds[1::2] = ends[:-1]
+        sums = np.add.reduceat(arr[:ends[-1]] * self.powers[:ends[-1]], bounds)[0::2]
+        keys = sums * self.inv_powers[starts] + (ends - starts).astype(np.uint64)
+        # look up the columns of known names, and add new names in the order
+        # they first appear
+        i = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        known = (self.keys[i] == keys) if len(self.keys) != 0 else np.zeros(len(keys), dtype = bool)
+        if not known.all():
+            (new_keys, first) = np.unique(keys[~known], return_index = True)
+            order = np.argsort(first)
+            first = np.flatnonzero(~known)[first[order]]
+            new_cols = np.arange(len(self.names), len(self.names) + len(first), dtype = np.int32)
+            self.names.extend(data[s:e] for (s, e) in zip(starts[first].tolist(), ends[first].tolist()))
+            all_keys = np.concatenate((self.keys, new_keys[order]))
+            all_cols = np.concatenate((self.key_cols, new_cols))
+            order = np.argsort(all_keys)
+            (self.keys, self.key_cols) = (all_keys[order], all_cols[order])
+            i = np.searchsorted(self.keys, keys)
+        if keep:
+            self.cols.append(self.key_cols[i])
+            self.vals.append(vals)
+
+    def finish(self):
+        if self.partial != b'':
+            self._parse(self.partial + b'\n')
+            self.partial = b''
+        names = [name.decode() for name in self.names]
+        if len(self.cols) == 0:
+            return Snapshots(names, np.ma.masked_all((0, len(names)), dtype = np.uint64), self.width)
+        cols = np.concatenate(self.cols)
+        vals = np.concatenate(self.vals)
+        rows = snapshot_rows(cols, len(names))
+        values = np.full((int(rows[-1]) + 1, len(names)), sentinel(self.width), dtype = np.uint64)
+        values[rows, cols] = vals
+        return Snapshots(names, np.ma.masked_equal(values, sentinel(self.width)), self.width)
+
+def snapshot_rows(cols, num_cols):
+    """Returns the snapshot of each line given its column.
+
+    A new snapshot starts at a line whose column already appeared in the
+    current snapshot. A snapshot has at most num_cols lines, so each boundary
+    is searched for in a window of that many lines after the previous one."""
+    # index of the previous line with the same column, or -1
+    prev = np.full(len(cols), -1, dtype = np.int64)
+    order = np.argsort(cols, kind = 'stable')
+    same = cols[order[1:]] == cols[order[:-1]]
+    prev[order[1:][same]] = order[:-1][same]
+    starts = [0]
+    while True:
+        start = starts[-1]
+        window = prev[start + 1 : start + 1 + num_cols] >= start
+        if not window.any():
+            break
+        starts.append(start + 1 + int(np.argmax(window)))
+    rows = np.zeros(len(cols), dtype = np.int64)
+    rows[starts[1:]] = 1
+    return np.cumsum(rows)
+
+def read_dumps(filenames, names = (), width = perf_data_sz, chunk_size = 1 << 20):
+    """Reads all the dumps in filenames (- for stdin) into a Snapshots."""
+    reader = DumpReader([name.encode() for name in names], width)
+    for filename in filenames:
+        f = sys.stdin.buffer if filename == '-' else open(filename, 'rb')
+        while True:
+            data = f.read(chunk_size)
+            if len(data) == 0:
+                break
+            reader.feed(data)
+        reader.feed(b'\n')
+        if f is not sys.stdin.buffer:
+            f.close()
+    return reader.finish()
+
+def deltas(snapshots, on_decrease = 'wrap'):
+    """Returns the per-interval increments as a masked uint64 array.
+
+    A counter that went down either wrapped around (on_decrease = 'wrap') or
+    was reset or set in between (on_decrease = 'reset'), in which case the new
+    value is the increment. Intervals with a masked end are masked."""
+    values = snapshots.values
+    new = values.data[1:]
+    old = values.data[:-1]
+    d = (new - old) & sentinel(snapshots.width)
+    if on_decrease == 'reset':
+        d = np.where(new < old, new, d)
+    mask = np.ma.getmaskarray(values)
+    return np.ma.masked_array(d, mask = mask[1:] | mask[:-1])
+
+def rates(d, per):
+    """Divides each row of d by the matching entry of per.
+
+    per is typically the deltas of a cycle counter. Rows where per is zero or
+    masked are masked."""
+    per = np.ma.masked_equal(np.ma.asarray(per).astype(np.float64), 0)
+    return d.astype(np.float64) / per[:, None]
+
+def ratio(d, num, den):
+    """Returns per-interval sum(d[:, num]) / sum(d[:, den]) for column lists."""
+    n = d[:, num].astype(np.float64).sum(axis = 1)
+    m = np.ma.masked_equal(d[:, den].astype(np.float64).sum(axis = 1), 0)
+    return n / m
+
+def group_names(names, depth):
+    """Returns the :: prefix of at most depth levels of each name."""
+    return ['::'.join(name.split('::')[:depth]) for name in names]
+
+def aggregate(d, names, depth):
+    """Sums the columns of d that share a :: prefix of depth levels.
+
+    Returns (group names, masked uint64 array). Masked entries count as zero
+    and a group is only masked if all its members are."""
+    groups = group_names(names, depth)
+    (keys, inverse) = np.unique(np.array(groups, dtype = object), return_inverse = True)
+    order = np.argsort(inverse, kind = 'stable')
+    bounds = np.flatnonzero(np.r_[True, np.diff(inverse[order]) != 0])
+    data = np.ma.filled(d, 0)[:, order]
+    mask = np.ma.getmaskarray(d)[:, order]
+    if d.shape[0] == 0:
+        return (list(keys), np.ma.masked_all((0, len(keys)), dtype = np.uint64))
+    sums = np.add.reduceat(data, bounds, axis = 1)
+    masked = np.logical_and.reduceat(mask, bounds, axis = 1)
+    return (list(keys), np.ma.masked_array(sums, mask = masked))
+
+def summary(d, names, per = None):
+    """Returns one row (name, total, mean, min, max, invalid[, rate]) per column."""
+    total = d.sum(axis = 0)
+    mean = d.astype(np.float64).mean(axis = 0)
+    lo = d.min(axis = 0)
+    hi = d.max(axis = 0)
+    invalid = np.ma.getmaskarray(d).sum(axis = 0)
+    rows = []
+    for i in range(len(names)):
+        row = [names[i], total[i], mean[i], lo[i], hi[i], int(invalid[i])]
+        if per is not None:
+            row.append(np.ma.masked if per is np.ma.masked or per == 0 or total[i] is np.ma.masked else float(total[i]) / float(per))
+        rows.append(row)
+    return rows
+
+def write_csv(filename, names, d, extra = ()):
+    """Writes one row per interval; masked entries are left empty."""
+    columns = [np.ma.asarray(d[:, i]) for i in range(d.shape[1])] + [np.ma.asarray(x) for (name, x) in extra]
+    header = ['interval'] + list(names) + [name for (name, x) in extra]
+    f = sys.stdout if filename == '-' else open(filename, 'w')
+    f.write(','.join(header) + '\n')
+    for r in range(d.shape[0]):
+        f.write(','.join([str(r)] + ['' if c.mask is not np.ma.nomask and c.mask[r] else str(c.data[r]) for c in columns]) + '\n')
+    if f is not sys.stdout:
+        f.close()
+
+def self_test(num_counters = 200, num_snapshots = 500, width = 16, seed = 0):
+    """Compares the vectorized results on synthetic dumps with a plain loop.
+
+    Returns the number of mismatches."""
+    rng = np.random.default_rng(seed)
+    mod = 1 << width
+    names = ['core%d::%s::c%d' % (i % 3, ['l1d', 'l1i', 'tlb'][i % 5 % 3], i) for i in range(num_counters)]
+    steps = rng.integers(0, mod // 4, size = (num_snapshots, num_counters))
+    values = np.cumsum(steps, axis = 0) % mod
+    values[values == mod - 1] = 0
+    # sprinkle invalid indices and drop a few counters from some dumps, but
+    # keep the first counter so consecutive dumps always share a name
+    invalid = rng.random(values.shape) < 0.01
+    missing = rng.random(values.shape) < 0.01
+    missing[:, 0] = False
+    lines = []
+    for s in range(num_snapshots):
+        for c in range(num_counters):
+            if not missing[s, c]:
+                v = mod - 1 if invalid[s, c] else values[s, c]
+                lines.append(('0x%x, %s = %d' % (c, names[c], v)) if s % 2 else ('%s = %d' % (names[c], v)))
+    data = ('\n'.join(lines) + '\n').encode()
+    # feed in odd sized pieces to exercise lines split across chunks
+    reader = DumpReader(width = width)
+    for i in range(0, len(data), 4093):
+        reader.feed(data[i:i + 4093])
+    snaps = reader.finish()
+    errors = 0
+    if sorted(snaps.names) != sorted(names) or snaps.values.shape != values.shape:
+        print('ERROR: parsed %d snapshots of %d counters, expected %d of %d' % (snaps.values.shape + values.shape))
+        return 1
+    # counters missing from the first dump get their columns later
+    snaps = Snapshots(names, snaps.values[:, [snaps.names.index(name) for name in names]], width)
+    # a counter that first appears in a later dump, where it is not last
+    reader = DumpReader(width = width)
+    reader.feed(b'a = 1\nb = 2\na = 3\nc = 4\nb = 5\na = 6\nc = 7\nb = 8\n')
+    small = reader.finish()
+    expected = np.ma.masked_array([[1, 2, 0], [3, 5, 4], [6, 8, 7]], mask = [[0, 0, 1], [0, 0, 0], [0, 0, 0]])
+    if small.names != ['a', 'b', 'c'] or small.values.shape != expected.shape or (small.values != expected).any() or (np.ma.getmaskarray(small.values) != expected.mask).any():
+        print('ERROR: parsed a,b / a,c,b / a,c,b as %s' % small.values.tolist())
+        errors += 1
+    d = deltas(snaps)
+    dmask = np.ma.getmaskarray(d)
+    (keys, g) = aggregate(d, names, 2)
+    gidx = {k: i for (i, k) in enumerate(keys)}
+    unavailable = invalid | missing
+    for s in range(1, num_snapshots):
+        sums = {}
+        for c in range(num_counters):
+            if unavailable[s, c] or unavailable[s - 1, c]:
+                if not dmask[s - 1, c]:
+                    errors += 1
+                continue
+            expected = (int(values[s, c]) - int(values[s - 1, c])) % mod
+            if dmask[s - 1, c] or int(d.data[s - 1, c]) != expected:
+                errors += 1
+            key = '::'.join(names[c].split('::')[:2])
+            sums[key] = sums.get(key, 0) + expected
+        for (key, x) in sums.items():
+            if int(g.data[s - 1, gidx[key]]) != x:
+                errors += 1
+    r = rates(d, d[:, 0])
+    for s in range(num_snapshots - 1):
+        for c in range(1, num_counters):
+            if dmask[s, c] or dmask[s, 0] or d.data[s, 0] == 0:
+                continue
+            if abs(r[s, c] - float(d.data[s, c]) / float(d.data[s, 0])) > 1e-9 * abs(r[s, c]):
+                errors += 1
+    if errors != 0:
+        print('ERROR: %d mismatches between the vectorized and reference results' % errors)
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Compute per-interval deltas, rates, and ratios from PerfMonitor dumps')
+    parser.add_argument('dumps', metavar = 'DUMP', nargs = '*', help = 'files with one or more dumps (- for stdin)')
+    parser.add_argument('-m', '--map', help = 'perfmon map (%s) giving the column order' % perfmon_ext)
+    parser.add_argument('-s', '--select', action = 'append', metavar = 'GLOB', help = 'only report counters matching GLOB (may be repeated)')
+    parser.add_argument('-d', '--depth', type = int, default = None, help = 'sum counters sharing the first DEPTH levels of their :: hierarchy')
+    parser.add_argument('--per', metavar = 'NAME', help = 'report rates relative to counter NAME (e.g. a cycle counter)')
+    parser.add_argument('--ratio', action = 'append', default = [], metavar = 'NUM/DEN', help = 'report sum(NUM)/sum(DEN) where NUM and DEN are names or globs (may be repeated)')
+    parser.add_argument('--reset', action = 'store_true', help = 'treat a decreasing counter as reset instead of wrapped around')
+    parser.add_argument('--width', type = int, default = perf_data_sz, help = 'counter width in bits (default: %(default)s)')
+    parser.add_argument('--csv', metavar = 'FILE', help = 'write the per-interval deltas, rates, and ratios to FILE (- for stdout)')
+    parser.add_argument('--test', action = 'store_true', help = 'check the vectorized code against a reference on synthetic dumps and exit')
+    args = parser.parse_args()
+
+    if args.test:
+        start = time.perf_counter()
+        errors = self_test()
+        sys.stderr.write('self test %s in %.3fs\n' % ('passed' if errors == 0 else 'FAILED', time.perf_counter() - start))
+        sys.exit(1 if errors else 0)
+    if len(args.dumps) == 0:
+        parser.print_usage()
+        sys.exit(1)
+
+    start = time.perf_counter()
+    snaps = read_dumps(args.dumps, read_map(args.map) if args.map else (), args.width)
+    sys.stderr.write('%d snapshots of %d counters read in %.3fs\n' % (snaps.values.shape[0], len(snaps.names), time.perf_counter() - start))
+    if snaps.values.shape[0] < 2:
+        print('ERROR: at least two snapshots are needed to compute deltas')
+        sys.exit(1)
+    d = deltas(snaps, 'reset' if args.reset else 'wrap')
+
+    per = None
+    if args.per is not None:
+        cols = snaps.columns(args.per)
+        if len(cols) != 1:
+            print('ERROR: --per %s matches %d counters' % (args.per, len(cols)))
+            sys.exit(1)
+        per = d[:, cols[0]]
+    extra = []
+    for spec in args.ratio:
+        (num, sep, den) = spec.rpartition('/')
+        if sep == '' or len(snaps.columns(num)) == 0 or len(snaps.columns(den)) == 0:
+            print('ERROR: --ratio %s does not name counters as NUM/DEN' % spec)
+            sys.exit(1)
+        extra.append((spec, ratio(d, snaps.columns(num), snaps.columns(den))))
+
+    names = snaps.names
+    if args.select:
+        cols = sorted(set(i for pattern in args.select for i in snaps.columns(pattern)))
+        names = [names[i] for i in cols]
+        d_out = d[:, cols]
+    else:
+        d_out = d
+    if args.depth is not None:
+        (names, d_out) = aggregate(d_out, names, args.depth)
+
+    total_per = None if per is None else per.sum()
+    width = max([len(name) for name in names] + [7])
+    header = '%-*s %20s %14s %20s %20s %7s' % (width, 'counter', 'total', 'mean', 'min', 'max', 'invalid')
+    print(header + ('' if per is None else ' %14s' % ('/' + args.per)))
+    for row in summary(d_out, names, total_per):
+        fields = ['-' if x is np.ma.masked else x for x in row]
+        line = '%-*s %20s %14s %20s %20s %7d' % (width, fields[0], fields[1], fields[2] if fields[2] == '-' else '%.2f' % fields[2], fields[3], fields[4], fields[5])
+        if per is not None:
+            line += ' %14s' % (fields[6] if fields[6] == '-' else '%.6g' % fields[6])
+        print(line)
+    for (spec, x) in extra:
+        (num, sep, den) = spec.rpartition('/')
+        n = d[:, snaps.columns(num)].astype(np.float64).sum()
+        m = d[:, snaps.columns(den)].astype(np.float64).sum()
+        print('%s = %s' % (spec, '-' if m == 0 else '%.6g' % (n / m)))
+
+    if args.csv is not None:
+        if per is not None:
+            extra = [('%s/%s' % (name, args.per), rates(d_out[:, i:i + 1], per)[:, 0]) for (i, name) in enumerate(names)] + extra
+        write_csv(args.csv, names, d_out, extra)
+        if args.csv != '-':
+            sys.stderr.write('wrote %s\n' % args.csv)
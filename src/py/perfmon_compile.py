@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compiler for PerfMonitor maps.
+#
+# mkPerfMonitor writes a .perfmon.txt map with one "0x<index>,name" line per
+# counter. The index has a PerfSubIndexSz bit sub-index for each of the
+# PerfLevels levels of the hierarchy, with the top module in the least
+# significant bits, and the name has one "::" separated part per level.
+#
+# This script checks that the indices are unique and fit in the hierarchy,
+# decodes them into a tree, and sorts the counters so the counters behind each
+# submodule path are read out together. Responses from a single path come back
+# in order, so the host can keep a whole group of requests in flight (see
+# PerfMonitor::printPerformanceCompiled). The result can be written as a binary
+# file or as a C header so the host does not have to parse text.
+#
+# Binary format (little endian):
+#   header:  char magic[4] = "PMAP", uint16 version, uint8 PerfSubIndexSz,
+#            uint8 PerfLevels, uint32 num_entries, uint32 num_groups,
+#            uint32 strings_size
+#   entries: num_entries x {uint32 index, uint32 name, uint32 group}
+#   groups:  num_groups x {uint32 first entry, uint32 num entries, uint32 path}
+#   strings: strings_size bytes of NUL terminated strings; name and path are
+#            offsets into these
+#
+# Examples:
+#   perfmon_compile.py mkProc.perfmon.txt --tree
+#   perfmon_compile.py mkProc.perfmon.txt --bin build/mkProc.perfmon.bin --header build/mkProc_perfmon.h
+
+import argparse
+import os
+import re
+import struct
+import sys
+
+from file_util import write_if_changed
+
+# These mirror the typedefs in PerfMonitor.bsv
+perf_sub_index_sz = 8
+perf_levels = 4
+
+magic = b'PMAP'
+version = 1
+header_format = '<4sHBBIII'
+entry_format = '<III'
+group_format = '<III'
+
+class Entry:
+    """A counter in a perfmon map."""
+    def __init__(self, index, name, line):
+        self.index = index
+        self.name = name
+        self.line = line
+        self.path = name.split('::')
+
+    def sub_indices(self, sub_index_sz = perf_sub_index_sz):
+        """Returns the sub-index of each level of the name, top level first."""
+        mask = (1 << sub_index_sz) - 1
+        return [(self.index >> (i * sub_index_sz)) & mask for i in range(len(self.path))]
+
+def parse_map(text, filename = '<map>', sub_index_sz = perf_sub_index_sz):
+    """Returns the entries of a perfmon map and a list of parse errors.
+
+    Lines are "index,name" with a hex (0x) or decimal index, as read by
+    PerfMonitor::printPerformance. Lines with several "index,name" pairs, one
+    per level and top level first, are accepted as well, like
+    mkPerfOutputFSM does."""
+    entries = []
+    errors = []
+    for (i, line) in enumerate(text.splitlines()):
+        line = line.strip()
+        if line == '':
+            continue
+        fields = [f.strip() for f in line.split(',')]
+        if len(fields) % 2 != 0:
+            errors.append('%s:%d: expected index,name pairs: %s' % (filename, i + 1, line))
+            continue
+        index = 0
+        names = []
+        try:
+            for level in range(len(fields) // 2 - 1, -1, -1):
+                index = (index << sub_index_sz) + int(fields[2 * level], 0)
+                names.insert(0, fields[2 * level + 1])
+        except ValueError:
+            errors.append('%s:%d: bad index: %s' % (filename, i + 1, line))
+            continue
+        entries.append(Entry(index, '::'.join(names), i + 1))
+    return (entries, errors)
+
+def check_map(entries, sub_index_sz = perf_sub_index_sz, levels = perf_levels, filename = '<map>'):
+    """Returns a list of problems that would make mkPerfMonitor.req miss.
+
+    An index has to fit in sub_index_sz * levels bits, a name can have at most
+    levels parts, the bits above a counter's level have to be zero, and each
+    submodule path has to map to exactly one sub-index prefix. A sub-index
+    used for a counter can not also lead to a submodule."""
+    errors = []
+    index_sz = sub_index_sz * levels
+    seen_index = {}
+    seen_name = {}
+    # (parent path, sub-index) -> child name, and (parent path, name) -> sub-index
+    child_name = {}
+    child_index = {}
+    counter_slots = set()
+    submodule_slots = set()
+    for e in entries:
+        where = '%s:%d' % (filename, e.line)
+        if e.index >> index_sz != 0:
+            errors.append('%s: index 0x%x of %s does not fit in %d bits' % (where, e.index, e.name, index_sz))
+            continue
+        if len(e.path) > levels:
+            errors.append('%s: %s has %d levels but PerfLevels is %d' % (where, e.name, len(e.path), levels))
+            continue
+        if e.index >> (len(e.path) * sub_index_sz) != 0:
+            errors.append('%s: index 0x%x of %s has bits set past its %d levels' % (where, e.index, e.name, len(e.path)))
+            continue
+        if e.index in seen_index:
+            errors.append('%s: index 0x%x of %s is also used by %s on line %d' % (where, e.index, e.name, seen_index[e.index].name, seen_index[e.index].line))
+        else:
+            seen_index[e.index] = e
+        if e.name in seen_name:
+            errors.append('%s: %s is also defined on line %d' % (where, e.name, seen_name[e.name].line))
+        else:
+            seen_name[e.name] = e
+        subs = e.sub_indices(sub_index_sz)
+        for level in range(len(e.path)):
+            parent = tuple(e.path[:level])
+            if level == len(e.path) - 1:
+                counter_slots.add((parent, subs[level]))
+                continue
+            submodule_slots.add((parent, subs[level]))
+            name = e.path[level]
+            if child_name.setdefault((parent, subs[level]), name) != name:
+                errors.append('%s: sub-index %d of %s is used by both %s and %s' % (where, subs[level], '::'.join(parent) or 'the top module', child_name[(parent, subs[level])], name))
+            if child_index.setdefault((parent, name), subs[level]) != subs[level]:
+                errors.append('%s: submodule %s has sub-indices %d and %d' % (where, '::'.join(parent + (name,)), child_index[(parent, name)], subs[level]))
+    for (parent, sub) in sorted(counter_slots & submodule_slots):
+        errors.append('%s: sub-index %d of %s is used by both a counter and a submodule' % (filename, sub, '::'.join(parent) or 'the top module'))
+    return errors
+
+def readout_order(entries, sub_index_sz = perf_sub_index_sz):
+    """Sorts entries depth first and groups them by submodule path.
+
+    Returns (entries, groups) where groups is a list of (path, first, count)
+    and path is the "::" separated submodule path ('' for the top module)."""
+    ordered = sorted(entries, key = lambda e: e.sub_indices(sub_index_sz))
+    groups = []
+    for (i, e) in enumerate(ordered):
+        path = '::'.join(e.path[:-1])
+        if len(groups) != 0 and groups[-1][0] == path:
+            groups[-1][2] += 1
+        else:
+            groups.append([path, i, 1])
+    return (ordered, [tuple(g) for g in groups])
+
+def format_tree(entries, sub_index_sz = perf_sub_index_sz):
+    """Returns the decoded index tree as indented text."""
+    ordered = readout_order(entries, sub_index_sz)[0]
+    lines = []
+    printed = ()
+    for e in ordered:
+        subs = e.sub_indices(sub_index_sz)
+        path = tuple(e.path[:-1])
+        common = 0
+        while common < min(len(path), len(printed)) and path[common] == printed[common]:
+            common += 1
+        for level in range(common, len(path)):
+            lines.append('%s[%d] %s' % ('  ' * level, subs[level], path[level]))
+        printed = path
+        lines.append('%s%d: %s (0x%x)' % ('  ' * len(path), subs[-1], e.path[-1], e.index))
+    return '\n'.join(lines) + '\n'
+
+class Strings:
+    """Table of NUL terminated strings."""
+    def __init__(self):
+        self.offsets = {}
+        self.data = bytearray()
+
+    def add(self, s):
+        if s not in self.offsets:
+            self.offsets[s] = len(self.data)
+            self.data += s.encode() + b'\0'
+        return self.offsets[s]
+
+def to_binary(ordered, groups, sub_index_sz = perf_sub_index_sz, levels = perf_levels):
+    """Returns the compiled map as bytes."""
+    strings = Strings()
+    group_of = []
+    for (g, (path, first, count)) in enumerate(groups):
+        group_of += [g] * count
+    entry_data = b''.join(struct.pack(entry_format, e.index, strings.add(e.name), g) for (e, g) in zip(ordered, group_of))
+    group_data = b''.join(struct.pack(group_format, first, count, strings.add(path)) for (path, first, count) in groups)
+    header = struct.pack(header_format, magic, version, sub_index_sz, levels, len(ordered), len(groups), len(strings.data))
+    return header + entry_data + group_data + bytes(strings.data)
+
+def from_binary(data):
+    """Returns (sub_index_sz, levels, [(index, name)], [(path, first, count)])."""
+    (m, v, sub_index_sz, levels, num_entries, num_groups, strings_size) = struct.unpack_from(header_format, data)
+    if m != magic or v != version:
+        raise ValueError('not a version %d perfmon map' % version)
+    offset = struct.calcsize(header_format)
+    strings_offset = offset + num_entries * struct.calcsize(entry_format) + num_groups * struct.calcsize(group_format)
+    def string(i):
+        return data[strings_offset + i : data.index(b'\0', strings_offset + i)].decode()
+    entries = []
+    for (index, name, group) in struct.iter_unpack(entry_format, data[offset : offset + num_entries * struct.calcsize(entry_format)]):
+        entries.append((index, string(name)))
+    offset += num_entries * struct.calcsize(entry_format)
+    groups = [(string(path), first, count) for (first, count, path) in struct.iter_unpack(group_format, data[offset : strings_offset])]
+    return (sub_index_sz, levels, entries, groups)
+
+def c_string(s):
+    return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"')
+
+def to_header(ordered, groups, guard, prefix = 'perfmon', sub_index_sz = perf_sub_index_sz, levels = perf_levels):
+    """Returns the compiled map as a C header with static arrays."""
+    lines = [
+        '// Generated by perfmon_compile.py; do not edit.',
+        '',
+        '#ifndef %s' % guard,
+        '#define %s' % guard,
+        '',
+        '#include <stdint.h>',
+        '',
+        '#define %s_SUB_INDEX_SZ %d' % (prefix.upper(), sub_index_sz),
+        '#define %s_LEVELS %d' % (prefix.upper(), levels),
+        '#define %s_NUM_ENTRIES %d' % (prefix.upper(), len(ordered)),
+        '#define %s_NUM_GROUPS %d' % (prefix.upper(), len(groups)),
+        '',
+        '// counters in readout order',
+        'static const uint32_t %s_index[%s_NUM_ENTRIES] = {' % (prefix, prefix.upper()),
+    ]
+    lines += ['    0x%x,' % e.index for e in ordered]
+    lines += ['};', 'static const char *const %s_name[%s_NUM_ENTRIES] = {' % (prefix, prefix.upper())]
+    lines += ['    %s,' % c_string(e.name) for e in ordered]
+    lines += [
+        '};',
+        '',
+        '// runs of counters behind the same submodule path; responses within a',
+        '// group come back in request order',
+        'static const uint32_t %s_group_first[%s_NUM_GROUPS] = {' % (prefix, prefix.upper()),
+    ]
+    lines += ['    %d,' % first for (path, first, count) in groups]
+    lines += ['};', 'static const uint32_t %s_group_count[%s_NUM_GROUPS] = {' % (prefix, prefix.upper())]
+    lines += ['    %d,' % count for (path, first, count) in groups]
+    lines += ['};', 'static const char *const %s_group_path[%s_NUM_GROUPS] = {' % (prefix, prefix.upper())]
+    lines += ['    %s,' % c_string(path) for (path, first, count) in groups]
+    lines += ['};', '', '#endif', '']
+    return '\n'.join(lines)
+
+def to_text(ordered):
+    """Returns the map in readout order in the .perfmon.txt format."""
+    return ''.join('0x%x,%s\n' % (e.index, e.name) for e in ordered)
+
+def self_check():
+    """Builds maps the way mkPerfMonitor does and checks the compiler on them.
+
+    Returns the number of failures."""
+    # mirrors the loop in mkPerfMonitor that writes the map
+    def build(counters, submodules):
+        lines = ['0x%x,%s' % (i, c) for (i, c) in enumerate(counters)]
+        for (j, (sub_name, sub_lines)) in enumerate(submodules):
+            for line in sub_lines:
+                (index, counter) = line.split(',', 1)
+                lines.append('0x%x,%s::%s' % ((int(index, 16) << perf_sub_index_sz) + len(counters) + j, sub_name, counter))
+        return lines
+    l1 = build(['hits', 'misses'], [])
+    tlb = build(['walks'], [])
+    core = build(['cycles', 'insts'], [('l1i', l1), ('l1d', l1), ('tlb', tlb)])
+    top = build(['cycles'], [('core', core), ('core_2', core)])
+    failures = 0
+    (entries, errors) = parse_map('\n'.join(top))
+    errors += check_map(entries)
+    if errors:
+        print('ERROR: valid map rejected: %s' % '; '.join(errors))
+        failures += 1
+    (ordered, groups) = readout_order(entries)
+    expected = ['', 'core', 'core::l1i', 'core::l1d', 'core::tlb', 'core_2', 'core_2::l1i', 'core_2::l1d', 'core_2::tlb']
+    if [g[0] for g in groups] != expected:
+        print('ERROR: readout groups %s, expected %s' % ([g[0] for g in groups], expected))
+        failures += 1
+    (sub_index_sz, levels, decoded, decoded_groups) = from_binary(to_binary(ordered, groups))
+    if decoded != [(e.index, e.name) for e in ordered] or decoded_groups != groups:
+        print('ERROR: binary map does not round trip')
+        failures += 1
+    # the multi-pair form used by mkPerfOutputFSM decodes to the same indices
+    pairs = '\n'.join(','.join('0x%x,%s' % (s, p) for (s, p) in zip(e.sub_indices(), e.path)) for e in entries)
+    (pair_entries, errors) = parse_map(pairs)
+    if errors or [(e.index, e.name) for e in pair_entries] != [(e.index, e.name) for e in entries]:
+        print('ERROR: index,name pairs decode differently')
+        failures += 1
+    bad_maps = [
+        ('duplicate index', top + ['0x0,other']),
+        ('duplicate name', top + ['0x2,cycles']),
+        ('too many levels', top + ['0x%x,a::b::c::d::e' % 0x01010101]),
+        ('index too wide', top + ['0x100000000,huge']),
+        ('bits past last level', top + ['0x500,misplaced']),
+        ('counter and submodule', top + ['0x2,core']),
+        ('inconsistent submodule', top + ['0x%x,core::extra' % ((7 << perf_sub_index_sz) + 2)]),
+    ]
+    for (what, lines) in bad_maps:
+        (entries, errors) = parse_map('\n'.join(lines))
+        errors += check_map(entries)
+        if len(errors) == 0:
+            print('ERROR: map with %s was accepted' % what)
+            failures += 1
+    return failures
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Check a PerfMonitor map and compile it for fast readout')
+    parser.add_argument('map', nargs = '?', help = 'map written by mkPerfMonitor (*.perfmon.txt)')
+    parser.add_argument('--sub-index-sz', type = int, default = perf_sub_index_sz, help = 'PerfSubIndexSz (default: %(default)s)')
+    parser.add_argument('--levels', type = int, default = perf_levels, help = 'PerfLevels (default: %(default)s)')
+    parser.add_argument('--tree', action = 'store_true', help = 'print the decoded index tree')
+    parser.add_argument('--bin', metavar = 'FILE', help = 'write the compiled map for PerfMonitor::printPerformanceCompiled')
+    parser.add_argument('--header', metavar = 'FILE', help = 'write the compiled map as a C header')
+    parser.add_argument('--prefix', default = 'perfmon', help = 'prefix of the names in the C header (default: %(default)s)')
+    parser.add_argument('--order', metavar = 'FILE', help = 'write the map in readout order in the .perfmon.txt format')
+    parser.add_argument('--check', action = 'store_true', help = 'run the compiler on maps built like mkPerfMonitor does and exit')
+    args = parser.parse_args()
+
+    if args.check:
+        failures = self_check()
+        print('%d failures' % failures)
+        sys.exit(1 if failures else 0)
+    if args.map is None:
+        parser.print_usage()
+        sys.exit(1)
+
+    with open(args.map) as f:
+        (entries, errors) = parse_map(f.read(), args.map, args.sub_index_sz)
+    errors += check_map(entries, args.sub_index_sz, args.levels, args.map)
+    if len(errors) != 0:
+        for error in errors:
+            sys.stderr.write('ERROR: %s\n' % error)
+        sys.exit(1)
+    (ordered, groups) = readout_order(entries, args.sub_index_sz)
+    sys.stderr.write('%d counters in %d groups\n' % (len(ordered), len(groups)))
+    if args.tree:
+        sys.stdout.write(format_tree(entries, args.sub_index_sz))
+    outputs = []
+    if args.bin is not None:
+        outputs.append((args.bin, to_binary(ordered, groups, args.sub_index_sz, args.levels)))
+    if args.header is not None:
+        guard = re.sub(r'\W', '_', os.path.basename(args.header)).upper()
+        outputs.append((args.header, to_header(ordered, groups, guard, args.prefix, args.sub_index_sz, args.levels)))
+    if args.order is not None:
+        outputs.append((args.order, to_text(ordered)))
+    for (filename, data) in outputs:
+        if write_if_changed(filename, data):
+            sys.stderr.write('wrote %s\n' % filename)
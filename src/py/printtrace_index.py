@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Index and latency statistics for PrintTrace logs.
+#
+# fprintTraceHelper writes one line per call, "(<time>) name(args) = value"
+# with the timestamp only for printTimedTraceM and the arguments and value
+# only when there are any. The call name ends in the method, e.g.
+# "myfifo.enq", "myfifo.deq", "mem.request.put" or "mem.response.get".
+#
+# build reads the log once in line aligned chunks and parses each chunk with
+# numpy. It writes a sidecar index with the byte offset, line number, and time
+# of the first line of every block of --block-size bytes, and for every call
+# name the blocks it occurs in. Queries use these to read only the blocks
+# they need.
+#
+# The same pass pairs the k-th enq with the k-th deq of each FIFO (until a
+# clear), the k-th request.put with the k-th response.get of each Server, and
+# the k-th request.get with the k-th response.put of each Client, and keeps
+# exact latency histograms. Logs without timestamps use line numbers as time.
+#
+# Examples:
+#   printtrace_index.py build sim.log
+#   printtrace_index.py stats sim.log
+#   printtrace_index.py window sim.log 100000 100500
+#   printtrace_index.py calls sim.log 'core.l1d.*'
+
+import argparse
+import fnmatch
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+from np_text import chunk_ranges, hash_mult, hash_mult_inv, pow10, powers
+
+magic = b'PTRACEIX'
+version = 1
+preamble_format = '<8sQ'
+
+# method suffix -> (role, pairing); role 0 starts, 1 ends, and 2 clears a pairing
+methods = [
+    ('.enq', 0, 'enq->deq'),
+    ('.deq', 1, 'enq->deq'),
+    ('.clear', 2, 'enq->deq'),
+    ('.request.put', 0, 'request.put->response.get'),
+    ('.response.get', 1, 'request.put->response.get'),
+    ('.request.get', 0, 'request.get->response.put'),
+    ('.response.put', 1, 'request.get->response.put'),
+]
+
+def _first_at_or_after(positions, starts, limit):
+    """Returns the first of positions at or after each start, or limit."""
+    if len(positions) == 0:
+        return limit.copy()
+    i = np.searchsorted(positions, starts)
+    found = positions[np.minimum(i, len(positions) - 1)]
+    return np.where((i < len(positions)) & (found < limit), found, limit)
+
+def classify(name):
+    """Returns (interface, role, pairing) of a call name."""
+    for (suffix, role, pairing) in methods:
+        if name.endswith(suffix):
+            return (name[:-len(suffix)], role, pairing)
+    return (None, -1, None)
+
+class LatencyTracker:
+    """Pairs starts and ends of one interface, across chunks."""
+    def __init__(self):
+        self.pending_starts = np.zeros(0, dtype = np.int64)
+        self.pending_ends = np.zeros(0, dtype = np.int64)
+        self.values = []
+        self.cleared = 0
+
+    def _match(self, starts, ends):
+        starts = np.concatenate((self.pending_starts, starts))
+        ends = np.concatenate((self.pending_ends, ends))
+        m = min(len(starts), len(ends))
+        self.values.append(ends[:m] - starts[:m])
+        (self.pending_starts, self.pending_ends) = (starts[m:], ends[m:])
+
+    def add(self, roles, times):
+        """Adds the events of one chunk in log order."""
+        clears = np.flatnonzero(roles == 2)
+        bounds = np.concatenate(([0], clears, [len(roles)]))
+        for (i, (lo, hi)) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if i != 0:
+                self.cleared += len(self.pending_starts)
+                self.pending_starts = self.pending_starts[:0]
+                self.pending_ends = self.pending_ends[:0]
+                lo += 1
+            (r, t) = (roles[lo:hi], times[lo:hi])
+            self._match(t[r == 0], t[r == 1])
+        if len(self.values) > 64:
+            self.compact()
+
+    def compact(self):
+        values = np.concatenate(self.values) if self.values else np.zeros(0, dtype = np.int64)
+        self.values = [values]
+
+    def histogram(self):
+        """Returns (latencies, counts) with distinct latencies in order."""
+        self.compact()
+        return np.unique(self.values[0], return_counts = True)
+
+def summarize(latencies, counts):
+    if len(latencies) == 0:
+        return {'count': 0}
+    total = int(counts.sum())
+    cum = np.cumsum(counts)
+    def percentile(p):
+        return int(latencies[np.searchsorted(cum, p * total / 100.0)])
+    return {
+        'count': total,
+        'min': int(latencies[0]),
+        'mean': float((latencies * counts).sum()) / total,
+        'p50': percentile(50),
+        'p90': percentile(90),
+        'p99': percentile(99),
+        'max': int(latencies[-1]),
+    }
+
+class Indexer:
+    """Builds the index of one log, a chunk at a time."""
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.names = []
+        self.keys = np.zeros(0, dtype = np.uint64)
+        self.key_ids = np.zeros(0, dtype = np.int64)
+        self.powers = np.zeros(0, dtype = np.uint64)
+        self.inv_powers = np.zeros(0, dtype = np.uint64)
+        self.lines = 0
+        self.timed = False
+        self.blocks = []
+        self.last_block = -1
+        self.postings = []
+        self.name_counts = np.zeros(0, dtype = np.int64)
+        self.role = np.zeros(0, dtype = np.int64)
+        self.iface = np.zeros(0, dtype = np.int64)
+        self.ifaces = []
+        self.trackers = []
+
+    def _name_ids(self, data, arr, starts, ends):
+        # hash only the name bytes, gathered into one array
+        lengths = ends - starts
+        local_ends = np.cumsum(lengths)
+        local_starts = local_ends - lengths
+        names = arr[np.repeat(starts - local_starts, lengths) + np.arange(local_ends[-1])]
+        if len(self.powers) < len(names):
+            self.powers = powers(hash_mult, len(names))
+            self.inv_powers = powers(hash_mult_inv, len(names))
+        sums = np.add.reduceat(names * self.powers[:len(names)], local_starts)
+        keys = sums * self.inv_powers[local_starts] + lengths.astype(np.uint64)
+        i = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        known = (self.keys[i] == keys) if len(self.keys) != 0 else np.zeros(len(keys), dtype = bool)
+        if not known.all():
+            (new_keys, first) = np.unique(keys[~known], return_index = True)
+            first = np.flatnonzero(~known)[first]
+            new_ids = np.arange(len(self.names), len(self.names) + len(first))
+            for (s, e) in zip(starts[first].tolist(), ends[first].tolist()):
+                self._add_name(data[s:e].decode(errors = 'replace'))
+            keys_all = np.concatenate((self.keys, new_keys))
+            ids_all = np.concatenate((self.key_ids, new_ids))
+            order = np.argsort(keys_all)
+            (self.keys, self.key_ids) = (keys_all[order], ids_all[order])
+            i = np.searchsorted(self.keys, keys)
+        return self.key_ids[i]
+
+    def _add_name(self, name):
+        (iface, role, pairing) = classify(name)
+        self.names.append(name)
+        self.name_counts = np.append(self.name_counts, 0)
+        self.role = np.append(self.role, role)
+        if iface is None:
+            self.iface = np.append(self.iface, -1)
+            return
+        key = '%s (%s)' % (iface, pairing)
+        if key not in self.ifaces:
+            self.ifaces.append(key)
+            self.trackers.append(LatencyTracker())
+        self.iface = np.append(self.iface, self.ifaces.index(key))
+
+    def add(self, data, offset):
+        """Indexes the whole lines in data, which start at byte offset."""
+        arr = np.frombuffer(data, dtype = np.uint8)
+        ends = np.flatnonzero(arr == ord('\n'))
+        if len(arr) != 0 and arr[-1] != ord('\n'):
+            ends = np.append(ends, len(arr))
+        starts = np.zeros(len(ends), dtype = np.int64)
+        starts[1:] = ends[:-1] + 1
+        line_numbers = self.lines + np.arange(len(starts))
+        self.lines += len(starts)
+        # "(<time>) " prefix
+        closes = _first_at_or_after(np.flatnonzero(arr == ord(')')), starts, ends)
+        timed = (arr[np.minimum(starts, len(arr) - 1)] == ord('(')) & (closes < ends) & (closes - starts > 1) & (closes - starts <= 21)
+        width = 20
+        pos = closes[:, None] - 1 - np.arange(width)
+        digits = arr[np.maximum(pos, 0)] - np.uint8(ord('0'))
+        run = np.logical_and.accumulate((digits <= 9) & (pos > starts[:, None]), axis = 1)
+        timed &= run.sum(axis = 1) == closes - starts - 1
+        times = (np.where(run, digits, 0).astype(np.uint64) * pow10).sum(axis = 1, dtype = np.uint64).astype(np.int64)
+        times = np.where(timed, times, line_numbers)
+        self.timed |= bool(timed.any())
+        name_starts = np.where(timed, closes + 1, starts)
+        name_starts += (name_starts < ends) & (arr[np.minimum(name_starts, len(arr) - 1)] == ord(' '))
+        # the name ends at its arguments, at " = ", or at the end of the line
+        equals = np.flatnonzero(arr == ord('='))
+        equals = equals[(equals > 0) & (equals < len(arr) - 1)]
+        equals = equals[(arr[equals - 1] == ord(' ')) & (arr[equals + 1] == ord(' '))] - 1
+        name_ends = np.minimum(_first_at_or_after(np.flatnonzero(arr == ord('(')), name_starts, ends), _first_at_or_after(equals, name_starts, ends))
+        ok = name_ends > name_starts
+        (starts, times, name_starts, name_ends, line_numbers) = (starts[ok], times[ok], name_starts[ok], name_ends[ok], line_numbers[ok])
+        if len(starts) == 0:
+            return
+        ids = self._name_ids(data, arr, name_starts, name_ends)
+        self.name_counts += np.bincount(ids, minlength = len(self.names))
+        # blocks start at the first line starting in each block_size window
+        block_ids = (starts + offset) // self.block_size
+        first = np.flatnonzero(np.concatenate(([True], block_ids[1:] != block_ids[:-1])))
+        if self.last_block == block_ids[0]:
+            first = first[1:]
+        is_first = np.zeros(len(starts), dtype = np.int64)
+        is_first[first] = 1
+        block_index = sum(len(b[0]) for b in self.blocks) + np.cumsum(is_first) - 1
+        self.blocks.append(((starts[first] + offset).astype(np.uint64), line_numbers[first].astype(np.uint64), times[first]))
+        self.last_block = block_ids[-1]
+        self.postings.append(np.unique(ids.astype(np.int64) << 32 | block_index))
+        # latencies
+        roles = self.role[ids]
+        paired = np.flatnonzero(roles >= 0)
+        iface = self.iface[ids[paired]]
+        order = np.argsort(iface, kind = 'stable')
+        (iface, paired) = (iface[order], paired[order])
+        bounds = np.flatnonzero(np.concatenate(([True], iface[1:] != iface[:-1], [True])))
+        for (lo, hi) in zip(bounds[:-1], bounds[1:]):
+            self.trackers[iface[lo]].add(roles[paired[lo:hi]], times[paired[lo:hi]])
+
+    def write(self, filename, log, log_stat):
+        offsets = np.concatenate([b[0] for b in self.blocks]) if self.blocks else np.zeros(0, dtype = np.uint64)
+        block_lines = np.concatenate([b[1] for b in self.blocks]) if self.blocks else np.zeros(0, dtype = np.uint64)
+        block_times = np.concatenate([b[2] for b in self.blocks]) if self.blocks else np.zeros(0, dtype = np.int64)
+        # (name, block) pairs as name << 32 | block
+        pairs = np.unique(np.concatenate(self.postings)) if self.postings else np.zeros(0, dtype = np.int64)
+        posting_offsets = np.searchsorted(pairs >> 32, np.arange(len(self.names) + 1)).astype(np.uint64)
+        latency = {}
+        for (key, tracker) in zip(self.ifaces, self.trackers):
+            (values, counts) = tracker.histogram()
+            latency[key] = summarize(values, counts)
+            latency[key]['unmatched_starts'] = len(tracker.pending_starts)
+            latency[key]['unmatched_ends'] = len(tracker.pending_ends)
+            latency[key]['cleared'] = tracker.cleared
+            latency[key]['histogram'] = [[int(v), int(c)] for (v, c) in zip(values, counts)]
+        arrays = {
+            'block_offset': offsets,
+            'block_line': block_lines,
+            'block_time': block_times,
+            'posting_offset': posting_offsets,
+            'posting_block': (pairs & 0xffffffff).astype(np.uint32),
+        }
+        footer = {
+            'version': version,
+            'log': os.path.abspath(log),
+            'log_size': log_stat.st_size,
+            'log_mtime_ns': log_stat.st_mtime_ns,
+            'lines': self.lines,
+            'timed': self.timed,
+            'block_size': self.block_size,
+            'names': self.names,
+            'name_counts': self.name_counts.tolist(),
+            'latency': latency,
+            'sections': {},
+        }
+        with open(filename, 'wb') as f:
+            f.write(struct.pack(preamble_format, magic, 0))
+            for (name, array) in arrays.items():
+                f.write(b'\0' * (-f.tell() % 8))
+                footer['sections'][name] = {'offset': f.tell(), 'dtype': array.dtype.str, 'shape': list(array.shape)}
+                f.write(np.ascontiguousarray(array).tobytes())
+            offset = f.tell()
+            f.write(json.dumps(footer, sort_keys = True).encode())
+            f.seek(0)
+            f.write(struct.pack(preamble_format, magic, offset))
+
+def default_index(log):
+    return log + '.idx'
+
+def build(log, index = None, block_size = 1 << 16, chunk_size = 1 << 26):
+    """Indexes log in one pass and writes the index. Returns the Indexer."""
+    indexer = Indexer(block_size)
+    st = os.stat(log)
+    with open(log, 'rb') as f:
+        for (start, end) in chunk_ranges(log, 0, chunk_size):
+            f.seek(start)
+            indexer.add(f.read(end - start), start)
+    indexer.write(index or default_index(log), log, st)
+    return indexer
+
+class TraceIndex:
+    """Reader for an index written by build."""
+    def __init__(self, log, index = None):
+        self.log = log
+        filename = index or default_index(log)
+        with open(filename, 'rb') as f:
+            (m, offset) = struct.unpack(preamble_format, f.read(struct.calcsize(preamble_format)))
+            if m != magic:
+                raise ValueError('%s is not a PrintTrace index' % filename)
+            f.seek(offset)
+            self.footer = json.loads(f.read().decode())
+        if self.footer['version'] != version:
+            raise ValueError('%s is version %d, expected %d' % (filename, self.footer['version'], version))
+        st = os.stat(log)
+        if (st.st_size, st.st_mtime_ns) != (self.footer['log_size'], self.footer['log_mtime_ns']):
+            raise ValueError('%s is out of date, rebuild it' % filename)
+        self.names = self.footer['names']
+        for (name, s) in self.footer['sections'].items():
+            shape = tuple(s['shape'])
+            if np.prod(shape) == 0:
+                array = np.zeros(shape, dtype = s['dtype'])
+            else:
+                array = np.memmap(filename, dtype = s['dtype'], mode = 'r', offset = s['offset'], shape = shape)
+            setattr(self, name, array)
+
+    def _block_range(self, i):
+        end = int(self.block_offset[i + 1]) if i + 1 < len(self.block_offset) else self.footer['log_size']
+        return (int(self.block_offset[i]), end)
+
+    def _lines(self, f, start, end, first_line):
+        f.seek(start)
+        for (i, line) in enumerate(f.read(end - start).decode(errors = 'replace').splitlines()):
+            yield (first_line + i, line)
+
+    def window(self, t0, t1):
+        """Yields (line number, line) for the lines with time in [t0, t1].
+
+        Without timestamps in the log, times are line numbers."""
+        if len(self.block_time) == 0:
+            return
+        i = max(0, int(np.searchsorted(self.block_time, t0, side = 'left')) - 1)
+        with open(self.log, 'rb') as f:
+            while i < len(self.block_offset):
+                (start, end) = self._block_range(i)
+                for (n, line) in self._lines(f, start, end, int(self.block_line[i])):
+                    t = line_time(line, n)
+                    if t > t1:
+                        return
+                    if t >= t0:
+                        yield (n, line)
+                i += 1
+
+    def calls(self, pattern):
+        """Yields (line number, line) for the calls whose name matches pattern."""
+        ids = [i for (i, name) in enumerate(self.names) if fnmatch.fnmatchcase(name, pattern)]
+        if len(ids) == 0:
+            return
+        wanted = set(self.names[i] for i in ids)
+        blocks = np.unique(np.concatenate([self.posting_block[int(self.posting_offset[i]):int(self.posting_offset[i + 1])] for i in ids]))
+        with open(self.log, 'rb') as f:
+            for b in blocks.tolist():
+                (start, end) = self._block_range(b)
+                for (n, line) in self._lines(f, start, end, int(self.block_line[b])):
+                    if line_name(line) in wanted:
+                        yield (n, line)
+
+def line_time(line, line_number):
+    """Returns the timestamp of a line, or line_number if it has none."""
+    if line.startswith('(') and ')' in line:
+        t = line[1:line.index(')')]
+        if t.isdigit():
+            return int(t)
+    return line_number
+
+def line_name(line):
+    """Returns the call name of a line."""
+    if line.startswith('(') and ')' in line and line[1:line.index(')')].isdigit():
+        line = line[line.index(')') + 1:]
+    line = line[1:] if line.startswith(' ') else line
+    end = len(line)
+    for sep in ('(', ' = '):
+        if sep in line:
+            end = min(end, line.index(sep))
+    return line[:end]
+
+def format_stats(footer):
+    lines = ['%d lines, %d call names, %s' % (footer['lines'], len(footer['names']), 'timed' if footer['timed'] else 'no timestamps (latencies in lines)')]
+    width = max([len(name) for name in footer['names']] + [4])
+    lines.append('')
+    for (name, count) in sorted(zip(footer['names'], footer['name_counts']), key = lambda x: -x[1]):
+        lines.append('%-*s %12d' % (width, name, count))
+    if footer['latency']:
+        width = max(len(key) for key in footer['latency'])
+        lines.append('')
+        lines.append('%-*s %10s %8s %10s %8s %8s %8s %8s %s' % (width, 'latency', 'pairs', 'min', 'mean', 'p50', 'p90', 'p99', 'max', 'unmatched'))
+        for (key, s) in sorted(footer['latency'].items()):
+            unmatched = '%d starts, %d ends, %d cleared' % (s['unmatched_starts'], s['unmatched_ends'], s['cleared'])
+            if s['count'] == 0:
+                lines.append('%-*s %10d %8s %10s %8s %8s %8s %8s %s' % (width, key, 0, '-', '-', '-', '-', '-', '-', unmatched))
+            else:
+                lines.append('%-*s %10d %8d %10.2f %8d %8d %8d %8d %s' % (width, key, s['count'], s['min'], s['mean'], s['p50'], s['p90'], s['p99'], s['max'], unmatched))
+    return '\n'.join(lines) + '\n'
+
+def self_test(tmp, num_events = 20000, seed = 0):
+    """Indexes a random log and compares the results with a line by line scan.
+
+    Returns the number of mismatches."""
+    rng = np.random.default_rng(seed)
+    lines = []
+    fifos = {'f%d' % i: [] for i in range(3)}
+    server = []
+    t = 0
+    expected = {'f%d (enq->deq)' % i: [] for i in range(3)}
+    expected['mem (request.put->response.get)'] = []
+    for e in range(num_events):
+        t += int(rng.integers(0, 3)) * 10
+        f = 'f%d' % rng.integers(0, 3)
+        r = rng.random()
+        if r < 0.4:
+            fifos[f].append(t)
+            lines.append('(%d) %s.enq(%d)' % (t, f, rng.integers(0, 100)))
+        elif r < 0.8 and fifos[f]:
+            expected[f + ' (enq->deq)'].append(t - fifos[f].pop(0))
+            lines.append('(%d) %s.deq = %d' % (t, f, rng.integers(0, 100)))
+        elif r < 0.81:
+            fifos[f] = []
+            lines.append('(%d) %s.clear' % (t, f))
+        elif r < 0.9:
+            server.append(t)
+            lines.append('(%d) mem.request.put(MemReq { addr: \'h%x })' % (t, rng.integers(0, 1 << 20)))
+        elif server:
+            expected['mem (request.put->response.get)'].append(t - server.pop(0))
+            lines.append('(%d) mem.response.get = %d' % (t, rng.integers(0, 100)))
+        else:
+            lines.append('(%d) r._write(%d)' % (t, rng.integers(0, 100)))
+    log = os.path.join(tmp, 'trace.log')
+    with open(log, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    build(log, block_size = 1024, chunk_size = 10007)
+    idx = TraceIndex(log)
+    errors = 0
+    for (key, values) in expected.items():
+        s = idx.footer['latency'].get(key)
+        (v, c) = np.unique(np.array(values, dtype = np.int64), return_counts = True)
+        if s is None or s['histogram'] != [[int(a), int(b)] for (a, b) in zip(v, c)]:
+            print('ERROR: latencies of %s differ' % key)
+            errors += 1
+    times = [line_time(line, n) for (n, line) in enumerate(lines)]
+    for (t0, t1) in [(0, 50), (times[len(times) // 2], times[len(times) // 2] + 300), (times[-1] - 10, times[-1] + 10)]:
+        got = [n for (n, line) in idx.window(t0, t1)]
+        want = [n for n in range(len(lines)) if t0 <= times[n] <= t1]
+        if got != want:
+            print('ERROR: window %d..%d returned %d lines, expected %d' % (t0, t1, len(got), len(want)))
+            errors += 1
+    for pattern in ['f1.deq', 'mem.*', 'r._write']:
+        got = [n for (n, line) in idx.calls(pattern)]
+        want = [n for (n, line) in enumerate(lines) if fnmatch.fnmatchcase(line_name(line), pattern)]
+        if got != want:
+            print('ERROR: calls %s returned %d lines, expected %d' % (pattern, len(got), len(want)))
+            errors += 1
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Index PrintTrace logs for fast queries and compute call latencies')
+    parser.add_argument('--test', action = 'store_true', help = 'index a random log, compare against a line by line scan, and exit')
+    subparsers = parser.add_subparsers(dest = 'command')
+    build_parser = subparsers.add_parser('build', help = 'index a log in one pass')
+    build_parser.add_argument('log')
+    build_parser.add_argument('--block-size', type = int, default = 1 << 16, help = 'bytes per index block (default: %(default)s)')
+    for (command, help) in [('stats', 'print call counts and latencies'), ('window', 'print the lines in a time window'), ('calls', 'print the calls whose name matches a glob')]:
+        p = subparsers.add_parser(command, help = help)
+        p.add_argument('log')
+        if command == 'window':
+            p.add_argument('start', type = int)
+            p.add_argument('end', type = int)
+        elif command == 'calls':
+            p.add_argument('pattern')
+        else:
+            p.add_argument('--json', action = 'store_true', help = 'print the statistics as JSON')
+    for p in subparsers.choices.values():
+        p.add_argument('-i', '--index', help = 'index file (default: LOG.idx)')
+    args = parser.parse_args()
+
+    if args.test:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            errors = self_test(tmp)
+        print('%d mismatches' % errors)
+        sys.exit(1 if errors else 0)
+    if args.command is None:
+        parser.print_usage()
+        sys.exit(1)
+    if args.command == 'build':
+        start = time.perf_counter()
+        indexer = build(args.log, args.index, args.block_size)
+        sys.stderr.write('wrote %s: %d lines, %d call names in %.3fs\n' % (args.index or default_index(args.log), indexer.lines, len(indexer.names), time.perf_counter() - start))
+        sys.exit(0)
+    try:
+        idx = TraceIndex(args.log, args.index)
+    except (OSError, ValueError) as e:
+        print('ERROR: %s' % e)
+        sys.exit(1)
+    if args.command == 'stats':
+        if args.json:
+            print(json.dumps({key: idx.footer[key] for key in ['lines', 'timed', 'names', 'name_counts', 'latency']}, indent = 1))
+        else:
+            sys.stdout.write(format_stats(idx.footer))
+    else:
+        results = idx.window(args.start, args.end) if args.command == 'window' else idx.calls(args.pattern)
+        try:
+            for (n, line) in results:
+                print(line)
+        except BrokenPipeError:
+            pass
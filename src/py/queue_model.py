@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Cycle level model of pipelines built from FIFOG, SearchFIFO, and Port
+# buffers, for sizing queues without a bsc build and a bluesim run per
+# design point.
+#
+# A pipeline is a chain of queues. A source enqueues into the first queue,
+# one rule per pair of neighboring queues moves one item a cycle
+# (q[i+1].enq(q[i].first); q[i].deq), and a sink dequeues from the last
+# queue. Items arrive at the source according to an arrival trace and wait in
+# an unbounded backlog, and the sink is ready according to a service trace.
+#
+# Each queue is modeled by its depth and by when enq and deq can fire:
+#   fifo            enq if not full and deq if not empty at the start of the
+#                   cycle (mkFIFOG, mkSizedFIFOG, mkFIFOG1)
+#   pipeline        deq < enq, so a full queue can enq in a cycle it deqs
+#                   (mkLFIFOG, mkPipelineFIFOG, mkInputPortBuffer,
+#                   mkOutputPortBuffer)
+#   bypass          enq < deq, so an empty queue can deq the item enqueued
+#                   that cycle (mkBypassFIFOG, mkInputPortBypassBuffer,
+#                   mkOutputPortBypassBuffer)
+#   search          mkSearchFIFO, enq and deq like fifo, search sees the
+#                   contents at the start of the cycle
+#   pipelinesearch  mkPipelineSearchFIFO, deq < search < enq, but enq still
+#                   needs the queue to not be full at the start of the cycle,
+#                   so only search sees the deq
+# A stage can be given by kind or by module name. Module names with a fixed
+# depth (mkFIFOG is 2, the others 1) do not take depths.
+#
+# Every combination of the kinds and depths given for each stage is a
+# configuration, and all configurations are simulated together with numpy
+# arrays indexed by configuration, one cycle at a time. For each
+# configuration the model reports throughput, mean latency from arrival to
+# the sink, mean, 99th percentile and max occupancy of each queue, the cycles
+# each queue blocked an item waiting to enter it, the cycles the sink was
+# starved, and for search stages the mean number of entries a search sees.
+#
+# Trace files hold one integer per cycle: the items arriving that cycle for
+# --arrivals, and nonzero if the sink is ready for --service. Traces shorter
+# than --cycles are repeated. Without a trace, arrivals and service are
+# random with --arrival-rate and --service-rate.
+#
+# Examples:
+#   queue_model.py --stage mkLFIFOG --stage search:1-32 --arrival-rate 0.9 --service-rate 0.5
+#   queue_model.py --stage fifo,pipeline,bypass:1-8 --stage fifo:1-8 --arrivals arr.txt --service svc.txt --csv sweep.csv
+#   queue_model.py --stage mkInputPortBuffer --stage fifo:1-64 --service svc.txt --target 0.99
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+KINDS = ['fifo', 'pipeline', 'bypass', 'search', 'pipelinesearch']
+
+# module name -> (kind, fixed depth or None)
+MODULES = {
+    'mkFIFOG': ('fifo', 2),
+    'mkSizedFIFOG': ('fifo', None),
+    'mkFIFOG1': ('fifo', 1),
+    'mkLFIFOG': ('pipeline', 1),
+    'mkPipelineFIFOG': ('pipeline', 1),
+    'mkBypassFIFOG': ('bypass', 1),
+    'mkSearchFIFO': ('search', None),
+    'mkPipelineSearchFIFO': ('pipelinesearch', None),
+    'mkInputPortBuffer': ('pipeline', 1),
+    'mkOutputPortBuffer': ('pipeline', 1),
+    'mkInputPortBypassBuffer': ('bypass', 1),
+    'mkOutputPortBypassBuffer': ('bypass', 1),
+}
+
+def parse_depths(text):
+    """Parses a list like '1,2,4-8' into a list of depths."""
+    depths = []
+    for item in text.split(','):
+        if '-' in item:
+            (lo, hi) = item.split('-', 1)
+            depths.extend(range(int(lo), int(hi) + 1))
+        else:
+            depths.append(int(item))
+    if not depths or min(depths) < 1:
+        raise ValueError('depths must be at least 1: %s' % text)
+    return depths
+
+def parse_stage(text):
+    """Parses a --stage argument 'KIND[,KIND...][:DEPTHS]' into a list of (kind, depth) choices."""
+    (names, _, depths) = text.partition(':')
+    choices = []
+    for name in names.split(','):
+        if name in MODULES:
+            (kind, fixed) = MODULES[name]
+        elif name in KINDS:
+            (kind, fixed) = (name, None)
+        else:
+            raise ValueError('unknown queue %s, expected one of %s or a module name' % (name, ', '.join(KINDS)))
+        if fixed is not None:
+            if depths and parse_depths(depths) != [fixed]:
+                raise ValueError('%s has a fixed depth of %d' % (name, fixed))
+            choices.append((kind, fixed))
+        elif not depths:
+            raise ValueError('%s needs depths, e.g. %s:1-8' % (name, name))
+        else:
+            choices.extend((kind, d) for d in parse_depths(depths))
+    return choices
+
+def configurations(stages):
+    """Returns every combination of the stage choices as a list of tuples of (kind, depth)."""
+    return list(itertools.product(*stages))
+
+def load_trace(filename, cycles):
+    """Reads one integer per cycle from a text file and repeats it to cycles entries."""
+    trace = np.fromfile(filename, dtype = np.int64, sep = ' ')
+    if len(trace) == 0:
+        raise ValueError('%s is empty' % filename)
+    if trace.min() < 0:
+        raise ValueError('%s has negative entries' % filename)
+    return np.resize(trace, cycles)
+
+class Sweep:
+    """Simulates many configurations of one pipeline shape at once.
+
+    All configurations must have the same number of stages. The per
+    configuration results are numpy arrays in self.results after run().
+    """
+
+    def __init__(self, configs):
+        self.configs = configs
+        kind = np.array([[KINDS.index(k) for (k, d) in c] for c in configs], dtype = np.int8).T
+        self.depth = np.array([[d for (k, d) in c] for c in configs], dtype = np.int64).T
+        self.pipeline = (kind == KINDS.index('pipeline'))
+        self.bypass = (kind == KINDS.index('bypass'))
+        self.search = (kind == KINDS.index('search')) | (kind == KINDS.index('pipelinesearch'))
+        self.search_after_deq = (kind == KINDS.index('pipelinesearch'))
+
+    def run(self, arrivals, service):
+        """Runs the configurations over the traces, which must have the same length."""
+        (S, C) = self.depth.shape
+        depth = self.depth
+        pipeline = self.pipeline
+        bypass = self.bypass
+        after_deq = self.search_after_deq
+        max_depth = int(depth.max())
+        count = np.zeros((S, C), dtype = np.int64)
+        backlog = np.zeros(C, dtype = np.int64)
+        delivered = np.zeros(C, dtype = np.int64)
+        in_system = np.zeros(C, dtype = np.int64)
+        occupancy = np.zeros((S, C), dtype = np.int64)
+        peak = np.zeros((S, C), dtype = np.int64)
+        blocked = np.zeros((S, C), dtype = np.int64)
+        starved = np.zeros(C, dtype = np.int64)
+        searched = np.zeros((S, C), dtype = np.int64)
+        # hist[(s * C + c) * (max_depth + 1) + n] counts the cycles queue s of configuration c holds n items
+        hist = np.zeros(S * C * (max_depth + 1), dtype = np.int64)
+        hist_base = np.arange(S * C, dtype = np.int64).reshape(S, C) * (max_depth + 1)
+        # fire[r] is rule r: 0 is the source, S is the sink, and r enqueues into queue r and dequeues from queue r - 1
+        fire = np.zeros((S + 1, C), dtype = bool)
+        has_item = np.zeros((S + 1, C), dtype = bool)
+        # A pipeline queue makes its enq rule depend on its deq rule, and a
+        # bypass queue makes its deq rule depend on its enq rule. Neither
+        # dependency can point both ways across a queue, so one sweep in
+        # each direction settles every rule, and one is enough if all the
+        # dependencies point the same way.
+        sweeps = []
+        if bypass.any():
+            sweeps.append(range(S + 1))
+        if pipeline.any() or not sweeps:
+            sweeps.append(range(S, -1, -1))
+        arrived = 0
+        for t in range(len(arrivals)):
+            backlog += arrivals[t]
+            arrived += int(arrivals[t])
+            not_full = count < depth
+            not_empty = count > 0
+            has_item[0] = backlog > 0
+            fire[:] = False
+            for sweep in sweeps:
+                for r in sweep:
+                    if r > 0:
+                        has_item[r] = not_empty[r - 1] | (bypass[r - 1] & fire[r - 1])
+                    if r < S:
+                        fire[r] = has_item[r] & (not_full[r] | (pipeline[r] & fire[r + 1]))
+                    else:
+                        fire[r] = has_item[r] & bool(service[t])
+            blocked += has_item[:S] & ~fire[:S]
+            if service[t]:
+                starved += ~fire[S]
+            searched += count - (after_deq & fire[1:])
+            occupancy += count
+            np.maximum(peak, count, out = peak)
+            hist[hist_base + count] += 1
+            backlog -= fire[0]
+            count += fire[:S]
+            count -= fire[1:]
+            delivered += fire[S]
+            in_system += arrived - delivered
+        cycles = len(arrivals)
+        hist = hist.reshape(S, C, max_depth + 1)
+        # in_system sums the cycles every arrived item spent waiting, so take
+        # off what the items still in the pipeline at the end spent.
+        times = np.repeat(np.arange(cycles, dtype = np.int64), arrivals)
+        waiting = np.concatenate([np.cumsum((cycles - times)[::-1])[::-1], [0]])
+        latency_sum = in_system - waiting[delivered]
+        self.results = {
+            'cycles': cycles,
+            'arrived': arrived,
+            'delivered': delivered,
+            'latency_sum': latency_sum,
+            'occupancy_sum': occupancy,
+            'peak': peak,
+            'hist': hist,
+            'blocked': blocked,
+            'starved': starved,
+            'search_sum': np.where(self.search, searched, 0),
+        }
+        return self.results
+
+def _run_slice(args):
+    (configs, arrivals, service) = args
+    return Sweep(configs).run(arrivals, service)
+
+def simulate(configs, arrivals, service, jobs = None):
+    """Simulates the configurations, split across processes, and returns one result dict per configuration."""
+    jobs = jobs or multiprocessing.cpu_count()
+    per_job = -(-len(configs) // jobs)
+    slices = [configs[i:i + per_job] for i in range(0, len(configs), per_job)]
+    tasks = [(s, arrivals, service) for s in slices]
+    if len(tasks) == 1:
+        outputs = [_run_slice(tasks[0])]
+    else:
+        with multiprocessing.Pool(len(tasks)) as pool:
+            outputs = pool.map(_run_slice, tasks)
+    rows = []
+    for (s, out) in zip(slices, outputs):
+        for c in range(len(s)):
+            rows.append(summarize(s[c], out, c))
+    return rows
+
+def percentile(hist, q):
+    """Returns the smallest n such that at least q of the cycles have at most n items."""
+    cum = np.cumsum(hist)
+    return int(np.searchsorted(cum, q * cum[-1] - 1e-9))
+
+def summarize(config, out, c):
+    """Returns the results for configuration c of a Sweep as a dict."""
+    cycles = out['cycles']
+    delivered = int(out['delivered'][c])
+    row = {
+        'config': ' '.join('%s:%d' % kd for kd in config),
+        'total_depth': sum(d for (k, d) in config),
+        'throughput': delivered / cycles,
+        'delivered': delivered,
+        'latency': float(out['latency_sum'][c]) / delivered if delivered else float('nan'),
+        'starved': int(out['starved'][c]),
+    }
+    for (s, (kind, depth)) in enumerate(config):
+        row['q%d_mean' % s] = float(out['occupancy_sum'][s, c]) / cycles
+        row['q%d_p99' % s] = percentile(out['hist'][s, c], 0.99)
+        row['q%d_max' % s] = int(out['peak'][s, c])
+        row['q%d_blocked' % s] = int(out['blocked'][s, c])
+        row['q%d_search' % s] = float(out['search_sum'][s, c]) / cycles if kind in ('search', 'pipelinesearch') else None
+    return row
+
+def cheapest(rows, target):
+    """Returns the row with the least total depth whose throughput is at least target times the best."""
+    best = max(row['throughput'] for row in rows)
+    good = [row for row in rows if row['throughput'] >= target * best]
+    return min(good, key = lambda row: (row['total_depth'], -row['throughput']))
+
+def format_rows(rows):
+    columns = list(rows[0].keys())
+    def cell(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return '%.4g' % value
+        return str(value)
+    table = [columns] + [[cell(row[k]) for k in columns] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(columns))]
+    return ''.join('  '.join(v.rjust(w) if i else v.ljust(w) for (i, (v, w)) in enumerate(zip(line, widths))).rstrip() + '\n' for line in table)
+
+def reference(config, arrivals, service):
+    """Simulates one configuration one method call at a time.
+
+    Rules run in an order that respects each queue's schedule, and each
+    method checks its guard against the queue state at that point in the
+    cycle, like the BSV modules do.
+    """
+    S = len(config)
+    queues = [[] for s in range(S)]
+    backlog = []
+    stats = {'delivered': 0, 'latency_sum': 0, 'starved': 0,
+             'occupancy_sum': [0] * S, 'peak': [0] * S, 'blocked': [0] * S, 'search_sum': [0] * S,
+             'hist': [[0] * (d + 1) for (k, d) in config]}
+    # rule r must run before rule r + 1 if queue r deqs before it enqs
+    order = []
+    r = 0
+    while r <= S:
+        run = [r]
+        while r < S and config[r][0] in ('pipeline', 'pipelinesearch'):
+            r += 1
+            run.append(r)
+        order.extend(reversed(run))
+        r += 1
+    for t in range(len(arrivals)):
+        backlog.extend([t] * int(arrivals[t]))
+        start = [len(q) for q in queues]
+        searched = list(start)
+        for s in range(S):
+            stats['occupancy_sum'][s] += start[s]
+            stats['peak'][s] = max(stats['peak'][s], start[s])
+            stats['hist'][s][start[s]] += 1
+        def can_enq(s):
+            (kind, depth) = config[s]
+            return (len(queues[s]) if kind == 'pipeline' else start[s]) < depth
+        def can_deq(s):
+            (kind, depth) = config[s]
+            return (len(queues[s]) if kind == 'bypass' else start[s]) > 0
+        for r in order:
+            src = len(backlog) > 0 if r == 0 else can_deq(r - 1)
+            if r == S:
+                if service[t] and src:
+                    stats['latency_sum'] += t - queues[S - 1].pop(0)
+                    stats['delivered'] += 1
+                    if config[S - 1][0] == 'pipelinesearch':
+                        searched[S - 1] -= 1
+                elif service[t]:
+                    stats['starved'] += 1
+                continue
+            if src and can_enq(r):
+                item = backlog.pop(0) if r == 0 else queues[r - 1].pop(0)
+                queues[r].append(item)
+                if r > 0 and config[r - 1][0] == 'pipelinesearch':
+                    searched[r - 1] -= 1
+            elif src:
+                stats['blocked'][r] += 1
+        for s in range(S):
+            if config[s][0] in ('search', 'pipelinesearch'):
+                stats['search_sum'][s] += searched[s]
+    return stats
+
+def self_test(seed = 0):
+    """Compares Sweep against reference() on random pipelines and traces. Returns the number of mismatches."""
+    rng = np.random.RandomState(seed)
+    errors = 0
+    for k in range(40):
+        stages = [[(kind, int(d)) for kind in KINDS for d in rng.choice(np.arange(1, 5), 2, replace = False)] for s in range(rng.randint(1, 4))]
+        configs = configurations(stages)
+        configs = [configs[i] for i in rng.choice(len(configs), min(len(configs), 24), replace = False)]
+        cycles = int(rng.randint(1, 300))
+        # bursty traces, so queues fill and drain
+        arrivals = (rng.rand(cycles) < rng.rand()) * rng.randint(1, 3, cycles)
+        service = np.repeat(rng.rand(cycles // 8 + 1) < rng.rand(), 8)[:cycles] & (rng.rand(cycles) < 0.9)
+        out = Sweep(configs).run(arrivals, service.astype(np.int64))
+        for (c, config) in enumerate(configs):
+            ref = reference(config, arrivals, service)
+            got = {
+                'delivered': int(out['delivered'][c]),
+                'latency_sum': int(out['latency_sum'][c]),
+                'starved': int(out['starved'][c]),
+                'occupancy_sum': [int(x) for x in out['occupancy_sum'][:, c]],
+                'peak': [int(x) for x in out['peak'][:, c]],
+                'blocked': [int(x) for x in out['blocked'][:, c]],
+                'search_sum': [int(x) for x in out['search_sum'][:, c]],
+                'hist': [[int(x) for x in out['hist'][s, c, :d + 1]] for (s, (kind, d)) in enumerate(config)],
+            }
+            for key in ref:
+                if ref[key] != got[key]:
+                    errors += 1
+                    print('ERROR: test %d, %s: %s is %s, expected %s' % (k, ' '.join('%s:%d' % kd for kd in config), key, got[key], ref[key]))
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Sweep queue depths of FIFOG, SearchFIFO, and Port pipelines with a cycle level model')
+    parser.add_argument('--stage', action = 'append', default = [], metavar = 'KIND[:DEPTHS]', help = 'add a queue to the pipeline, e.g. mkLFIFOG, search:1-16, or fifo,bypass:1,2,4')
+    parser.add_argument('--cycles', type = int, help = 'cycles to simulate (default: the length of the arrival trace, or 10000)')
+    parser.add_argument('--arrivals', help = 'file with the items arriving each cycle')
+    parser.add_argument('--service', help = 'file with a nonzero entry for each cycle the sink is ready')
+    parser.add_argument('--arrival-rate', type = float, default = 1.0, help = 'probability an item arrives each cycle without --arrivals (default: %(default)s)')
+    parser.add_argument('--service-rate', type = float, default = 1.0, help = 'probability the sink is ready each cycle without --service (default: %(default)s)')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed for random traces (default: %(default)s)')
+    parser.add_argument('--target', type = float, help = 'also print the smallest configuration with at least this fraction of the best throughput')
+    parser.add_argument('--csv', help = 'write the results to a CSV file instead of printing them')
+    parser.add_argument('--json', help = 'write the results to a JSON file instead of printing them')
+    parser.add_argument('-j', '--jobs', type = int, help = 'worker processes (default: one per core)')
+    parser.add_argument('--test', action = 'store_true', help = 'compare against a one method at a time reference on random pipelines and exit')
+    args = parser.parse_args()
+
+    if args.test:
+        errors = self_test()
+        print('%d mismatches' % errors)
+        sys.exit(1 if errors else 0)
+    if not args.stage:
+        parser.print_usage()
+        sys.exit(1)
+    try:
+        configs = configurations([parse_stage(s) for s in args.stage])
+        rng = np.random.RandomState(args.seed)
+        if args.arrivals:
+            cycles = args.cycles or len(np.fromfile(args.arrivals, dtype = np.int64, sep = ' '))
+            arrivals = load_trace(args.arrivals, cycles)
+        else:
+            cycles = args.cycles or 10000
+            arrivals = (rng.rand(cycles) < args.arrival_rate).astype(np.int64)
+        if args.service:
+            service = load_trace(args.service, cycles)
+        else:
+            service = (rng.rand(cycles) < args.service_rate).astype(np.int64)
+    except (OSError, ValueError) as e:
+        print('ERROR: %s' % e)
+        sys.exit(1)
+    start = time.perf_counter()
+    rows = simulate(configs, arrivals, service, args.jobs)
+    sys.stderr.write('simulated %d configurations for %d cycles in %.3fs\n' % (len(rows), cycles, time.perf_counter() - start))
+    if args.csv:
+        with open(args.csv, 'w', newline = '') as f:
+            writer = csv.DictWriter(f, fieldnames = list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent = 1)
+    if not args.csv and not args.json:
+        sys.stdout.write(format_rows(rows))
+    if args.target is not None:
+        row = cheapest(rows, args.target)
+        print('smallest configuration with %.4g of the best throughput: %s (throughput %.4g, latency %.4g)' % (args.target, row['config'], row['throughput'], row['latency']))
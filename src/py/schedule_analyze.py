@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Analyzer for traces written by mkScheduleMonitor.
+#
+# A trace starts with a legend of one rule name per line, the i-th indented
+# by i spaces, followed by one line per cycle with one character per rule
+# ('_' if the rule did not fire) and optionally " 0x<pc>" and
+# " DASM(0x<inst>)".
+#
+# The file is memory mapped and split at line boundaries into chunks that are
+# analyzed by a pool of worker processes. Each chunk is turned into a
+# (cycles, rules) character matrix with numpy, so memory use is bounded by the
+# chunk size no matter how long the trace is. The per-chunk results are merged
+# in cycle order.
+#
+# Examples:
+#   schedule_analyze.py sched.txt
+#   schedule_analyze.py sched.txt -j 8 --top 20 --cofire build/cofire.csv
+#   schedule_analyze.py sched.txt --json build/sched.json
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+from np_text import chunk_ranges, hex_value
+
+idle_char = ord('_')
+
+def read_legend(filename):
+    """Returns (rule names, offset of the first cycle line).
+
+    The legend ends at the first line that is not indented by as many spaces
+    as there are names so far."""
+    names = []
+    offset = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            indent = len(line) - len(line.lstrip(b' '))
+            name = line.strip()
+            if indent != len(names) or name == b'' or (len(names) != 0 and b' ' in name):
+                break
+            names.append(name.decode())
+            offset += len(line)
+    return (names, offset)
+
+def parse_hex(arr, starts, ends, max_digits = 16):
+    """Parses the hex numbers at starts in arr, stopping at ends.
+
+    Returns (values, number of digits) as arrays."""
+    pos = starts[:, None] + np.arange(max_digits)
+    digits = hex_value[arr[np.minimum(pos, len(arr) - 1)]]
+    run = np.logical_and.accumulate((digits < 16) & (pos < ends[:, None]), axis = 1)
+    n = run.sum(axis = 1)
+    shift = np.maximum(n[:, None] - 1 - np.arange(max_digits), 0).astype(np.uint64) * np.uint64(4)
+    values = np.where(run, digits.astype(np.uint64) << shift, np.uint64(0)).sum(axis = 1, dtype = np.uint64)
+    return (values, n)
+
+def parse_lines(arr, num_rules, with_insts = False):
+    """Returns (chars, pcs, has_pc, malformed) for the cycle lines in arr.
+
+    chars is a (cycles, num_rules) uint8 array, pcs a uint64 array that is
+    only meaningful where has_pc is set, and malformed the number of lines
+    too short to hold a character for every rule; those lines are dropped.
+    If with_insts is set, the instructions and where they are present are
+    appended to the tuple."""
+    ends = np.flatnonzero(arr == ord('\n'))
+    if len(arr) != 0 and arr[-1] != ord('\n'):
+        ends = np.append(ends, len(arr))
+    starts = np.zeros(len(ends), dtype = np.int64)
+    starts[1:] = ends[:-1] + 1
+    ok = ends - starts >= num_rules
+    malformed = int(len(ok) - np.count_nonzero(ok))
+    (starts, ends) = (starts[ok], ends[ok])
+    chars = arr[starts[:, None] + np.arange(num_rules)]
+    # " 0x<pc>" right after the rule characters
+    (pcs, has_pc, pc_digits) = _parse_field(arr, starts + num_rules, ends, b' 0x')
+    if not with_insts:
+        return (chars, pcs, has_pc, malformed)
+    # " DASM(0x<inst>)" after that
+    inst_start = starts + num_rules + np.where(has_pc, 3 + pc_digits, 0)
+    (insts, has_inst, inst_digits) = _parse_field(arr, inst_start, ends, b' DASM(0x')
+    return (chars, pcs, has_pc, malformed, insts, has_inst)
+
+def _parse_field(arr, starts, ends, prefix):
+    """Parses prefix followed by a hex number at starts in each line.
+
+    Returns (values, where the field is present, number of digits)."""
+    has = starts + len(prefix) < ends
+    for (i, c) in enumerate(prefix):
+        has &= arr[np.minimum(starts + i, len(arr) - 1)] == c
+    lines = np.flatnonzero(has)
+    values = np.zeros(len(starts), dtype = np.uint64)
+    digits = np.zeros(len(starts), dtype = np.int64)
+    (values[lines], digits[lines]) = parse_hex(arr, starts[lines] + len(prefix), ends[lines])
+    has[lines] = digits[lines] > 0
+    return (values, has, digits)
+
+def analyze_chunk(job):
+    """Analyzes the cycle lines in one chunk of the trace.
+
+    Idle runs touching the chunk edges and the first PC are returned
+    separately so they can be joined with the neighbouring chunks."""
+    (filename, num_rules, start, end, top) = job
+    arr = np.asarray(np.memmap(filename, dtype = np.uint8, mode = 'r', offset = start, shape = (end - start,)))
+    (chars, pcs, has_pc, malformed) = parse_lines(arr, num_rules)
+    del arr
+    cycles = chars.shape[0]
+    fired = chars != idle_char
+    cofire = np.zeros((num_rules, num_rules), dtype = np.int64)
+    # float32 sums are exact below 2**24
+    for i in range(0, cycles, 1 << 16):
+        f = fired[i:i + (1 << 16)].astype(np.float32)
+        cofire += (f.T @ f).astype(np.int64)
+    # count each character that shows up, which usually is only a few
+    char_counts = np.zeros((num_rules, 256), dtype = np.int64)
+    for c in np.flatnonzero(np.bincount(chars.ravel(), minlength = 256)):
+        char_counts[:, c] = (chars == c).sum(axis = 0)
+    # runs of cycles in which no rule fired
+    idle = ~fired.any(axis = 1)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], idle.view(np.int8), [0]))))
+    (run_starts, run_lengths) = (edges[0::2], edges[1::2] - edges[0::2])
+    head = tail = 0
+    if len(run_starts) != 0 and run_starts[0] == 0:
+        head = int(run_lengths[0])
+        (run_starts, run_lengths) = (run_starts[1:], run_lengths[1:])
+    if len(run_starts) != 0 and run_starts[-1] + run_lengths[-1] == cycles:
+        tail = int(run_lengths[-1])
+        (run_starts, run_lengths) = (run_starts[:-1], run_lengths[:-1])
+    idle_hist = np.bincount(np.log2(run_lengths).astype(np.int64), minlength = 64) if len(run_lengths) else np.zeros(64, dtype = np.int64)
+    longest = np.lexsort((run_starts, -run_lengths))[:top]
+    # cycles since the previous PC are charged to each PC
+    pc_cycles = np.flatnonzero(has_pc)
+    pcs = pcs[pc_cycles]
+    first_pc = None
+    if len(pcs) != 0:
+        first_pc = (int(pcs[0]), int(pc_cycles[0]))
+    (unique_pcs, inverse) = np.unique(pcs[1:], return_inverse = True)
+    pc_counts = np.bincount(inverse, minlength = len(unique_pcs))
+    pc_stall = np.bincount(inverse, weights = np.diff(pc_cycles), minlength = len(unique_pcs)).astype(np.int64)
+    return {
+        'cycles': cycles,
+        'malformed': malformed,
+        'fires': np.diag(cofire).copy(),
+        'cofire': cofire,
+        'chars': char_counts,
+        'idle_cycles': int(idle.sum()),
+        'idle_head': head,
+        'idle_tail': tail,
+        'idle_hist': idle_hist,
+        'idle_longest': list(zip(run_starts[longest].tolist(), run_lengths[longest].tolist())),
+        'pcs': unique_pcs,
+        'pc_counts': pc_counts,
+        'pc_stall': pc_stall,
+        'first_pc': first_pc,
+        'last_pc_cycle': int(pc_cycles[-1]) if len(pc_cycles) else None,
+    }
+
+class Analysis:
+    """Results for a whole trace, merged from per-chunk results in order."""
+    def __init__(self, names, top = 10):
+        n = len(names)
+        self.names = names
+        self.top = top
+        self.cycles = 0
+        self.malformed = 0
+        self.fires = np.zeros(n, dtype = np.int64)
+        self.cofire = np.zeros((n, n), dtype = np.int64)
+        self.chars = np.zeros((n, 256), dtype = np.int64)
+        self.idle_cycles = 0
+        self.idle_hist = np.zeros(64, dtype = np.int64)
+        self.idle_longest = []
+        self.run = (0, 0)
+        self.pc_parts = []
+        self.last_pc_cycle = None
+
+    def _keep_longest(self, start, length):
+        heapq.heappush(self.idle_longest, (length, -start))
+        if len(self.idle_longest) > self.top:
+            heapq.heappop(self.idle_longest)
+
+    def _end_run(self, start, length):
+        if length != 0:
+            self.idle_hist[int(np.log2(length))] += 1
+            self._keep_longest(start, length)
+
+    def add(self, r):
+        base = self.cycles
+        self.malformed += r['malformed']
+        self.fires += r['fires']
+        self.cofire += r['cofire']
+        self.chars += r['chars']
+        self.idle_cycles += r['idle_cycles']
+        if r['idle_head'] == r['cycles']:
+            self.run = (self.run[0], self.run[1] + r['cycles'])
+        else:
+            self._end_run(self.run[0], self.run[1] + r['idle_head'])
+            self.idle_hist += r['idle_hist']
+            for (start, length) in r['idle_longest']:
+                self._keep_longest(base + start, length)
+            self.run = (base + r['cycles'] - r['idle_tail'], r['idle_tail'])
+        self.pc_parts.append((r['pcs'], r['pc_counts'], r['pc_stall']))
+        if r['first_pc'] is not None:
+            (pc, cycle) = r['first_pc']
+            stall = base + cycle - (self.last_pc_cycle if self.last_pc_cycle is not None else -1)
+            self.pc_parts.append((np.array([pc], dtype = np.uint64), np.array([1]), np.array([stall])))
+            self.last_pc_cycle = base + r['last_pc_cycle']
+        self.cycles += r['cycles']
+
+    def finish(self):
+        self._end_run(self.run[0], self.run[1])
+        self.run = (self.cycles, 0)
+        if len(self.pc_parts) != 0:
+            pcs = np.concatenate([p[0] for p in self.pc_parts])
+            (self.pcs, inverse) = np.unique(pcs, return_inverse = True)
+            self.pc_counts = np.bincount(inverse, weights = np.concatenate([p[1] for p in self.pc_parts]), minlength = len(self.pcs)).astype(np.int64)
+            self.pc_stall = np.bincount(inverse, weights = np.concatenate([p[2] for p in self.pc_parts]), minlength = len(self.pcs)).astype(np.int64)
+        self.pc_parts = []
+        return self
+
+    def longest_idle(self):
+        """Returns the longest idle runs as (start cycle, length), longest first."""
+        return [(-start, length) for (length, start) in sorted(self.idle_longest, reverse = True)]
+
+    def conflicts(self):
+        """Returns pairs of rules that both fired but never in the same cycle."""
+        fired = np.flatnonzero(self.fires)
+        sub = self.cofire[np.ix_(fired, fired)]
+        (i, j) = np.nonzero(np.triu(sub == 0, 1))
+        return [(self.names[fired[a]], self.names[fired[b]]) for (a, b) in zip(i, j)]
+
+    def to_json(self):
+        order = np.argsort(-self.pc_stall, kind = 'stable')[:self.top] if hasattr(self, 'pcs') else []
+        return {
+            'rules': self.names,
+            'cycles': self.cycles,
+            'malformed_lines': self.malformed,
+            'fires': self.fires.tolist(),
+            'cofire': self.cofire.tolist(),
+            'chars': {name: {chr(c): int(self.chars[i, c]) for c in np.flatnonzero(self.chars[i])} for (i, name) in enumerate(self.names)},
+            'idle_cycles': self.idle_cycles,
+            'idle_runs_log2_hist': np.trim_zeros(self.idle_hist, 'b').tolist(),
+            'longest_idle_runs': self.longest_idle(),
+            'conflicts': self.conflicts(),
+            'pc_hot_spots': [{'pc': '0x%x' % self.pcs[i], 'count': int(self.pc_counts[i]), 'cycles': int(self.pc_stall[i])} for i in order],
+        }
+
+def analyze(filename, jobs = None, chunk_size = 1 << 26, top = 10):
+    """Analyzes a whole trace and returns an Analysis."""
+    (names, offset) = read_legend(filename)
+    result = Analysis(names, top)
+    if len(names) == 0:
+        return result.finish()
+    work = [(filename, len(names), start, end, top) for (start, end) in chunk_ranges(filename, offset, chunk_size)]
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    jobs = max(1, min(jobs, len(work)))
+    if jobs == 1:
+        for r in map(analyze_chunk, work):
+            result.add(r)
+    else:
+        with multiprocessing.Pool(jobs) as pool:
+            for r in pool.imap(analyze_chunk, work):
+                result.add(r)
+    return result.finish()
+
+def format_report(a):
+    lines = ['%d cycles, %d rules, %d idle cycles (%.2f%%)' % (a.cycles, len(a.names), a.idle_cycles, 100.0 * a.idle_cycles / max(a.cycles, 1))]
+    if a.malformed != 0:
+        lines.append('WARNING: %d malformed lines skipped' % a.malformed)
+    width = max([len(name) for name in a.names] + [4])
+    lines.append('')
+    lines.append('%-*s %12s %8s  %s' % (width, 'rule', 'fires', 'rate', 'characters'))
+    for (i, name) in enumerate(a.names):
+        chars = ' '.join('%s:%d' % (chr(c), a.chars[i, c]) for c in np.flatnonzero(a.chars[i]) if c != idle_char)
+        lines.append('%-*s %12d %7.2f%%  %s' % (width, name, a.fires[i], 100.0 * a.fires[i] / max(a.cycles, 1), chars))
+    pairs = [(a.cofire[i, j], a.names[i], a.names[j]) for i in range(len(a.names)) for j in range(i + 1, len(a.names)) if a.cofire[i, j] != 0]
+    if pairs:
+        lines.append('')
+        lines.append('most frequent co-firing rules:')
+        for (count, x, y) in sorted(pairs, reverse = True)[:a.top]:
+            lines.append('  %12d  %s + %s' % (count, x, y))
+    conflicts = a.conflicts()
+    if conflicts:
+        lines.append('')
+        lines.append('rules that fired but never together:')
+        for (x, y) in conflicts[:a.top]:
+            lines.append('  %s / %s' % (x, y))
+        if len(conflicts) > a.top:
+            lines.append('  ... %d more' % (len(conflicts) - a.top))
+    if a.longest_idle():
+        lines.append('')
+        lines.append('longest idle stretches (start cycle, length):')
+        for (start, length) in a.longest_idle():
+            lines.append('  %12d %12d' % (start, length))
+    if hasattr(a, 'pcs') and len(a.pcs) != 0:
+        lines.append('')
+        lines.append('PC hot spots (cycles since the previous PC):')
+        for i in np.argsort(-a.pc_stall, kind = 'stable')[:a.top]:
+            lines.append('  0x%016x %12d cycles %10d times' % (a.pcs[i], a.pc_stall[i], a.pc_counts[i]))
+    return '\n'.join(lines) + '\n'
+
+def write_trace(f, names, chars, pcs = None, insts = None):
+    """Writes a trace like mkScheduleMonitor does; used by the self test."""
+    for (i, name) in enumerate(names):
+        f.write(' ' * i + name + '\n')
+    for c in range(chars.shape[0]):
+        line = chars[c].tobytes().decode()
+        if pcs is not None and pcs[c] is not None:
+            line += ' 0x%x' % pcs[c]
+        if insts is not None and insts[c] is not None:
+            line += ' DASM(0x%x)' % insts[c]
+        f.write(line + '\n')
+
+def self_test(filename, num_rules = 7, num_cycles = 20000, seed = 0):
+    """Compares analyze on a random trace with a line by line reference.
+
+    Returns the number of mismatches."""
+    rng = np.random.default_rng(seed)
+    names = ['rl_%d' % i for i in range(num_rules)]
+    fire = rng.random((num_cycles, num_rules)) < rng.random(num_rules) * 0.3
+    # long idle stretches, including at the start and the end
+    for (s, l) in [(0, 50), (5000, 300), (12000, 2000), (num_cycles - 70, 70)]:
+        fire[s:s + l] = False
+    fire[:, 2] &= ~fire[:, 3]
+    chars = np.where(fire, np.array([ord('X'), ord('Y')], dtype = np.uint8)[rng.integers(0, 2, size = fire.shape)], idle_char).astype(np.uint8)
+    pcs = [int(rng.choice([0x80000000, 0x80000004, 0x80001000, 0xffffffff80002000])) if fire[c, 0] else None for c in range(num_cycles)]
+    insts = [0x13 if pc is not None and rng.random() < 0.5 else None for pc in pcs]
+    with open(filename, 'w') as f:
+        write_trace(f, names, chars, pcs, insts)
+    # reference: plain python over the lines
+    fires = [0] * num_rules
+    cofire = [[0] * num_rules for i in range(num_rules)]
+    idle_runs = []
+    run = None
+    pc_stall = {}
+    last_pc = -1
+    with open(filename) as f:
+        lines = f.read().split('\n')[num_rules:-1]
+    for (c, line) in enumerate(lines):
+        fired = [i for i in range(num_rules) if line[i] != '_']
+        for i in fired:
+            fires[i] += 1
+            for j in fired:
+                cofire[i][j] += 1
+        if len(fired) == 0:
+            run = c if run is None else run
+        elif run is not None:
+            idle_runs.append((run, c - run))
+            run = None
+        fields = line[num_rules:].split()
+        if len(fields) != 0 and fields[0].startswith('0x'):
+            pc = int(fields[0], 16)
+            pc_stall[pc] = pc_stall.get(pc, 0) + c - last_pc
+            last_pc = c
+    if run is not None:
+        idle_runs.append((run, len(lines) - run))
+    errors = 0
+    for jobs in (1, 3):
+        a = analyze(filename, jobs = jobs, chunk_size = 4099, top = 5)
+        if a.names != names or a.cycles != num_cycles:
+            print('ERROR: read %d rules and %d cycles' % (len(a.names), a.cycles))
+            errors += 1
+            continue
+        if a.fires.tolist() != fires or a.cofire.tolist() != cofire:
+            print('ERROR: firing counts differ with %d jobs' % jobs)
+            errors += 1
+        longest = sorted(idle_runs, key = lambda r: (-r[1], r[0]))[:5]
+        if a.longest_idle() != longest or a.idle_cycles != sum(l for (s, l) in idle_runs):
+            print('ERROR: idle runs %s, expected %s' % (a.longest_idle(), longest))
+            errors += 1
+        if {int(p): int(s) for (p, s) in zip(a.pcs, a.pc_stall)} != pc_stall:
+            print('ERROR: PC hot spots differ with %d jobs' % jobs)
+            errors += 1
+        if (names[2], names[3]) not in a.conflicts():
+            print('ERROR: conflict between %s and %s not found' % (names[2], names[3]))
+            errors += 1
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Summarize a mkScheduleMonitor trace')
+    parser.add_argument('trace', nargs = '?', help = 'trace written by mkScheduleMonitor')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of worker processes (default: number of cores)')
+    parser.add_argument('--chunk-size', type = int, default = 64, help = 'MiB of trace per chunk (default: %(default)s)')
+    parser.add_argument('--top', type = int, default = 10, help = 'number of entries in each top list (default: %(default)s)')
+    parser.add_argument('--cofire', metavar = 'FILE', help = 'write the co-firing matrix as CSV')
+    parser.add_argument('--json', metavar = 'FILE', help = 'write all results as JSON')
+    parser.add_argument('--test', action = 'store_true', help = 'check the analyzer against a line by line reference on a random trace and exit')
+    args = parser.parse_args()
+
+    if args.test:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            errors = self_test(os.path.join(tmp, 'sched.txt'))
+        print('%d mismatches' % errors)
+        sys.exit(1 if errors else 0)
+    if args.trace is None:
+        parser.print_usage()
+        sys.exit(1)
+
+    start = time.perf_counter()
+    a = analyze(args.trace, args.jobs, args.chunk_size << 20, args.top)
+    if len(a.names) == 0:
+        print('ERROR: %s does not start with a rule legend' % args.trace)
+        sys.exit(1)
+    sys.stderr.write('%d cycles analyzed in %.3fs\n' % (a.cycles, time.perf_counter() - start))
+    sys.stdout.write(format_report(a))
+    if args.cofire is not None:
+        with open(args.cofire, 'w') as f:
+            f.write(','.join([''] + a.names) + '\n')
+            for (i, name) in enumerate(a.names):
+                f.write(','.join([name] + [str(x) for x in a.cofire[i]]) + '\n')
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(a.to_json(), f, indent = 1)
+            f.write('\n')
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Columnar store for mkScheduleMonitor traces.
+#
+# convert reads a text trace in one streaming pass and writes a file with:
+#   fired:         one row of bit-packed rule fire flags per cycle, so cycle N
+#                  is at a fixed offset
+#   exc_*:         (cycle, rule, char) for every fired rule whose character
+#                  differs from the first one seen for that rule
+#   pc_cycles,     the cycles with a PC and the PCs, as zigzag varint deltas
+#   pc_values:     that restart at every block of block_cycles cycles
+#   block_table:   the first PC entry and the byte offsets into pc_cycles and
+#                  pc_values of each block
+#   index_*:       the sorted distinct PCs and, for each, the blocks that
+#                  contain it
+#   inst_*:        (cycle, inst) for the cycles with a DASM field
+# Sections are raw little endian arrays. The file starts with "SCHDPACK" and
+# the offset of a JSON footer that lists the sections and the rule legend, so
+# the reader only memory maps the arrays.
+#
+# Examples:
+#   schedule_store.py convert sched.txt -o sched.schedpack
+#   schedule_store.py show sched.schedpack 1000000 -n 20
+#   schedule_store.py pc sched.schedpack 0x80000100
+
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+import schedule_analyze
+from np_text import chunk_ranges
+
+magic = b'SCHDPACK'
+version = 1
+preamble_format = '<8sQ'
+
+def zigzag(x):
+    x = x.view(np.int64)
+    return ((x << 1) ^ (x >> 63)).view(np.uint64)
+
+def unzigzag(z):
+    return ((z >> np.uint64(1)) ^ (np.uint64(0) - (z & np.uint64(1)))).view(np.int64)
+
+def varint_encode(values):
+    """Encodes uint64 values as LEB128 varints; returns (bytes, bytes per value)."""
+    values = np.asarray(values, dtype = np.uint64)
+    n = np.ones(len(values), dtype = np.int64)
+    v = values >> np.uint64(7)
+    while v.any():
+        n += v != 0
+        v >>= np.uint64(7)
+    out = np.zeros(int(n.sum()), dtype = np.uint8)
+    starts = np.cumsum(n) - n
+    for k in range(int(n.max()) if len(n) else 0):
+        sel = np.flatnonzero(n > k)
+        byte = ((values[sel] >> np.uint64(7 * k)) & np.uint64(0x7f)).astype(np.uint8)
+        out[starts[sel] + k] = byte | np.where(n[sel] > k + 1, 0x80, 0).astype(np.uint8)
+    return (out, n)
+
+def varint_decode(data):
+    """Decodes a sequence of LEB128 varints into uint64 values."""
+    data = np.asarray(data, dtype = np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) == 0:
+        return np.zeros(0, dtype = np.uint64)
+    starts = np.zeros(len(ends), dtype = np.int64)
+    starts[1:] = ends[:-1] + 1
+    data = data[:ends[-1] + 1]
+    group = np.zeros(len(data), dtype = np.int64)
+    group[starts[1:]] = 1
+    group = np.cumsum(group)
+    shift = ((np.arange(len(data)) - starts[group]) * 7).astype(np.uint64)
+    return np.bitwise_or.reduceat((data & 0x7f).astype(np.uint64) << shift, starts)
+
+def delta_encode(values, blocks, prev_value, prev_block):
+    """Varint encodes values as deltas that restart at every new block.
+
+    The first entry of a block is stored relative to 0. Returns (bytes,
+    bytes per entry)."""
+    values = np.asarray(values, dtype = np.uint64)
+    prev = np.empty(len(values), dtype = np.uint64)
+    if len(values) != 0:
+        prev[0] = prev_value
+        prev[1:] = values[:-1]
+        prev_blocks = np.concatenate(([prev_block], blocks[:-1]))
+        prev[blocks != prev_blocks] = 0
+    return varint_encode(zigzag(values - prev))
+
+def delta_decode(data):
+    """Decodes one block worth of delta_encode output."""
+    return np.cumsum(unzigzag(varint_decode(data))).view(np.uint64)
+
+class Writer:
+    """Writes the sections of a store; fired goes straight to the output file
+    and the other sections through temporary files."""
+    streams = {'exc_cycle': np.uint64, 'exc_rule': np.uint16, 'exc_char': np.uint8, 'pc_cycles': np.uint8, 'pc_values': np.uint8, 'inst_cycle': np.uint64, 'inst_value': np.uint32}
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'wb')
+        self.f.write(struct.pack(preamble_format, magic, 0))
+        self.tmp = {name: open('%s.%s.tmp' % (filename, name), 'wb+') for name in self.streams}
+        self.sections = {}
+
+    def write(self, name, array):
+        self.tmp[name].write(np.ascontiguousarray(array, dtype = self.streams[name]).tobytes())
+
+    def _section(self, name, dtype, shape, copy_from = None, array = None):
+        pad = -self.f.tell() % 8
+        self.f.write(b'\0' * pad)
+        self.sections[name] = {'offset': self.f.tell(), 'dtype': np.dtype(dtype).str, 'shape': list(shape)}
+        if copy_from is not None:
+            copy_from.seek(0)
+            while True:
+                data = copy_from.read(1 << 24)
+                if len(data) == 0:
+                    break
+                self.f.write(data)
+        if array is not None:
+            self.f.write(np.ascontiguousarray(array, dtype = dtype).tobytes())
+
+    def start_fired(self, bytes_per_cycle):
+        self._section('fired', np.uint8, (0, bytes_per_cycle))
+
+    def close(self, footer, num_cycles, arrays):
+        self.sections['fired']['shape'][0] = num_cycles
+        for (name, dtype) in self.streams.items():
+            f = self.tmp[name]
+            self._section(name, dtype, (f.tell() // np.dtype(dtype).itemsize,), copy_from = f)
+            f.close()
+            os.remove(f.name)
+        for (name, array) in arrays.items():
+            self._section(name, array.dtype, array.shape, array = array)
+        footer['sections'] = self.sections
+        offset = self.f.tell()
+        self.f.write(json.dumps(footer, sort_keys = True).encode())
+        self.f.seek(0)
+        self.f.write(struct.pack(preamble_format, magic, offset))
+        self.f.close()
+
+def convert(trace, output, block_cycles = 4096, chunk_size = 1 << 26):
+    """Converts a text trace to a store. Returns the number of cycles."""
+    (names, offset) = schedule_analyze.read_legend(trace)
+    if len(names) == 0:
+        raise ValueError('%s does not start with a rule legend' % trace)
+    num_rules = len(names)
+    fire_chars = np.zeros(num_rules, dtype = np.uint8)
+    w = Writer(output)
+    w.start_fired((num_rules + 7) // 8)
+    cycles = 0
+    malformed = 0
+    # per block: number of PC entries and varint bytes of the two PC streams
+    block_counts = [np.zeros(0, dtype = np.int64) for i in range(3)]
+    pc_blocks = []
+    (last_cycle, last_pc, last_block) = (0, 0, -1)
+    for (start, end) in chunk_ranges(trace, offset, chunk_size):
+        arr = np.asarray(np.memmap(trace, dtype = np.uint8, mode = 'r', offset = start, shape = (end - start,)))
+        (chars, pcs, has_pc, bad, insts, has_inst) = schedule_analyze.parse_lines(arr, num_rules, with_insts = True)
+        del arr
+        malformed += bad
+        fired = chars != schedule_analyze.idle_char
+        w.f.write(np.packbits(fired, axis = 1, bitorder = 'little').tobytes())
+        # the first character seen for a rule is its default one
+        for r in np.flatnonzero((fire_chars == 0) & fired.any(axis = 0)):
+            fire_chars[r] = chars[np.argmax(fired[:, r]), r]
+        (exc_cycles, exc_rules) = np.nonzero(fired & (chars != fire_chars))
+        w.write('exc_cycle', (exc_cycles + cycles).astype(np.uint64))
+        w.write('exc_rule', exc_rules.astype(np.uint16))
+        w.write('exc_char', chars[exc_cycles, exc_rules])
+        pc_cycles = (np.flatnonzero(has_pc) + cycles).astype(np.uint64)
+        pcs = pcs[has_pc]
+        blocks = (pc_cycles // np.uint64(block_cycles)).astype(np.int64)
+        (cycle_bytes, cycle_n) = delta_encode(pc_cycles - blocks.astype(np.uint64) * np.uint64(block_cycles), blocks, last_cycle, last_block)
+        (pc_bytes, pc_n) = delta_encode(pcs, blocks, last_pc, last_block)
+        w.write('pc_cycles', cycle_bytes)
+        w.write('pc_values', pc_bytes)
+        num_blocks = (cycles + chars.shape[0] + block_cycles - 1) // block_cycles
+        for (i, weights) in enumerate([None, cycle_n, pc_n]):
+            counts = np.bincount(blocks, weights = weights, minlength = num_blocks).astype(np.int64)
+            grown = np.zeros(num_blocks, dtype = np.int64)
+            grown[:len(block_counts[i])] = block_counts[i]
+            grown[:len(counts)] += counts
+            block_counts[i] = grown
+        if len(pcs) != 0:
+            pc_blocks.append(np.unique(np.stack((pcs, blocks.astype(np.uint64)), axis = 1), axis = 0))
+            (last_cycle, last_pc, last_block) = (int(pc_cycles[-1]) - int(blocks[-1]) * block_cycles, int(pcs[-1]), int(blocks[-1]))
+        w.write('inst_cycle', (np.flatnonzero(has_inst) + cycles).astype(np.uint64))
+        w.write('inst_value', insts[has_inst])
+        cycles += chars.shape[0]
+    # block table and the sparse PC -> blocks index
+    table = np.zeros((len(block_counts[0]) + 1, 3), dtype = np.uint64)
+    for i in range(3):
+        table[1:, i] = np.cumsum(block_counts[i])
+    pairs = np.unique(np.concatenate(pc_blocks), axis = 0) if pc_blocks else np.zeros((0, 2), dtype = np.uint64)
+    (index_pcs, first) = np.unique(pairs[:, 0], return_index = True)
+    index_offsets = np.append(first, len(pairs)).astype(np.uint64)
+    footer = {
+        'version': version,
+        'rules': names,
+        'fire_chars': fire_chars.tobytes().decode('latin-1'),
+        'cycles': cycles,
+        'block_cycles': block_cycles,
+        'malformed_lines': malformed,
+    }
+    w.close(footer, cycles, {'block_table': table, 'index_pcs': index_pcs, 'index_offsets': index_offsets, 'index_blocks': pairs[:, 1].astype(np.uint32)})
+    return cycles
+
+class ScheduleStore:
+    """Memory mapped reader for files written by convert."""
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            (m, offset) = struct.unpack(preamble_format, f.read(struct.calcsize(preamble_format)))
+            if m != magic:
+                raise ValueError('%s is not a schedule store' % filename)
+            f.seek(offset)
+            footer = json.loads(f.read().decode())
+        if footer['version'] != version:
+            raise ValueError('%s is version %d, expected %d' % (filename, footer['version'], version))
+        self.names = footer['rules']
+        self.fire_chars = np.frombuffer(footer['fire_chars'].encode('latin-1'), dtype = np.uint8)
+        self.cycles = footer['cycles']
+        self.block_cycles = footer['block_cycles']
+        self.malformed = footer['malformed_lines']
+        for (name, s) in footer['sections'].items():
+            shape = tuple(s['shape'])
+            if np.prod(shape) == 0:
+                array = np.zeros(shape, dtype = s['dtype'])
+            else:
+                array = np.memmap(filename, dtype = s['dtype'], mode = 'r', offset = s['offset'], shape = shape)
+            setattr(self, name, array)
+
+    def fired_rules(self, start, end):
+        """Returns a (cycles, rules) bool array of the rules fired in [start, end)."""
+        bits = np.unpackbits(np.asarray(self.fired[start:end]), axis = 1, count = len(self.names), bitorder = 'little')
+        return bits.astype(bool)
+
+    def chars(self, start, end):
+        """Returns the (cycles, rules) characters of [start, end) as in the trace."""
+        chars = np.where(self.fired_rules(start, end), self.fire_chars, schedule_analyze.idle_char).astype(np.uint8)
+        lo = np.searchsorted(self.exc_cycle, start)
+        hi = np.searchsorted(self.exc_cycle, end)
+        chars[self.exc_cycle[lo:hi].astype(np.int64) - start, self.exc_rule[lo:hi]] = self.exc_char[lo:hi]
+        return chars
+
+    def _block_pcs(self, block):
+        """Returns (cycles, pcs) of the PC entries in one block."""
+        (e0, c0, p0) = self.block_table[block]
+        (e1, c1, p1) = self.block_table[block + 1]
+        cycles = delta_decode(self.pc_cycles[c0:c1]) + np.uint64(block * self.block_cycles)
+        return (cycles, delta_decode(self.pc_values[p0:p1]))
+
+    def pcs(self, start, end):
+        """Returns (cycles, pcs) of the PC entries in [start, end)."""
+        parts = [self._block_pcs(b) for b in range(start // self.block_cycles, min((end + self.block_cycles - 1) // self.block_cycles, len(self.block_table) - 1))]
+        if len(parts) == 0:
+            return (np.zeros(0, dtype = np.uint64), np.zeros(0, dtype = np.uint64))
+        cycles = np.concatenate([p[0] for p in parts])
+        pcs = np.concatenate([p[1] for p in parts])
+        keep = (cycles >= start) & (cycles < end)
+        return (cycles[keep], pcs[keep])
+
+    def insts(self, start, end):
+        """Returns (cycles, insts) of the DASM fields in [start, end)."""
+        lo = np.searchsorted(self.inst_cycle, start)
+        hi = np.searchsorted(self.inst_cycle, end)
+        return (np.asarray(self.inst_cycle[lo:hi]), np.asarray(self.inst_value[lo:hi]))
+
+    def cycles_of_pc(self, pc):
+        """Returns the cycles at which pc was recorded."""
+        i = np.searchsorted(self.index_pcs, np.uint64(pc))
+        if i == len(self.index_pcs) or self.index_pcs[i] != pc:
+            return np.zeros(0, dtype = np.uint64)
+        parts = []
+        for b in self.index_blocks[self.index_offsets[i]:self.index_offsets[i + 1]]:
+            (cycles, pcs) = self._block_pcs(int(b))
+            parts.append(cycles[pcs == np.uint64(pc)])
+        return np.concatenate(parts)
+
+    def lines(self, start, end):
+        """Returns the trace lines of [start, end) as mkScheduleMonitor wrote them."""
+        end = min(end, self.cycles)
+        chars = self.chars(start, end)
+        pcs = dict(zip(*(x.tolist() for x in self.pcs(start, end))))
+        insts = dict(zip(*(x.tolist() for x in self.insts(start, end))))
+        lines = []
+        for c in range(start, end):
+            line = chars[c - start].tobytes().decode('latin-1')
+            if c in pcs:
+                line += ' 0x%x' % pcs[c]
+            if c in insts:
+                line += ' DASM(0x%x)' % insts[c]
+            lines.append(line)
+        return lines
+
+def self_test(tmp, num_rules = 11, num_cycles = 30000, seed = 0):
+    """Converts a random trace and checks that the store reproduces it.
+
+    Returns the number of mismatches."""
+    rng = np.random.default_rng(seed)
+    names = ['rl_%d' % i for i in range(num_rules)]
+    fire = rng.random((num_cycles, num_rules)) < 0.2
+    chars = np.where(fire, ord('X'), schedule_analyze.idle_char).astype(np.uint8)
+    chars[fire & (rng.random(fire.shape) < 0.05)] = ord('Y')
+    loop = [0x80000000 + 4 * i for i in range(40)]
+    pcs = [loop[c % len(loop)] if fire[c, 0] else (0xffffffff80001000 if c % 997 == 0 else None) for c in range(num_cycles)]
+    insts = [int(rng.integers(0, 1 << 32)) if rng.random() < 0.1 else None for c in range(num_cycles)]
+    trace = os.path.join(tmp, 'sched.txt')
+    with open(trace, 'w') as f:
+        schedule_analyze.write_trace(f, names, chars, pcs, insts)
+    with open(trace) as f:
+        expected = f.read().split('\n')[num_rules:-1]
+    store_file = os.path.join(tmp, 'sched.schedpack')
+    convert(trace, store_file, block_cycles = 512, chunk_size = 8191)
+    s = ScheduleStore(store_file)
+    errors = 0
+    if s.names != names or s.cycles != num_cycles:
+        print('ERROR: store has %d rules and %d cycles' % (len(s.names), s.cycles))
+        return 1
+    if s.lines(0, num_cycles) != expected:
+        print('ERROR: store does not reproduce the trace')
+        errors += 1
+    for start in rng.integers(0, num_cycles, size = 50).tolist():
+        if s.lines(start, start + 7) != expected[start:start + 7]:
+            print('ERROR: lines at cycle %d differ' % start)
+            errors += 1
+    for pc in loop[:5] + [0xffffffff80001000, 0x1234]:
+        if s.cycles_of_pc(pc).tolist() != [c for c in range(num_cycles) if pcs[c] == pc]:
+            print('ERROR: cycles of pc 0x%x differ' % pc)
+            errors += 1
+    print('%d bytes of text, %d bytes stored' % (os.path.getsize(trace), os.path.getsize(store_file)))
+    return errors
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Convert mkScheduleMonitor traces to a columnar store and query it')
+    parser.add_argument('--test', action = 'store_true', help = 'convert a random trace, check that the store reproduces it, and exit')
+    subparsers = parser.add_subparsers(dest = 'command')
+    convert_parser = subparsers.add_parser('convert', help = 'convert a text trace')
+    convert_parser.add_argument('trace', help = 'trace written by mkScheduleMonitor')
+    convert_parser.add_argument('-o', '--output', help = 'store to write (default: TRACE with a .schedpack extension)')
+    convert_parser.add_argument('--block-cycles', type = int, default = 4096, help = 'cycles per PC block (default: %(default)s)')
+    show_parser = subparsers.add_parser('show', help = 'print trace lines starting at a cycle')
+    show_parser.add_argument('store')
+    show_parser.add_argument('cycle', type = int)
+    show_parser.add_argument('-n', '--count', type = int, default = 10, help = 'number of cycles to print (default: %(default)s)')
+    pc_parser = subparsers.add_parser('pc', help = 'print the cycles at which a PC was recorded')
+    pc_parser.add_argument('store')
+    pc_parser.add_argument('pc', type = lambda x: int(x, 0))
+    info_parser = subparsers.add_parser('info', help = 'print the size of each section')
+    info_parser.add_argument('store')
+    args = parser.parse_args()
+
+    if args.test:
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            errors = self_test(tmp)
+        print('%d mismatches' % errors)
+        sys.exit(1 if errors else 0)
+    if args.command is None:
+        parser.print_usage()
+        sys.exit(1)
+    if args.command == 'convert':
+        output = args.output or os.path.splitext(args.trace)[0] + '.schedpack'
+        start = time.perf_counter()
+        try:
+            cycles = convert(args.trace, output, args.block_cycles)
+        except ValueError as e:
+            print('ERROR: %s' % e)
+            sys.exit(1)
+        sys.stderr.write('wrote %s: %d cycles, %d bytes (%.1f%% of the trace) in %.3fs\n' % (output, cycles, os.path.getsize(output), 100.0 * os.path.getsize(output) / max(os.path.getsize(args.trace), 1), time.perf_counter() - start))
+        sys.exit(0)
+    s = ScheduleStore(args.store)
+    if args.command == 'show':
+        for (i, line) in enumerate(s.lines(args.cycle, args.cycle + args.count)):
+            print('%10d %s' % (args.cycle + i, line))
+    elif args.command == 'pc':
+        cycles = s.cycles_of_pc(args.pc)
+        for c in cycles.tolist():
+            print(c)
+        if len(cycles) == 0:
+            sys.exit(1)
+    else:
+        print('%d rules, %d cycles, %d cycles per block' % (len(s.names), s.cycles, s.block_cycles))
+        for name in ['fired', 'exc_cycle', 'exc_rule', 'exc_char', 'pc_cycles', 'pc_values', 'block_table', 'index_pcs', 'index_offsets', 'index_blocks', 'inst_cycle', 'inst_value']:
+            array = getattr(s, name)
+            print('%-14s %12d bytes' % (name, array.nbytes))
@@ -0,0 +1,132 @@
+// generated by gen_BankedSRAM.py using BankedSRAM.mako
+
+// Copyright (c) 2019 Massachusetts Institute of Technology
+
+// Permission is hereby granted, free of charge, to any person
+// obtaining a copy of this software and associated documentation
+// files (the "Software"), to deal in the Software without
+// restriction, including without limitation the rights to use, copy,
+// modify, merge, publish, distribute, sublicense, and/or sell copies
+// of the Software, and to permit persons to whom the Software is
+// furnished to do so, subject to the following conditions:
+
+// The above copyright notice and this permission notice shall be
+// included in all copies or substantial portions of the Software.
+
+// THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+// EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+// MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+// NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+// BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+// ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+// CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+// SOFTWARE.
+
+
+// 2 bank SRAM with 2 read ports and 1 write port
+//
+// Addresses are interleaved across the banks: the low 1 address bits
+// select the bank. Each bank serves one read and one write per cycle. If
+// several ports access the same bank in the same cycle, the lowest numbered
+// port wins and the other requests are dropped. read_conflict_i and
+// write_conflict_i are set in the cycle after a dropped request, along with
+// read_data_i for reads. A concurrent read and write to the same address
+// returns the old data.
+module SRAM_B2_2R1W (
+    input clk,
+    input read_en_0,
+    input [ADDR_SZ-1:0] read_addr_0,
+    output [DATA_SZ-1:0] read_data_0,
+    output read_conflict_0,
+    input read_en_1,
+    input [ADDR_SZ-1:0] read_addr_1,
+    output [DATA_SZ-1:0] read_data_1,
+    output read_conflict_1,
+    input write_en_0,
+    input [ADDR_SZ-1:0] write_addr_0,
+    input [DATA_SZ-1:0] write_data_0,
+    output write_conflict_0
+);
+
+    parameter ADDR_SZ = 9;
+    parameter DATA_SZ = 64;
+    parameter MEM_SZ = 512;
+
+    localparam LOG_BANKS = 1;
+    localparam BANK_MEM_SZ = MEM_SZ / 2;
+
+    reg                  read_conflict_reg_0;
+    reg                  read_conflict_reg_1;
+    reg                  write_conflict_reg_0;
+    reg  [LOG_BANKS-1:0] read_bank_reg_0;
+    reg  [LOG_BANKS-1:0] read_bank_reg_1;
+
+    // bank 0
+    reg [DATA_SZ-1:0] ram_block_0 [BANK_MEM_SZ-1:0];
+    reg [DATA_SZ-1:0] read_data_reg_0;
+
+    wire read_req_0_0 = read_en_0 && (read_addr_0[LOG_BANKS-1:0] == 0);
+    wire read_req_1_0 = read_en_1 && (read_addr_1[LOG_BANKS-1:0] == 0);
+    wire write_req_0_0 = write_en_0 && (write_addr_0[LOG_BANKS-1:0] == 0);
+    wire read_grant_0_0 = read_req_0_0;
+    wire read_grant_1_0 = read_req_1_0 && !(read_req_0_0);
+    wire write_grant_0_0 = write_req_0_0;
+    wire bank_read_en_0 = read_req_0_0 || read_req_1_0;
+    wire [ADDR_SZ-1:0] bank_read_addr_0 = read_req_0_0 ? read_addr_0 : read_addr_1;
+    wire bank_write_en_0 = write_req_0_0;
+    wire [ADDR_SZ-1:0] bank_write_addr_0 = write_addr_0;
+    wire [DATA_SZ-1:0] bank_write_data_0 = write_data_0;
+
+    always @ (posedge clk) begin
+        if (bank_write_en_0 == 1) begin
+            ram_block_0[bank_write_addr_0[ADDR_SZ-1:LOG_BANKS]] <= bank_write_data_0;
+        end
+        if (bank_read_en_0 == 1) begin
+            read_data_reg_0 <= ram_block_0[bank_read_addr_0[ADDR_SZ-1:LOG_BANKS]];
+        end
+    end
+
+    // bank 1
+    reg [DATA_SZ-1:0] ram_block_1 [BANK_MEM_SZ-1:0];
+    reg [DATA_SZ-1:0] read_data_reg_1;
+
+    wire read_req_0_1 = read_en_0 && (read_addr_0[LOG_BANKS-1:0] == 1);
+    wire read_req_1_1 = read_en_1 && (read_addr_1[LOG_BANKS-1:0] == 1);
+    wire write_req_0_1 = write_en_0 && (write_addr_0[LOG_BANKS-1:0] == 1);
+    wire read_grant_0_1 = read_req_0_1;
+    wire read_grant_1_1 = read_req_1_1 && !(read_req_0_1);
+    wire write_grant_0_1 = write_req_0_1;
+    wire bank_read_en_1 = read_req_0_1 || read_req_1_1;
+    wire [ADDR_SZ-1:0] bank_read_addr_1 = read_req_0_1 ? read_addr_0 : read_addr_1;
+    wire bank_write_en_1 = write_req_0_1;
+    wire [ADDR_SZ-1:0] bank_write_addr_1 = write_addr_0;
+    wire [DATA_SZ-1:0] bank_write_data_1 = write_data_0;
+
+    always @ (posedge clk) begin
+        if (bank_write_en_1 == 1) begin
+            ram_block_1[bank_write_addr_1[ADDR_SZ-1:LOG_BANKS]] <= bank_write_data_1;
+        end
+        if (bank_read_en_1 == 1) begin
+            read_data_reg_1 <= ram_block_1[bank_read_addr_1[ADDR_SZ-1:LOG_BANKS]];
+        end
+    end
+
+    // ports
+    always @ (posedge clk) begin
+        if (read_en_0 == 1) begin
+            read_bank_reg_0 <= read_addr_0[LOG_BANKS-1:0];
+        end
+        if (read_en_1 == 1) begin
+            read_bank_reg_1 <= read_addr_1[LOG_BANKS-1:0];
+        end
+        read_conflict_reg_0 <= read_en_0 && !(read_grant_0_0 || read_grant_0_1);
+        read_conflict_reg_1 <= read_en_1 && !(read_grant_1_0 || read_grant_1_1);
+        write_conflict_reg_0 <= write_en_0 && !(write_grant_0_0 || write_grant_0_1);
+    end
+
+    assign read_data_0 = (read_bank_reg_0 == 0) ? read_data_reg_0 : read_data_reg_1;
+    assign read_data_1 = (read_bank_reg_1 == 0) ? read_data_reg_0 : read_data_reg_1;
+    assign read_conflict_0 = read_conflict_reg_0;
+    assign read_conflict_1 = read_conflict_reg_1;
+    assign write_conflict_0 = write_conflict_reg_0;
+endmodule
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Stand-in for bsc for testing CompareProvisosTest.py without bsc.
+#
+# It accepts the bsc command lines CompareProvisosTest.py uses and fails on a
+# file if one of its GT/GTE/LT/LTE/EQ provisos with constant arguments is not
+# satisfied. Use --delay to simulate the time a real compile takes.
+
+import argparse
+import operator
+import re
+import sys
+import time
+
+provisos = {
+        'GT'  : operator.gt,
+        'GTE' : operator.ge,
+        'LT'  : operator.lt,
+        'LTE' : operator.le,
+        'EQ'  : operator.eq
+    }
+
+proviso_re = re.compile(r'\b(GT|GTE|LT|LTE|EQ)#\(\s*(\d+)\s*,\s*(\d+)\s*\)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Pretend to compile bsv files for CompareProvisosTest.py')
+    parser.add_argument('--delay', type = float, default = 0, help = 'seconds to sleep per compile')
+    parser.add_argument('-p', help = 'ignored')
+    parser.add_argument('-bdir', help = 'ignored')
+    parser.add_argument('filename')
+    args = parser.parse_args()
+
+    time.sleep(args.delay)
+    with open(args.filename) as f:
+        text = f.read()
+    failed = False
+    for m in proviso_re.finditer(text):
+        if not provisos[m.group(1)](int(m.group(2)), int(m.group(3))):
+            sys.stderr.write('Error: "%s": proviso %s is not satisfied\n' % (args.filename, m.group(0)))
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 # Copyright (c) 2016 Massachusetts Institute of Technology
 
@@ -22,14 +22,32 @@
 # CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+# Checks that the typeclasses in CompareProvisos.bsv are satisfied exactly
+# when the comparison they stand for is true.
+#
+# Each case is a module with a proviso such as GT#(25,7) that should compile
+# if and only if 25 > 7. Cases are split into jobs that run in a pool of
+# worker processes, and each worker compiles in its own bdir. Cases that
+# should compile are batched into a single file per job; if the batch does
+# not compile, it is bisected to find the failing cases. Cases that should
+# not compile are compiled one at a time since a failed compile does not say
+# which case failed.
+#
+# The compiler command can be replaced, e.g. by CompareProvisosStub.py to
+# test this runner without bsc:
+#   ./CompareProvisosTest.py --compiler './CompareProvisosStub.py' --sweep 50
+
+import argparse
+import multiprocessing
 import operator
 import os
+import random
+import shlex
+import shutil
 import subprocess
 import sys
 import tempfile
-
-# This opens /dev/null for output
-fout = open(os.devnull, 'w')
+import time
 
 provisos = {
         'GT'  : operator.gt,
@@ -47,52 +65,152 @@ values = [
         (3,10)
     ]
 
-print 'Provisos to test and if they should be satisfied:'
-tests = []
-for p in provisos:
-    for (a, b) in values:
-        provisoString = p + '#(%d,%d)' % (a, b)
-        isSatisfied = provisos[p](a, b)
-        print '\t' + provisoString + '\t' + str(isSatisfied)
-        tests = tests + [(provisoString, isSatisfied)]
+compare_provisos_bsv = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'bsv', 'CompareProvisos.bsv')
+
+def make_tests(values):
+    """Returns a (provisoString, isSatisfied) tuple for each proviso and
+    value pair."""
+    tests = []
+    for p in sorted(provisos):
+        for (a, b) in values:
+            tests.append((p + '#(%d,%d)' % (a, b), provisos[p](a, b)))
+    return tests
+
+def test_file_text(cases):
+    """Returns a bsv file with one module per case and a top module that
+    instantiates all of them."""
+    text = "import CompareProvisos::*;\n"
+    text += "(* synthesize *)\n"
+    text += "module mkTest(Empty);\n"
+    for i in range(len(cases)):
+        text += "    let _x%d <- mkModuleWithProviso%d;\n" % (i, i)
+    text += "endmodule\n"
+    for (i, (provisoString, isSatisfied)) in enumerate(cases):
+        text += "module mkModuleWithProviso%d(Empty) provisos (\n" % i
+        text += "    " + provisoString + "\n"
+        text += ");\n"
+        text += "endmodule\n"
+    return text
 
-print "\nRunning tests..."
+# Per worker state set by _init_worker
+_compiler = None
+_bdir = None
+_path = None
 
-# Compile CompareProvisos
-subprocess.Popen(["bsc", "-bdir", "/tmp", "../src/bsv/CompareProvisos.bsv"], stdout=fout, stderr=fout).wait()
+def _init_worker(compiler, tmpdir, common_bdir):
+    global _compiler, _bdir, _path
+    _compiler = compiler
+    _bdir = tempfile.mkdtemp(dir = tmpdir)
+    # CompareProvisos.bo is compiled once by run_tests into common_bdir
+    _path = _bdir + ':' + common_bdir + ':+'
 
-successful = True
-for (provisoString, isSatisfied) in tests:
-    (fd, filename) = tempfile.mkstemp(suffix='.bsv')
+def _compile(cases):
+    """Returns True if a file with all of cases compiles."""
+    (fd, filename) = tempfile.mkstemp(suffix = '.bsv', dir = _bdir)
     try:
-        tfile = os.fdopen(fd, "w")
-        tfile.write("import CompareProvisos::*;\n")
-        tfile.write("(* synthesize *)\n")
-        tfile.write("module mkTest(Empty);\n")
-        tfile.write("    let _x <- mkModuleWithProviso;\n")
-        tfile.write("endmodule\n")
-        tfile.write("module mkModuleWithProviso(Empty) provisos (\n")
-        tfile.write("    " + provisoString + "\n")
-        tfile.write(");\n")
-        tfile.write("endmodule\n")
-        tfile.close()
-        try:
-            subprocess.check_call(["bsc", "-bdir", "/tmp", filename], stdout=fout, stderr=fout)
-            if not isSatisfied:
-                print provisoString + "\tFAILED (compilation successful)"
-                successful = False
-            else:
-                print provisoString + "\tPassed (compilation successful)"
-        except subprocess.CalledProcessError:
-            if isSatisfied:
-                print provisoString + "\tFAILED (compilation failed)"
-                successful = False
-            else:
-                print provisoString + "\tPassed (compilation failed)"
+        with os.fdopen(fd, 'w') as f:
+            f.write(test_file_text(cases))
+        return subprocess.call(_compiler + ['-p', _path, '-bdir', _bdir, filename], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL) == 0
     finally:
         os.remove(filename)
-if not successful:
-    print "\nTEST FAILED"
-    sys.exit(-1)
-else:
-    print "\nAll tests passed!"
+
+def run_job(cases):
+    """Compiles cases and returns ((provisoString, isSatisfied, compiled)
+    for each case, number of compiles)."""
+    results = []
+    compiles = 0
+    # cases that should compile are batched and bisected on failure
+    batches = [[case for case in cases if case[1]]]
+    while len(batches) != 0:
+        batch = batches.pop()
+        if len(batch) == 0:
+            continue
+        compiles += 1
+        if _compile(batch):
+            results += [(provisoString, isSatisfied, True) for (provisoString, isSatisfied) in batch]
+        elif len(batch) == 1:
+            results.append(batch[0] + (False,))
+        else:
+            batches += [batch[:len(batch)//2], batch[len(batch)//2:]]
+    for case in cases:
+        if not case[1]:
+            compiles += 1
+            results.append(case + (_compile([case]),))
+    return (results, compiles)
+
+def run_tests(tests, compiler, jobs = None, batch_size = 32):
+    """Runs tests in a pool of jobs workers and returns (results, compiles).
+
+    Raises subprocess.CalledProcessError or OSError if CompareProvisos.bsv
+    does not compile."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    # spread the cases that cannot be batched evenly over the jobs
+    satisfied = [test for test in tests if test[1]]
+    unsatisfied = [test for test in tests if not test[1]]
+    num_jobs = max(1, (len(satisfied) + batch_size - 1) // batch_size, min(len(unsatisfied), 4 * jobs))
+    job_list = [satisfied[i::num_jobs] + unsatisfied[i::num_jobs] for i in range(num_jobs)]
+    tmpdir = tempfile.mkdtemp(prefix = 'CompareProvisosTest_')
+    try:
+        # compile CompareProvisos.bsv here since a worker initializer that
+        # fails just gets restarted by the pool
+        common_bdir = tempfile.mkdtemp(dir = tmpdir)
+        subprocess.check_call(compiler + ['-bdir', common_bdir, compare_provisos_bsv], stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+        with multiprocessing.Pool(jobs, _init_worker, (compiler, tmpdir, common_bdir)) as pool:
+            results = []
+            compiles = 0
+            for (job_results, job_compiles) in pool.imap_unordered(run_job, job_list):
+                results += job_results
+                compiles += job_compiles
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors = True)
+    order = {test[0]: i for (i, test) in enumerate(tests)}
+    results.sort(key = lambda result: order[result[0]])
+    return (results, compiles)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Test the typeclasses in CompareProvisos.bsv')
+    parser.add_argument('--compiler', default = 'bsc', help = 'compiler command (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of worker processes (default: number of cores)')
+    parser.add_argument('--batch-size', type = int, default = 32, help = 'cases that should compile per compiler call (default: %(default)s)')
+    parser.add_argument('--sweep', metavar = 'N', type = int, default = None, help = 'also test every pair of values below N')
+    parser.add_argument('--random', metavar = 'K', type = int, default = 0, help = 'also test K random pairs of values')
+    parser.add_argument('--max-value', type = int, default = 1000, help = 'largest value for --random (default: %(default)s)')
+    parser.add_argument('--seed', type = int, default = None, help = 'random seed for --random')
+    parser.add_argument('-v', '--verbose', action = 'store_true', help = 'print every case, not just failures')
+    args = parser.parse_args()
+
+    test_values = list(values)
+    if args.sweep is not None:
+        test_values += [(a, b) for a in range(args.sweep) for b in range(args.sweep)]
+    rng = random.Random(args.seed)
+    test_values += [(rng.randint(0, args.max_value), rng.randint(0, args.max_value)) for i in range(args.random)]
+    test_values = sorted(set(test_values), key = test_values.index)
+    tests = make_tests(test_values)
+
+    if args.verbose:
+        print('Provisos to test and if they should be satisfied:')
+        for (provisoString, isSatisfied) in tests:
+            print('\t' + provisoString + '\t' + str(isSatisfied))
+    print('\nRunning %d tests...' % len(tests))
+
+    start = time.perf_counter()
+    try:
+        (results, compiles) = run_tests(tests, shlex.split(args.compiler), args.jobs, args.batch_size)
+    except (subprocess.CalledProcessError, OSError):
+        print('ERROR: could not compile %s with %s' % (compare_provisos_bsv, args.compiler))
+        sys.exit(-1)
+
+    successful = True
+    for (provisoString, isSatisfied, compiled) in results:
+        if compiled != isSatisfied:
+            print(provisoString + '\tFAILED (compilation %s)' % ('successful' if compiled else 'failed'))
+            successful = False
+        elif args.verbose:
+            print(provisoString + '\tPassed (compilation %s)' % ('successful' if compiled else 'failed'))
+    print('%d tests in %d compiles in %.2fs' % (len(results), compiles, time.perf_counter() - start))
+    if not successful:
+        print("\nTEST FAILED")
+        sys.exit(-1)
+    else:
+        print("\nAll tests passed!")
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017 Massachusetts Institute of Technology
+
+# Permission is hereby granted, free of charge, to any person
+# obtaining a copy of this software and associated documentation
+# files (the "Software"), to deal in the Software without
+# restriction, including without limitation the rights to use, copy,
+# modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Builds and runs the bluesim tests listed in the Makefiles of test
+# directories (see Makefile.bluesim), several at a time.
+#
+# A test passes if its simulation exits with status 0 within the timeout and
+# its log contains neither ERROR nor "Property does not hold". Passing tests
+# are remembered in a cache keyed by a hash of the test source, the bsv files
+# it transitively imports or includes, and the build and simulator commands,
+# so they are only rerun when something they depend on changes.
+#
+# The library packages the tests import are compiled once into a shared bdir
+# under build/, and each test is then built in its own bdir under
+# <test dir>/build, with the shared bdir on its search path, so builds can
+# run concurrently without recompiling the library for every test. The
+# compiler and simulator commands are templates where {test} is the test name
+# ("library" for the shared build) and {dir} is the test directory, so
+# stand-ins can be used for hermetic testing, e.g.:
+#   ./RunBluesimTests.py --bsc true --sim 'echo {test} ok' MemUtil
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+tests_path = os.path.dirname(os.path.abspath(__file__))
+src_bsv_path = os.path.join(tests_path, '..', 'src', 'bsv')
+bluecheck_path = os.path.join(tests_path, 'bluecheck')
+
+default_cache = os.path.join(tests_path, '..', 'build', 'bluesim_test_cache.json')
+library_bdir_path = os.path.join(tests_path, '..', 'build', 'bluesim_library')
+
+failure_re = re.compile(r'ERROR|Property does not hold')
+comment_re = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+import_re = re.compile(r'\bimport\s+(\w+)\s*::\s*\*\s*;')
+include_re = re.compile(r'`include\s+"([^"]+)"')
+
+def makefile_tests(test_dir):
+    """Returns the (name, uses bluecheck) pairs listed in TEST_NAME and
+    CHECK_NAME in the Makefile in test_dir."""
+    with open(os.path.join(test_dir, 'Makefile')) as f:
+        text = f.read().replace('\\\n', ' ')
+    tests = []
+    for (variable, bluecheck) in (('TEST_NAME', False), ('CHECK_NAME', True)):
+        m = re.search(r'^%s\s*=(.*)$' % variable, text, re.MULTILINE)
+        if m is not None:
+            tests += [(name, bluecheck) for name in m.group(1).split()]
+    return tests
+
+def dependencies(filename, search_path):
+    """Returns the sorted list of files that filename transitively imports or
+    includes from search_path, including filename itself.
+
+    Imports are followed regardless of `ifdef, so the list may have a few
+    files more than a particular build uses. Packages that are not found in
+    search_path (the Bluespec libraries) are skipped."""
+    seen = set()
+    stack = [os.path.normpath(filename)]
+    while len(stack) != 0:
+        path = stack.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path) as f:
+            text = comment_re.sub('', f.read())
+        names = [name + '.bsv' for name in import_re.findall(text)] + include_re.findall(text)
+        for name in names:
+            for directory in [os.path.dirname(path)] + search_path:
+                candidate = os.path.normpath(os.path.join(directory, name))
+                if os.path.isfile(candidate):
+                    stack.append(candidate)
+                    break
+    return sorted(seen)
+
+def cache_key(files, commands):
+    h = hashlib.sha256()
+    for command in commands:
+        h.update(repr(command).encode() + b'\0')
+    for path in files:
+        with open(path, 'rb') as f:
+            h.update(os.path.basename(path).encode() + b'\0' + hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+def library_bdir(args):
+    """Returns the shared bdir for the library packages built with args.
+
+    bsc -u only compares timestamps, so packages compiled with a different
+    compiler command or flags get a bdir of their own."""
+    h = hashlib.sha256(repr((args.bsc, args.bsc_flags)).encode()).hexdigest()[:12]
+    return os.path.abspath(os.path.join(library_bdir_path, h))
+
+def is_library_file(path):
+    return any(os.path.dirname(os.path.abspath(path)) == os.path.abspath(d) for d in (src_bsv_path, bluecheck_path))
+
+class Test:
+    """A bluesim test and the commands that build and run it."""
+    def __init__(self, test_dir, name, bluecheck, args):
+        self.dir = test_dir
+        self.name = name
+        self.id = os.path.join(os.path.basename(os.path.abspath(test_dir)), name)
+        search_path = [src_bsv_path] + ([bluecheck_path] if bluecheck else [])
+        bdir = os.path.join('build', name)
+        fields = {'test': name, 'dir': test_dir}
+        bsc = shlex.split(args.bsc.format(**fields)) + shlex.split(args.bsc_flags) + ['-p', ':'.join([bdir, library_bdir(args)] + search_path) + ':+', '-bdir', bdir, '-simdir', bdir, '-sim']
+        self.build_commands = [bsc + ['-g', 'mk' + name, '-u', name + '.bsv'], bsc + ['-e', 'mk' + name, '-o', name]]
+        self.sim_command = shlex.split(args.sim.format(**fields))
+        self.log = os.path.join(test_dir, 'run', name + '.log')
+        self.files = dependencies(os.path.join(test_dir, name + '.bsv'), search_path)
+        self.key = cache_key(self.files, self.build_commands + [self.sim_command])
+
+def build_library(tests, args):
+    """Compiles the src/bsv and bluecheck packages that tests import into
+    library_bdir(args).
+
+    Returns (seconds, None) on success and (seconds, compiler output) if a
+    package fails to compile."""
+    start = time.perf_counter()
+    bdir = library_bdir(args)
+    os.makedirs(bdir, exist_ok = True)
+    files = sorted(set(f for test in tests for f in test.files if is_library_file(f)))
+    bsc = shlex.split(args.bsc.format(test = 'library', dir = tests_path)) + shlex.split(args.bsc_flags) + ['-p', ':'.join([bdir, src_bsv_path, bluecheck_path]) + ':+', '-bdir', bdir, '-simdir', bdir, '-sim']
+    for path in files:
+        # -u skips packages that are already up to date, including the ones
+        # compiled for an earlier file in this loop
+        p = subprocess.run(bsc + ['-u', path], stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        if p.returncode != 0:
+            return (time.perf_counter() - start, p.stdout[-4000:])
+    return (time.perf_counter() - start, None)
+
+def run_test(test, timeout):
+    """Builds and runs test and returns a result dict."""
+    result = {'name': test.id, 'status': 'passed', 'message': '', 'build_time': 0.0, 'sim_time': 0.0}
+    os.makedirs(os.path.join(test.dir, 'build', test.name), exist_ok = True)
+    os.makedirs(os.path.dirname(test.log), exist_ok = True)
+    start = time.perf_counter()
+    for command in test.build_commands:
+        p = subprocess.run(command, cwd = test.dir, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        if p.returncode != 0:
+            result['build_time'] = time.perf_counter() - start
+            result['status'] = 'build failed'
+            result['message'] = p.stdout[-4000:]
+            return result
+    result['build_time'] = time.perf_counter() - start
+    start = time.perf_counter()
+    with open(test.log, 'w') as log:
+        try:
+            returncode = subprocess.run(test.sim_command, cwd = test.dir, stdout = log, stderr = subprocess.STDOUT, timeout = timeout).returncode
+        except subprocess.TimeoutExpired:
+            returncode = None
+    result['sim_time'] = time.perf_counter() - start
+    with open(test.log) as log:
+        output = log.read()
+    if returncode is None:
+        result['status'] = 'failed'
+        result['message'] = 'ERROR: test timed out after %gs' % timeout
+    elif returncode != 0:
+        result['status'] = 'failed'
+        result['message'] = 'ERROR: exit code %d' % returncode
+    else:
+        failures = [line for line in output.splitlines() if failure_re.search(line)]
+        if len(failures) != 0:
+            result['status'] = 'failed'
+            result['message'] = '\n'.join(failures[:20])
+    return result
+
+def write_junit(filename, results, elapsed):
+    suite = ET.Element('testsuite', name = 'bluesim', tests = str(len(results)), failures = str(sum(r['status'] != 'passed' and r['status'] != 'cached' for r in results)), skipped = str(sum(r['status'] == 'cached' for r in results)), time = '%.3f' % elapsed)
+    for r in results:
+        case = ET.SubElement(suite, 'testcase', classname = os.path.dirname(r['name']), name = os.path.basename(r['name']), time = '%.3f' % (r['build_time'] + r['sim_time']))
+        if r['status'] == 'cached':
+            ET.SubElement(case, 'skipped', message = 'passed with the same sources before')
+        elif r['status'] != 'passed':
+            ET.SubElement(case, 'failure', message = r['status']).text = r['message']
+    ET.ElementTree(suite).write(filename, encoding = 'utf-8', xml_declaration = True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Build and run bluesim tests concurrently, skipping tests that passed with the same sources')
+    parser.add_argument('test_dirs', metavar = 'DIR', nargs = '*', default = [os.path.join(tests_path, 'MemUtil')], help = 'test directories with a Makefile that includes Makefile.bluesim (default: MemUtil)')
+    parser.add_argument('-t', '--test', action = 'append', default = None, help = 'only run this test (may be repeated)')
+    parser.add_argument('-j', '--jobs', type = int, default = None, help = 'number of tests to build and run at once (default: number of cores)')
+    parser.add_argument('--timeout', type = float, default = 60, help = 'seconds each simulation may run (default: %(default)s)')
+    parser.add_argument('--bsc', default = 'bsc', help = 'compiler command (default: %(default)s)')
+    parser.add_argument('--bsc-flags', default = '', help = 'extra compiler flags, like BSC_FLAGS')
+    parser.add_argument('--sim', default = './{test}', help = 'simulator command run in the test directory (default: %(default)s)')
+    parser.add_argument('--cache', default = default_cache, help = 'cache of passing tests (default: build/bluesim_test_cache.json)')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'run every selected test even if it passed before, keeping the cache entries of the others')
+    parser.add_argument('--junit', metavar = 'FILE', help = 'write a JUnit XML report')
+    parser.add_argument('--json', metavar = 'FILE', help = 'write a JSON report')
+    args = parser.parse_args()
+
+    tests = []
+    for test_dir in args.test_dirs:
+        for (name, bluecheck) in makefile_tests(test_dir):
+            if args.test is None or name in args.test:
+                tests.append(Test(test_dir, name, bluecheck, args))
+
+    # --no-cache only skips the lookup, so the entries of tests that are not
+    # run are kept when the cache is written back
+    cache = {}
+    if os.path.isfile(args.cache):
+        with open(args.cache) as f:
+            cache = json.load(f)
+
+    start = time.perf_counter()
+    results = []
+    to_run = []
+    for test in tests:
+        if not args.no_cache and cache.get(test.id) == test.key:
+            results.append({'name': test.id, 'status': 'cached', 'message': '', 'build_time': 0.0, 'sim_time': 0.0})
+            print('%-45s cached' % test.id)
+        else:
+            to_run.append(test)
+    library_error = None
+    if len(to_run) != 0:
+        (library_time, library_error) = build_library(to_run, args)
+        print('%-45s %-12s build %6.1fs' % ('library', 'failed' if library_error else 'built', library_time))
+    if library_error is not None:
+        # none of the tests can be built
+        for test in to_run:
+            results.append({'name': test.id, 'status': 'build failed', 'message': library_error, 'build_time': 0.0, 'sim_time': 0.0})
+            cache.pop(test.id, None)
+        for line in library_error.splitlines():
+            print('    ' + line)
+        to_run = []
+    with concurrent.futures.ThreadPoolExecutor(args.jobs or os.cpu_count() or 1) as executor:
+        futures = {executor.submit(run_test, test, args.timeout): test for test in to_run}
+        for future in concurrent.futures.as_completed(futures):
+            test = futures[future]
+            result = future.result()
+            results.append(result)
+            print('%-45s %-12s build %6.1fs  sim %6.1fs' % (test.id, result['status'], result['build_time'], result['sim_time']))
+            if result['status'] == 'passed':
+                cache[test.id] = test.key
+            else:
+                cache.pop(test.id, None)
+                for line in result['message'].splitlines():
+                    print('    ' + line)
+    elapsed = time.perf_counter() - start
+    order = {test.id: i for (i, test) in enumerate(tests)}
+    results.sort(key = lambda r: order[r['name']])
+
+    for filename in (args.cache, args.junit, args.json):
+        if filename is not None and os.path.dirname(filename) != '':
+            os.makedirs(os.path.dirname(filename), exist_ok = True)
+    with open(args.cache, 'w') as f:
+        json.dump(cache, f, indent = 1, sort_keys = True)
+    if args.junit is not None:
+        write_junit(args.junit, results, elapsed)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump({'elapsed': elapsed, 'tests': results}, f, indent = 1)
+
+    failed = [r['name'] for r in results if r['status'] not in ('passed', 'cached')]
+    print('%d passed, %d cached, %d failed in %.1fs' % (sum(r['status'] == 'passed' for r in results), sum(r['status'] == 'cached' for r in results), len(failed), elapsed))
+    if len(failed) != 0:
+        print('ERROR: failed tests: %s' % ' '.join(failed))
+        sys.exit(1)
+    print('All tests passed')